@@ -135,6 +135,18 @@ def set_fingerprint(parent):
     return new_action(parent, 'Fingerprint', icon_name='fingerprint.png', slot=parent.set_fingerprint)
 
 
+def toggle_metrics(parent):
+    return new_action(parent, 'PSNR / SSIM', shortcut='F7', slot=parent.toggle_metrics)
+
+
+def toggle_diff(parent):
+    return new_action(parent, 'Difference Heatmap', shortcut='F8', slot=parent.toggle_diff)
+
+
+def sort_by_metric_gap(parent):
+    return new_action(parent, 'Sort by Metric Gap', slot=parent.sort_by_metric_gap)
+
+
 # ---------------------------------------
 # auto zoom
 # ---------------------------------------
@@ -142,5 +154,61 @@ def auto_zoom(parent):
     return new_action(parent, 'Auto Zoom', icon_name='auto_zoom.png', slot=parent.auto_zoom)
 
 
+def toggle_patch_preview(parent):
+    return new_action(parent, 'Patch Preview', shortcut='F4', slot=parent.toggle_patch_preview)
+
+
+def toggle_roi_stats(parent):
+    return new_action(parent, 'ROI Statistics', shortcut='F3', slot=parent.toggle_roi_stats)
+
+
+def cycle_hover_neighborhood(parent):
+    return new_action(parent, 'Hover Neighborhood', shortcut='F2', slot=parent.cycle_hover_neighborhood)
+
+
+def toggle_pixel_values(parent):
+    return new_action(parent, 'Pixel Values', shortcut='F10', slot=parent.toggle_pixel_values)
+
+
+def increase_exposure(parent):
+    return new_action(parent, 'Exposure +', shortcut='E', slot=parent.increase_exposure)
+
+
+def decrease_exposure(parent):
+    return new_action(parent, 'Exposure -', shortcut='Shift+E', slot=parent.decrease_exposure)
+
+
+def toggle_display_gamma(parent):
+    return new_action(parent, 'Display Gamma', shortcut='G', slot=parent.toggle_display_gamma)
+
+
+def next_channel_mode(parent):
+    return new_action(parent, 'Next Channel', shortcut='X', slot=parent.next_channel_mode)
+
+
+def previous_channel_mode(parent):
+    return new_action(parent, 'Previous Channel', shortcut='Shift+X', slot=parent.previous_channel_mode)
+
+
+def toggle_wipe_compare(parent):
+    return new_action(parent, 'Wipe Compare', shortcut='W', slot=parent.toggle_wipe_compare)
+
+
+def toggle_flicker_compare(parent):
+    return new_action(parent, 'Flicker Compare', shortcut='Shift+W', slot=parent.toggle_flicker_compare)
+
+
+def toggle_playback(parent):
+    return new_action(parent, 'Play / Stop', shortcut='P', slot=parent.toggle_playback)
+
+
+def set_playback_fps(parent):
+    return new_action(parent, 'Playback FPS', slot=parent.set_playback_fps)
+
+
+def set_array_layout(parent):
+    return new_action(parent, 'Array / YUV Layout', slot=parent.set_array_layout)
+
+
 def auto_zoom_dialog(parent):
     return new_action(parent, 'Auto Zoom', icon_name='auto_zoom.png', slot=parent.auto_zoom_dialog)
@@ -0,0 +1,280 @@
+"""
+Batch metrics: PSNR / SSIM of the images in compare folders against the reference folder, over a whole
+validation set, with per-image results, folder means and CSV / JSON reports.
+
+Per-image results are kept in a json cache in the user cache dir, keyed by the image paths, options and file mtimes,
+so that only new or modified images are evaluated again.
+"""
+import csv
+import json
+import numpy as np
+import os
+import time
+from PIL import Image
+
+from handyview.crop import align_folders, get_folder_names, run_in_pool
+from handyview.hdr import read_high_bit_depth, to_metric_range
+from handyview.metrics import calculate_psnr, calculate_ssim
+from handyview.sources import getmtime, open_file
+from handyview.utils import CACHE_DIR
+
+METRICS_CACHE_PATH = os.path.join(CACHE_DIR, 'metrics_cache.json')
+METRIC_NAMES = ('psnr', 'ssim')
+
+
+def read_array(path):
+    """Decode an image (also for virtual paths) to a (h, w, 3) uint8 RGB array.
+
+    High bit-depth and HDR images keep their original values, scaled to [0, 255] (see hdr.to_metric_range).
+    """
+    raw = read_high_bit_depth(path)
+    if raw is not None:
+        return to_metric_range(raw)
+    with open_file(path) as f:
+        return np.asarray(Image.open(f).convert('RGB'))
+
+
+def evaluate_image(ref_path, paths, crop_border=0, test_y_channel=False):
+    """PSNR / SSIM of images against a reference image. The reference image is decoded once.
+
+    Args:
+        ref_path (str): Reference image path.
+        paths (list[str]): Image paths.
+        crop_border (int): Pixels cropped from each border. Default: 0.
+        test_y_channel (bool): Whether to test on the Y channel. Default: False.
+
+    Returns:
+        list[dict]: psnr and ssim for each image. They are None if the image has a different shape.
+    """
+    ref = read_array(ref_path)
+    results = []
+    for path in paths:
+        img = read_array(path)
+        if img.shape != ref.shape:
+            results.append(dict(psnr=None, ssim=None))
+            continue
+        results.append(
+            dict(
+                psnr=calculate_psnr(ref, img, crop_border, test_y_channel),
+                ssim=calculate_ssim(ref, img, crop_border, test_y_channel)))
+    return results
+
+
+class MetricsCache():
+    """Per-image metrics persisted in a json file.
+
+    Entries are kept in the order of their last use, and the least recently used ones are dropped when saving, so
+    that the file does not grow with every evaluated validation set.
+
+    Args:
+        cache_path (str): Path of the json file. None for metrics_cache.json in the cache dir. Default: None.
+        max_entries (int): Maximum number of entries kept in the file. Default: 100000.
+    """
+
+    def __init__(self, cache_path=None, max_entries=100000):
+        self.cache_path = cache_path or METRICS_CACHE_PATH
+        self.max_entries = max_entries
+        self._cache = {}
+        if os.path.exists(self.cache_path):
+            try:
+                with open(self.cache_path, 'r', encoding='utf-8') as f:
+                    self._cache = json.load(f)
+            except ValueError:
+                # a broken cache is rebuilt
+                self._cache = {}
+
+    @staticmethod
+    def get_key(ref_path, path, crop_border, test_y_channel):
+        return f'{ref_path}|{path}|{crop_border}|{int(test_y_channel)}'
+
+    def get(self, key, mtimes):
+        entry = self._cache.get(key)
+        if entry is None or entry['mtimes'] != list(mtimes):
+            return None
+        # move to the end as the most recently used
+        self._cache[key] = self._cache.pop(key)
+        return {name: entry[name] for name in METRIC_NAMES}
+
+    def put(self, key, mtimes, result):
+        self._cache.pop(key, None)
+        self._cache[key] = dict(result, mtimes=list(mtimes))
+
+    def save(self):
+        num_dropped = len(self._cache) - self.max_entries
+        if num_dropped > 0:
+            for key in list(self._cache)[:num_dropped]:
+                del self._cache[key]
+        os.makedirs(os.path.dirname(os.path.abspath(self.cache_path)), exist_ok=True)
+        # write to a temporary file first, so that an interrupted save does not break the cache
+        tmp_path = f'{self.cache_path}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self._cache, f)
+        os.replace(tmp_path, self.cache_path)
+
+
+def _get_mtime(path):
+    try:
+        return getmtime(path)
+    except OSError:
+        return None
+
+
+def evaluate_folders(path_lists,
+                     crop_border=0,
+                     test_y_channel=False,
+                     align='index',
+                     folders=None,
+                     num_workers=None,
+                     cache_path=None,
+                     use_cache=True,
+                     progress_callback=None):
+    """Evaluate PSNR / SSIM of compare folders against the reference folder.
+
+    Images are evaluated in a process pool, one task for each reference image (which is decoded once for all the
+    compare folders). Only the images that are not in the cache (or have been modified) are evaluated.
+
+    Args:
+        path_lists (list[list[str]]): Image paths of each folder. The first folder is the reference.
+        crop_border (int): Pixels cropped from each border. Default: 0.
+        test_y_channel (bool): Whether to test on the Y channel. Default: False.
+        align (str): Align mode, see crop.align_folders. Default: 'index'.
+        folders (list[str]): Folders, for the report. None for the folders of the first images. Default: None.
+        num_workers (int): Number of worker processes. None for the number of CPU cores. Images are evaluated in
+            the current process when num_workers <= 1. Default: None.
+        cache_path (str): Path of the metrics cache. See MetricsCache. Default: None.
+        use_cache (bool): Whether to read and update the metrics cache. Default: True.
+        progress_callback (func): Called after each evaluated reference image with (num_done, num_total, results).
+            Default: None.
+
+    Returns:
+        dict: Report. 'images' has the name, paths and metrics (one value for each compare folder) of each image.
+            'mean' has the mean metrics of each compare folder, skipping images with different shapes.
+    """
+    start_time = time.time()
+    path_lists = align_folders(path_lists, align)
+    if folders is None:
+        folders = [os.path.dirname(paths[0]) if paths else '' for paths in path_lists]
+    cache = MetricsCache(cache_path) if use_cache else None
+
+    # results[image index][folder index - 1]
+    results = [[None] * (len(path_lists) - 1) for _ in path_lists[0]]
+    tasks, task_infos = [], []
+    for idx, ref_path in enumerate(path_lists[0]):
+        ref_mtime = _get_mtime(ref_path)
+        todo = []
+        for fidx, paths in enumerate(path_lists[1:]):
+            key = MetricsCache.get_key(ref_path, paths[idx], crop_border, test_y_channel)
+            mtimes = (ref_mtime, _get_mtime(paths[idx]))
+            result = cache.get(key, mtimes) if cache is not None else None
+            if result is None:
+                todo.append((fidx, key, mtimes))
+            else:
+                results[idx][fidx] = result
+        if todo:
+            kwargs = dict(
+                paths=[path_lists[fidx + 1][idx] for fidx, _, _ in todo],
+                crop_border=crop_border,
+                test_y_channel=test_y_channel)
+            tasks.append((ref_path, kwargs))
+            task_infos.append((idx, todo))
+
+    if num_workers is None:
+        num_workers = os.cpu_count() or 1
+    num_workers = min(num_workers, len(tasks))
+    if num_workers > 1:
+        task_results = run_in_pool(evaluate_image, tasks, num_workers, progress_callback)
+    else:
+        task_results = []
+        for ref_path, kwargs in tasks:
+            task_results.append(evaluate_image(ref_path, **kwargs))
+            if progress_callback is not None:
+                progress_callback(len(task_results), len(tasks), task_results[-1])
+
+    for (idx, todo), task_result in zip(task_infos, task_results):
+        for (fidx, key, mtimes), result in zip(todo, task_result):
+            results[idx][fidx] = result
+            if cache is not None:
+                cache.put(key, mtimes, result)
+    if cache is not None and tasks:
+        cache.save()
+
+    images = []
+    for idx, ref_path in enumerate(path_lists[0]):
+        image = dict(
+            name=os.path.splitext(os.path.basename(ref_path))[0],
+            ref_path=ref_path,
+            paths=[paths[idx] for paths in path_lists[1:]])
+        for name in METRIC_NAMES:
+            image[name] = [result[name] for result in results[idx]]
+        images.append(image)
+    mean = {}
+    for name in METRIC_NAMES:
+        mean[name] = []
+        for fidx in range(len(path_lists) - 1):
+            values = [image[name][fidx] for image in images if image[name][fidx] is not None]
+            mean[name].append(float(np.mean(values)) if values else None)
+    num_pairs = len(path_lists[0]) * (len(path_lists) - 1)
+    num_evaluated = sum(len(todo) for _, todo in task_infos)
+    return dict(
+        reference=folders[0],
+        folders=folders[1:],
+        crop_border=crop_border,
+        test_y_channel=test_y_channel,
+        images=images,
+        mean=mean,
+        num_evaluated=num_evaluated,
+        num_cached=num_pairs - num_evaluated,
+        time=time.time() - start_time)
+
+
+def get_metric_gaps(report, metric='psnr', fidx=0, other_fidx=None):
+    """Gap of a metric between a compare folder and another one, for each image. Failure cases have small gaps.
+
+    Args:
+        report (dict): Report of evaluate_folders.
+        metric (str): psnr | ssim. Default: 'psnr'.
+        fidx (int): Index of the compare folder (0 for the first compare folder). Default: 0.
+        other_fidx (int): Index of the other compare folder. None for the best of the other compare folders, or the
+            mean of the compare folder when there is only one compare folder. Default: None.
+
+    Returns:
+        list[float]: Gap for each image. None if the metric is missing.
+    """
+    gaps = []
+    for image in report['images']:
+        values = image[metric]
+        if other_fidx is not None:
+            others = [values[other_fidx]]
+        elif len(values) > 1:
+            others = [value for idx, value in enumerate(values) if idx != fidx and value is not None]
+        else:
+            others = [report['mean'][metric][fidx]]
+        if values[fidx] is None or not others or None in others:
+            gaps.append(None)
+        else:
+            gaps.append(values[fidx] - max(others))
+    return gaps
+
+
+def sort_by_gap(gaps):
+    """Image indices sorted by gaps, in ascending order (failure cases first). Missing gaps are at the end."""
+    return sorted(range(len(gaps)), key=lambda idx: (gaps[idx] is None, gaps[idx] if gaps[idx] is not None else 0))
+
+
+def write_csv(report, csv_path):
+    """Write a report as CSV: one row for each image, and a last row of means."""
+    names = get_folder_names(report['folders'])
+    with open(csv_path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(['image'] + [f'{name}_{metric}' for name in names for metric in METRIC_NAMES])
+        for image in report['images']:
+            writer.writerow([image['name']] +
+                            [image[metric][fidx] for fidx in range(len(names)) for metric in METRIC_NAMES])
+        writer.writerow(['mean'] +
+                        [report['mean'][metric][fidx] for fidx in range(len(names)) for metric in METRIC_NAMES])
+
+
+def write_json(report, json_path):
+    """Write a report as json. PSNR of identical images is written as Infinity."""
+    with open(json_path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
@@ -1,14 +1,24 @@
 import os
 from PyQt5 import QtCore
+from PyQt5.QtCore import QTimer
 from PyQt5.QtGui import QColor, QImage, QPainter, QPen, QPixmap
 from PyQt5.QtWidgets import QApplication, QGridLayout, QSplitter, QWidget
 
-from handyview.view_scene import HVScene, HVView
+from handyview.channels import extract_channel
+from handyview.hover_inspector import HoverInspector
+from handyview.image_cache import array_to_qimage, get_image_cache, qimage_to_argb
+from handyview.image_loader import get_image_loader
+from handyview.metrics import PairCache, compare_images, diff_heatmap
+from handyview.playback import FramePlayer
+from handyview.sources import is_virtual_path
+from handyview.view_scene import HVScene, HVView, WipeItem
 from handyview.widgets import ColorLabel, HVLable, show_msg
 
 
 class Canvas(QWidget):
     """Main canvas"""
+    # emitted after showing images
+    image_changed = QtCore.pyqtSignal()
 
     def __init__(self, parent, db, num_view=1):
         super(Canvas, self).__init__()
@@ -20,6 +30,26 @@ class Canvas(QWidget):
         self.init_widgets_layout()
         self.qview_bg_color = 'white'
         self.show_fingerprint = False
+        # PSNR / SSIM and difference heatmaps against the reference (first) folder, in compare mode
+        self.show_metrics = False
+        self.show_diff = False
+        self.metrics_cache = PairCache(max_items=1024)
+        self.diff_cache = PairCache(max_items=8)
+        # channel views (the mode is in db), keyed by the image path and mode
+        self.channel_cache = PairCache(max_items=16)
+        # in-view compare with another folder: None, 'wipe' or 'flicker'
+        self.inview_compare = None
+        self.wipe_ratio = 0.5
+        # flicker swaps the pixmap of the shown item, without showing images again
+        self.flicker_item = None
+        self.flicker_pixmaps = []
+        self.flicker_names = []
+        self.flicker_idx = 0
+        self.flicker_timer = QTimer(self)
+        self.flicker_timer.setInterval(500)
+        self.flicker_timer.timeout.connect(self.flicker)
+        # pixel values on pixels at high zoom ratios
+        self.show_pixel_values = True
 
         # set bg color to light_gray when num_view > 1
         if self.num_view > 1:
@@ -28,6 +58,21 @@ class Canvas(QWidget):
         # for auto zoom ratio
         self.target_zoom_width = 0
 
+        # browsing by key auto-repeats and wheel scrolls is shown once per display frame
+        rate = QApplication.primaryScreen().refreshRate() if QApplication.primaryScreen() else 60
+        self.browse_timer = QTimer(self)
+        self.browse_timer.setSingleShot(True)
+        self.browse_timer.setInterval(max(1, int(1000 / max(rate, 1))))
+        self.browse_timer.timeout.connect(self.show_image)
+        # playback of the path list at a fixed frame rate
+        self.player = FramePlayer(self, fps=self.db.playback_fps)
+        # images are loaded asynchronously. (paths, init) of the show waiting for loading
+        self.pending_show = None
+        self.shown_paths = set()
+        self.qimg = QImage()
+        self.img_path = self.db.get_path()[0]
+        get_image_loader().loaded.connect(self.on_image_loaded)
+        get_image_loader().failed.connect(self.on_image_failed)
         self.show_image(init=True)
 
     def init_widgets_layout(self):
@@ -55,6 +100,11 @@ class Canvas(QWidget):
             # pixel color at the mouse position
             self.mouse_color_title = HVLable('RGBA:', self, 'black', 'Times', 12)
             self.mouse_color_label = ColorLabel(color=(255, 255, 255))
+            # pixel values of the neighborhood at the mouse position
+            self.mouse_neighbor_label = HVLable('', self, 'black', 'Courier', 10)
+            # updates the labels above, coalesced to the display refresh rate
+            self.hover_inspector = HoverInspector(self.mouse_pos_label, self.mouse_color_label, self.mouse_rgb_label,
+                                                  self.mouse_neighbor_label)
 
             # selection rectangle position and length
             selection_pos_text = ('Rect Pos: (H, W)\n Start: 0, 0\nEnd  : 0, 0\n Len  : 0, 0')
@@ -119,8 +169,13 @@ class Canvas(QWidget):
                 # copy image to clipboard
                 clipboard = QApplication.clipboard()
                 mime_data = QtCore.QMimeData()
-                full_path = os.path.abspath(self.img_path)
-                mime_data.setUrls([QtCore.QUrl(f'file:///{full_path}')])
+                if is_virtual_path(self.img_path):
+                    # there is no file on disk for images in archives, copy the image data instead.
+                    # A deep copy, as cached images may share the memory of numpy arrays
+                    mime_data.setImageData(self.qimg.copy())
+                else:
+                    full_path = os.path.abspath(self.img_path)
+                    mime_data.setUrls([QtCore.QUrl(f'file:///{full_path}')])
                 clipboard.setMimeData(mime_data)
             else:
                 self.compare_folders(1)
@@ -136,24 +191,24 @@ class Canvas(QWidget):
 
         elif event.key() == QtCore.Qt.Key_Space:
             if modifiers == QtCore.Qt.ShiftModifier:
-                self.dir_browse(10)
+                self.dir_browse(10, coalesce=event.isAutoRepeat())
             else:
-                self.dir_browse(1)
+                self.dir_browse(1, coalesce=event.isAutoRepeat())
         elif event.key() == QtCore.Qt.Key_Backspace:
             if modifiers == QtCore.Qt.ShiftModifier:
-                self.dir_browse(-10)
+                self.dir_browse(-10, coalesce=event.isAutoRepeat())
             else:
-                self.dir_browse(-1)
+                self.dir_browse(-1, coalesce=event.isAutoRepeat())
         elif event.key() == QtCore.Qt.Key_Right:
             if modifiers == QtCore.Qt.ShiftModifier:
-                self.dir_browse(10)
+                self.dir_browse(10, coalesce=event.isAutoRepeat())
             else:
-                self.dir_browse(1)
+                self.dir_browse(1, coalesce=event.isAutoRepeat())
         elif event.key() == QtCore.Qt.Key_Left:
             if modifiers == QtCore.Qt.ShiftModifier:
-                self.dir_browse(-10)
+                self.dir_browse(-10, coalesce=event.isAutoRepeat())
             else:
-                self.dir_browse(-1)
+                self.dir_browse(-1, coalesce=event.isAutoRepeat())
 
         elif event.key() == QtCore.Qt.Key_Up:
             if modifiers == QtCore.Qt.ShiftModifier:  # quickly zoom in all qviews
@@ -188,7 +243,11 @@ class Canvas(QWidget):
         self.show_image()
 
     def add_cmp_folder(self, cmp_path):
-        is_same_len, img_len_list = self.db.add_cmp_folder(cmp_path)
+        try:
+            is_same_len, img_len_list = self.db.add_cmp_folder(cmp_path)
+        except ValueError as error:
+            show_msg('Warning', 'Warning!', f'Cannot add {cmp_path}:\n{error}')
+            return
         show_str = 'Number for each folder:\n\t' + '\n\t'.join(map(str, img_len_list))
         self.comparison_label.setText(show_str)
         if is_same_len is False:
@@ -216,7 +275,95 @@ class Canvas(QWidget):
             else:
                 self.comparison_label.setStyleSheet('QLabel {color : black;}')
 
+    def get_needed_paths(self, pidx=None):
+        """Paths of the images needed for showing: the images in views, the reference image for metrics and
+        difference heatmaps, and the compared image of in-view compare.
+
+        Args:
+            pidx (int): Path index. Default: None, for the current index.
+        """
+        if pidx is None:
+            pidx = self.db.pidx
+        interval_mode = (self.db.get_folder_len() == 1)
+        paths = []
+        for idx in range(self.num_view):
+            if interval_mode:
+                paths.append(self.db.get_path(pidx=pidx + idx)[0])
+            else:
+                paths.append(self.db.get_path(fidx=self.db.fidx + idx, pidx=pidx)[0])
+        if not interval_mode:
+            if self.show_metrics or self.show_diff:
+                paths.append(self.db.get_path(fidx=0, pidx=pidx)[0])
+            if self.inview_compare is not None and self.num_view == 1:
+                paths.append(self.db.get_path(fidx=0 if self.db.fidx != 0 else 1, pidx=pidx)[0])
+        return list(dict.fromkeys(paths))
+
     def show_image(self, init=False):
+        """Show the current images.
+
+        Images are loaded by the image loader in workers. If they are not loaded yet, the last shown images are kept
+        with a loading indicator, and the images are shown once they are loaded. Shown images are also validated
+        in workers, and shown again if their files have been modified.
+        """
+        if self.player.playing:
+            # browsing (or changing the view) stops playback
+            self.player.stop()
+        paths = self.get_needed_paths()
+        loader = get_image_loader()
+        # queued loads of the images that are browsed over are cancelled
+        loader.set_wanted(paths)
+        loader.request(paths, self.show_fingerprint)
+        if self.pending_show is not None:
+            # keep the initial zoom of a pending initial show
+            init = init or self.pending_show[1]
+        if all(loader.is_ready(path, self.show_fingerprint) for path in paths):
+            self.show_loaded_image(paths, init)
+        else:
+            self.pending_show = (paths, init)
+            self.show_loading(paths)
+
+    def show_loading(self, paths, error=None):
+        """Show a loading indicator (or an error) on the last shown images."""
+        lines = []
+        for path in paths:
+            if not get_image_loader().is_ready(path, self.show_fingerprint):
+                status = 'Loading ...' if error is None else error
+                lines.append(f'{os.path.basename(path)}: {status}')
+        self.parent.set_statusbar(f'{paths[0]} (loading)' if error is None else f'{paths[0]} ({error})')
+        for qview in self.qviews:
+            # the loading lines are kept under the text of the shown images
+            shown_text = [text for text in qview.shown_text or [] if not text.startswith('Loading: ')]
+            qview.set_shown_text(shown_text + [f'Loading: {line}' for line in lines], 'red')
+            qview.viewport().update()
+
+    def on_image_loaded(self, path, changed):
+        loader = get_image_loader()
+        if self.pending_show is not None:
+            paths, init = self.pending_show
+            if path not in paths:
+                return
+            if all(loader.is_ready(path, self.show_fingerprint) for path in paths):
+                self.show_loaded_image(paths, init)
+            else:
+                # e.g., fingerprints are toggled on while loading
+                loader.request([path for path in paths if not loader.is_loading(path)], self.show_fingerprint)
+        elif changed and path in self.shown_paths:
+            # the file has been modified
+            self.show_image()
+
+    def on_image_failed(self, path, error):
+        pending = self.pending_show is not None and path in self.pending_show[0]
+        if pending:
+            self.show_loading(self.pending_show[0], error)
+        # failed decodes (e.g., missing files, or hdr images without OpenCV) of the wanted images are reported once,
+        # rather than on every redraw. Timeouts are only shown by the loading indicator
+        if (pending or path in self.shown_paths) and get_image_cache().errors.get(path) == error:
+            show_msg('Critical', 'Critical', f'Cannot open {path}: {error}')
+
+    def show_loaded_image(self, paths, init=False):
+        """Show the current images, which have been loaded into the image cache."""
+        self.pending_show = None
+        self.shown_paths = set(paths)
         interval_mode = (self.db.get_folder_len() == 1)
         for idx, qscene in enumerate(self.qscenes):
             qview = self.qviews[idx]
@@ -230,8 +377,8 @@ class Canvas(QWidget):
                     md5, phash = self.db.get_fingerprint(pidx=pidx)
                     md5_0, phash_0 = self.db.get_fingerprint(pidx=self.db.pidx)
             else:
-                fidx = self.db.fidx + idx
-                img_path = self.db.get_path(fidx=fidx)[0]
+                img_path, fidx, _ = self.db.get_path(fidx=self.db.fidx + idx)
+                ref_path = self.db.get_path(fidx=0)[0]
                 width, height = self.db.get_shape(fidx=fidx)
                 file_size = self.db.get_file_size(fidx=fidx)
                 color_type = self.db.get_color_type(fidx=fidx)
@@ -239,17 +386,20 @@ class Canvas(QWidget):
                     md5, phash = self.db.get_fingerprint(fidx=fidx)
                     md5_0, phash_0 = self.db.get_fingerprint(fidx=self.db.fidx)
 
-            qimg = QImage(img_path)
+            # decoded images are cached, and shared with other panels
+            qimg = get_image_cache().get(img_path)
             self.img_path = img_path
             if idx == 0:
-                # for HVView, HVScene show_mouse_color.
+                # for the hover inspector of HVView, HVScene.
                 # only work on the first qimg (main canvas mode)
                 self.qimg = qimg
+                if self.num_view == 1:
+                    self.hover_inspector.set_image(qimg, get_image_cache().get_raw(img_path))
                 # show image path in the statusbar
                 self.parent.set_statusbar(f'{img_path}')
 
             # --------------- auto zoom scale ratio -------------------
-            if self.target_zoom_width > 0:
+            if self.target_zoom_width > 0 and not qimg.isNull():
                 qview.set_zoom(self.target_zoom_width / qimg.width())
             # --------------- end of auto zoom scale ratio -------------------
 
@@ -275,16 +425,43 @@ class Canvas(QWidget):
                 f'[{shown_idx:d} / {self.db.get_path_len():d}] {tail}', head, f'{height:d} x {width:d}, {file_size}',
                 f'{color_type}'
             ]
+            if img_path in get_image_cache().errors:
+                # e.g., loaded in advance, and the failure is not reported
+                shown_text.append(f'Cannot open: {get_image_cache().errors[img_path]}')
+            if get_image_cache().get_raw(img_path) is not None:
+                exposure, gamma = get_image_cache().tone_mapping
+                shown_text.append(f'Tone mapping: exposure {exposure:+.1f}, gamma {gamma:g}')
             # show fingerprint
             if self.show_fingerprint:
                 if idx > 0:
                     md5_diff = (md5 == md5_0)
-                    phash_diff = phash - phash_0
+                    # None for images that failed to load
+                    phash_diff = phash - phash_0 if phash is not None and phash_0 is not None else None
                     shown_text.append(f'md5: {md5_diff} - {md5}')
                     shown_text.append(f'phash: {phash_diff} - {phash}')
                 else:
                     shown_text.append(f'md5: {md5}')
                     shown_text.append(f'phash: {phash}')
+            shown_qimg = qimg
+            if self.db.channel_mode != 'RGB':
+                shown_qimg = self.get_channel_qimage(img_path, qimg)
+                shown_text.append(f'Channel: {self.db.channel_mode}')
+            # show metrics against the reference folder
+            if not interval_mode and fidx > 0:
+                if self.show_metrics:
+                    metrics = self.get_metrics(ref_path, img_path)
+                    if metrics:
+                        shown_text.append(f'PSNR: {metrics["psnr"]:.2f} dB (Y: {metrics["psnr_y"]:.2f} dB)')
+                        shown_text.append(f'SSIM: {metrics["ssim"]:.4f} (Y: {metrics["ssim_y"]:.4f})')
+                    else:
+                        shown_text.append('PSNR / SSIM: different shape from the reference')
+                if self.show_diff:
+                    heatmap = self.get_diff_qimage(ref_path, img_path)
+                    if heatmap is not None:
+                        shown_qimg = heatmap
+                        shown_text.append('Difference heatmap (x4)')
+            elif not interval_mode and (self.show_metrics or self.show_diff):
+                shown_text.append('Reference')
 
             if qview.hasFocus():
                 color = 'red'
@@ -292,7 +469,7 @@ class Canvas(QWidget):
                 color = 'green'
             qview.set_shown_text(shown_text, color)
             # qview.viewport().update()
-            qpixmap = QPixmap.fromImage(qimg)
+            qpixmap = QPixmap.fromImage(shown_qimg)
 
             # draw border
             if not interval_mode and len(self.qscenes) == 1 and self.db.fidx == 0:  # compare mode, the main image
@@ -303,8 +480,12 @@ class Canvas(QWidget):
                 painter.drawRect(0, 0, qpixmap.width(), qpixmap.height())
                 painter.end()
 
+            qview.pixel_overlay.set_image(shown_qimg)
             qscene.clear()
-            qscene.addPixmap(qpixmap)
+            pixmap_item = qscene.addPixmap(qpixmap)
+            qview.wipe_item = None
+            if self.inview_compare is not None and self.num_view == 1 and not interval_mode:
+                self.add_inview_compare(qview, pixmap_item)
             qscene.set_width_height(width, height)
             # put image always in the center of a QGraphicsView
             qscene.setSceneRect(0, 0, width, height)
@@ -332,16 +513,141 @@ class Canvas(QWidget):
             self.exclude_names_label.setText(show_str)
 
         if init:
-            if width < 500:
+            if 0 < width < 500:
                 self.qviews[0].set_zoom(500 // width)
             else:
                 self.qviews[0].set_zoom(1)
         for qview in self.qviews:
             qview.set_transform()
+        self.image_changed.emit()
+
+    def get_metrics(self, ref_path, img_path):
+        """PSNR / SSIM (RGB and Y channel) of an image against the reference, cached for the image pair.
+
+        Returns:
+            dict: Metrics. Empty if the images have different shapes.
+        """
+        cache = get_image_cache()
+        mtimes = (cache.get_entry(ref_path).mtime, cache.get_entry(img_path).mtime)
+        metrics = self.metrics_cache.get((ref_path, img_path), mtimes)
+        if metrics is None:
+            try:
+                # original values of high bit-depth images
+                metrics = compare_images(cache.get_metric_array(ref_path), cache.get_metric_array(img_path))
+            except ValueError:
+                metrics = {}
+            self.metrics_cache.put((ref_path, img_path), mtimes, metrics)
+        return metrics
+
+    def get_diff_qimage(self, ref_path, img_path):
+        """Difference heatmap of an image against the reference, cached for the image pair.
+
+        Returns:
+            QImage | None: Heatmap. None if the images have different shapes.
+        """
+        cache = get_image_cache()
+        mtimes = (cache.get_entry(ref_path).mtime, cache.get_entry(img_path).mtime)
+        entry = self.diff_cache.get((ref_path, img_path), mtimes)
+        if entry is None:
+            try:
+                heatmap = diff_heatmap(cache.get_array(ref_path), cache.get_array(img_path))
+                # the QImage shares the memory of the heatmap, which is kept in the cache entry
+                entry = (heatmap, array_to_qimage(heatmap))
+            except ValueError:
+                entry = (None, None)
+            self.diff_cache.put((ref_path, img_path), mtimes, entry)
+        return entry[1]
+
+    def get_channel_qimage(self, img_path, qimg):
+        """A channel of an image (see channels.extract_channel) as a gray QImage, cached for the image and mode.
+        It is computed from the decoded image, without decoding again."""
+        mode = self.db.channel_mode
+        mtimes = (get_image_cache().get_entry(img_path).mtime, get_image_cache().tone_mapping)
+        entry = self.channel_cache.get((img_path, mode), mtimes)
+        if entry is None:
+            channel = extract_channel(qimage_to_argb(qimg), mode)
+            # QImage needs contiguous rows, so strided channels are copied once (kept in the QImage)
+            entry = array_to_qimage(channel)
+            self.channel_cache.put((img_path, mode), mtimes, entry)
+        return entry
+
+    def get_view_qimage(self, img_path):
+        """Decoded image in the current channel mode."""
+        qimg = get_image_cache().get(img_path)
+        if self.db.channel_mode != 'RGB':
+            qimg = self.get_channel_qimage(img_path, qimg)
+        return qimg
+
+    def add_inview_compare(self, qview, pixmap_item):
+        """Compare the shown image with the same image in another folder (the reference folder, or the second one
+        for the reference folder) in the view, from the decoded images in the image cache."""
+        other_fidx = 0 if self.db.fidx != 0 else 1
+        other_pixmap = QPixmap.fromImage(self.get_view_qimage(self.db.get_path(fidx=other_fidx)[0]))
+        names = [os.path.basename(self.db.folder_list[fidx]) for fidx in (self.db.fidx, other_fidx)]
+        if self.inview_compare == 'wipe':
+            qview.wipe_item = WipeItem(other_pixmap, self.wipe_ratio)
+            pixmap_item.scene().addItem(qview.wipe_item)
+            qview.shown_text.append(f'Wipe: {names[0]} | {names[1]} (drag the line, or Alt + drag)')
+        else:
+            self.flicker_item = pixmap_item
+            self.flicker_pixmaps = [pixmap_item.pixmap(), other_pixmap]
+            self.flicker_names = names
+            self.flicker_idx = 0
+            qview.shown_text.append(f'Flicker: {names[0]}')
+
+    def flicker(self):
+        """Swap the shown image and the compared one in flicker compare."""
+        if self.flicker_item is None or self.flicker_item.scene() is None:
+            return
+        self.flicker_idx = 1 - self.flicker_idx
+        self.flicker_item.setPixmap(self.flicker_pixmaps[self.flicker_idx])
+        self.qviews[0].shown_text[-1] = f'Flicker: {self.flicker_names[self.flicker_idx]}'
+
+    def set_inview_compare(self, mode):
+        """Toggle an in-view compare mode ('wipe' or 'flicker') with another folder."""
+        if self.inview_compare != mode and self.db.get_folder_len() < 2:
+            show_msg('Warning', 'Warning!', 'Please add compare folders first.')
+            return
+        self.inview_compare = None if self.inview_compare == mode else mode
+        self.flicker_item = None
+        if self.inview_compare == 'flicker':
+            self.flicker_timer.start()
+        else:
+            self.flicker_timer.stop()
+        self.show_image()
 
-    def dir_browse(self, step):
+    def dir_browse(self, step, coalesce=False):
+        """Browse images in the folder.
+
+        Args:
+            step (int): Step of the path index.
+            coalesce (bool): Only move the target index, and show it in the next display frame, e.g., for key
+                auto-repeats and wheel scrolls. Loads of the skipped images are cancelled. Default: False.
+        """
         self.db.path_browse(step)
-        self.show_image()
+        if coalesce:
+            # do not restart an active timer, so that continuous browsing is shown at the refresh rate
+            if not self.browse_timer.isActive():
+                self.browse_timer.start()
+        else:
+            self.browse_timer.stop()
+            self.show_image()
+
+    def keyReleaseEvent(self, event):
+        # show the final image right after releasing the key, without waiting for the next frame
+        if not event.isAutoRepeat() and self.browse_timer.isActive():
+            self.browse_timer.stop()
+            self.show_image()
+
+    def toggle_playback(self):
+        """Play or stop the path list at the frame rate of the player. All views advance in lockstep."""
+        if self.player.playing:
+            self.player.stop()
+            self.show_image()
+        elif self.db.get_path_len() < 2:
+            show_msg('Warning', 'Warning!', 'There is only one image to play.')
+        else:
+            self.player.start()
 
     def toggle_bg_color(self):
         if self.qview_bg_color == 'white':
@@ -353,6 +659,12 @@ class Canvas(QWidget):
             for qscene in self.qscenes:
                 qscene.setBackgroundBrush(QtCore.Qt.white)
 
+    def toggle_pixel_values(self):
+        self.show_pixel_values = not self.show_pixel_values
+        for qview in self.qviews:
+            qview.pixel_overlay.enabled = self.show_pixel_values
+            qview.viewport().update()
+
     def auto_zoom(self):
         target_zoom_width = self.qimg.width() * self.qviews[0].zoom
         self.target_zoom_width = int(target_zoom_width)
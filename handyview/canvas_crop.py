@@ -1,17 +1,70 @@
 import os
 import subprocess
 import sys
-from PyQt5.QtCore import QSize
-from PyQt5.QtGui import QIcon
-from PyQt5.QtWidgets import (QComboBox, QGridLayout, QGroupBox, QLabel, QLineEdit, QListWidget, QListWidgetItem,
-                             QPushButton, QScrollArea, QVBoxLayout, QWidget)
+from PyQt5 import QtCore
+from PyQt5.QtCore import QSize, QThread
+from PyQt5.QtGui import QColor, QIcon, QPixmap
+from PyQt5.QtWidgets import (QCheckBox, QComboBox, QGridLayout, QGroupBox, QLabel, QLineEdit, QListWidget,
+                             QListWidgetItem, QProgressBar, QPushButton, QScrollArea, QVBoxLayout, QWidget)
 from shutil import rmtree
-from time import localtime, strftime
-
-from handyview.utils import ROOT_DIR, crop_images, scandir
+from time import time
+
+from handyview.crop import OUTPUT_FORMATS, crop_folders, crop_images, get_encode_stats, get_folder_names
+from handyview.crop_history import CROP_HISTORY_PATH, append_crop_record, make_crop_record
+from handyview.image_cache import get_image_cache
+from handyview.sources import get_host_folder, getmtime
+from handyview.thumbnail import ThumbnailLoader
+from handyview.utils import scandir
 from handyview.widgets import HLine, HVLable, show_msg
 
 
+class CropWorker(QThread):
+    """Run the crop engine in a background thread, so that the GUI is not frozen.
+
+    Args:
+        crop_func (func): crop_images or crop_folders. Other engine functions with progress_callback (e.g.,
+            batch_metrics.evaluate_folders) can also run in it.
+        crop_kwargs (dict): Arguments for crop_func.
+    """
+    progress = QtCore.pyqtSignal(int, int)
+    done = QtCore.pyqtSignal(object)
+    failed = QtCore.pyqtSignal(str)
+
+    def __init__(self, crop_func, crop_kwargs, parent=None):
+        super(CropWorker, self).__init__(parent)
+        self.crop_func = crop_func
+        self.crop_kwargs = crop_kwargs
+
+    def run(self):
+        try:
+            results = self.crop_func(
+                progress_callback=lambda num_done, num_total, _: self.progress.emit(num_done, num_total),
+                **self.crop_kwargs)
+        except Exception as error:
+            self.failed.emit(str(error))
+        else:
+            self.done.emit(results)
+
+
+def crop_cached(crop_func, cached, **crop_kwargs):
+    """Run crop_func in the current process with the images decoded for showing.
+
+    Args:
+        crop_func (func): crop_images or crop_folders.
+        cached (dict): path -> (array, mtime) from ImageCache.get_rgb_arrays. Images modified after decoding are
+            decoded again. Their mtimes are read here, in the crop thread.
+        crop_kwargs (dict): Arguments for crop_func.
+    """
+    decoded = {}
+    for path, (array, mtime) in cached.items():
+        try:
+            if getmtime(path) == mtime:
+                decoded[path] = array
+        except OSError:
+            pass
+    return crop_func(decoded=decoded, num_workers=0, **crop_kwargs)
+
+
 class CanvasCrop(QWidget):
     """Crop canvas
 
@@ -26,19 +79,41 @@ class CanvasCrop(QWidget):
         self.parent = parent
         self.db = db  # database
 
+        # thumbnails are loaded asynchronously, and filled in when ready.
+        # crop results are overwritten by each crop, so they use another loader that is cleared before refreshing
+        thumbnail_size = QSize(200, 150)
+        self.thumbnail_loader = ThumbnailLoader(thumbnail_size, parent=self)
+        self.thumbnail_loader.thumbnail_ready.connect(self.show_thumbnail)
+        self.result_loader = ThumbnailLoader(thumbnail_size, parent=self)
+        self.result_loader.thumbnail_ready.connect(self.show_thumbnail)
+        # path -> (QListWidgetItem, loader)
+        self.thumbnail_items = {}
+        placeholder = QPixmap(thumbnail_size)
+        placeholder.fill(QColor(211, 211, 211))
+        self.placeholder_icon = QIcon(placeholder)
+
+        # rectangles added for cropping multiple patches in one run
+        self.rects = []
+        self.crop_worker = None
+
         # initialize widgets and layout
         self.init_widgets_layout()
 
         # get patch and rect folder
-        self.patch_folder = os.path.join(os.path.dirname(self.db.path_list[0][0]), os.pardir, 'crop_patch')
-        self.rect_folder = os.path.join(os.path.dirname(self.db.path_list[0][0]), os.pardir, 'draw_rect')
+        self.patch_folder, self.rect_folder = self.get_output_folders()
 
     def update_db(self, db):
         # after the "open" action, the db also changes
         self.db = db  # database
         # get patch and rect folder
-        self.patch_folder = os.path.join(os.path.dirname(self.db.path_list[0][0]), os.pardir, 'crop_patch')
-        self.rect_folder = os.path.join(os.path.dirname(self.db.path_list[0][0]), os.pardir, 'draw_rect')
+        self.patch_folder, self.rect_folder = self.get_output_folders()
+
+    def get_output_folders(self):
+        # for images in archives, the output folders are next to the archive
+        folder = get_host_folder(self.db.path_list[0][0])
+        patch_folder = os.path.normpath(os.path.join(folder, os.pardir, 'crop_patch'))
+        rect_folder = os.path.normpath(os.path.join(folder, os.pardir, 'draw_rect'))
+        return patch_folder, rect_folder
 
     def init_widgets_layout(self):
         # show thumbnails
@@ -104,6 +179,10 @@ class CanvasCrop(QWidget):
         # Width  [   ] [   ]  Mode   Combo
         # --------------------------------
         # Rect: Line Width [   ], Color Combo
+        # [Add Rect] [Clear Rects]
+        # Rects: ...
+        # [] All folders  Align Combo
+        # Format Combo  Level [   ]
         # row 0
         config_grid.addWidget(label_start, 0, 1, 1, 1)
         config_grid.addWidget(label_len, 0, 2, 1, 1)
@@ -127,16 +206,48 @@ class CanvasCrop(QWidget):
         config_grid.addWidget(self.edit_line_width, 4, 1, 1, 1)
         config_grid.addWidget(label_line_color, 4, 2, 1, 1)
         config_grid.addWidget(self.combo_line_color, 4, 3, 1, 1)
+        # row 5: multiple rectangles
+        button_add_rect = QPushButton('Add Rect', self)
+        button_add_rect.clicked.connect(self.add_rect)
+        button_clear_rects = QPushButton('Clear Rects', self)
+        button_clear_rects.clicked.connect(self.clear_rects)
+        config_grid.addWidget(button_add_rect, 5, 0, 1, 2)
+        config_grid.addWidget(button_clear_rects, 5, 2, 1, 2)
+        # row 6
+        self.rects_label = HVLable('Rects: current', self, color='blue')
+        config_grid.addWidget(self.rects_label, 6, 0, 1, 5)
+        # row 7: crop all the compare folders
+        self.check_all_folders = QCheckBox('All folders', self)
+        label_align = HVLable('Align', self, color='blue')
+        self.combo_align = QComboBox()
+        self.combo_align.addItems(['index', 'name'])
+        config_grid.addWidget(self.check_all_folders, 7, 0, 1, 2)
+        config_grid.addWidget(label_align, 7, 2, 1, 1)
+        config_grid.addWidget(self.combo_align, 7, 3, 1, 1)
+        # row 8: output format
+        label_format = HVLable('Format', self, color='blue')
+        self.combo_format = QComboBox()
+        self.combo_format.addItems(list(OUTPUT_FORMATS.keys()))
+        label_level = HVLable('Level', self, color='blue')
+        # 0 (fastest) to 9 (smallest)
+        self.edit_level = QLineEdit('1')
+        config_grid.addWidget(label_format, 8, 0, 1, 1)
+        config_grid.addWidget(self.combo_format, 8, 1, 1, 1)
+        config_grid.addWidget(label_level, 8, 2, 1, 1)
+        config_grid.addWidget(self.edit_level, 8, 3, 1, 1)
         # blank
-        config_grid.addWidget(QLabel(), 5, 0, 5, 5)
+        config_grid.addWidget(QLabel(), 9, 0, 5, 5)
 
         # actions
         button_add = QPushButton('Add ALL', self)
         button_add.clicked.connect(self.add_all_images)
         button_selection_pos = QPushButton('Set Selection Pos', self)
         button_selection_pos.clicked.connect(self.set_selection_pos)
-        button_crop = QPushButton('Crop', self)
-        button_crop.clicked.connect(self.crop_images)
+        self.button_crop = QPushButton('Crop', self)
+        self.button_crop.clicked.connect(self.crop_images)
+        self.crop_progress = QProgressBar(self)
+        self.crop_progress.setValue(0)
+        self.crop_info = HVLable('', self, color='blue')
         button_open_patch = QPushButton('Open Patch Folder', self)
         button_open_patch.clicked.connect(self.open_patch_folder)
         button_open_rect = QPushButton('Open Rect Folder', self)
@@ -150,21 +261,23 @@ class CanvasCrop(QWidget):
         button_delete_rect.clicked.connect(self.delete_rect_folder)
 
         button_add.setStyleSheet('background-color : lightblue')
-        button_crop.setStyleSheet('background-color : lightblue')
+        self.button_crop.setStyleSheet('background-color : lightblue')
         button_open_patch.setStyleSheet('background-color : lightgreen')
         button_open_rect.setStyleSheet('background-color : lightgreen')
 
         action_grid = QGridLayout()
         action_grid.addWidget(button_add, 0, 0, 1, 1)
         action_grid.addWidget(button_selection_pos, 1, 0, 1, 1)
-        action_grid.addWidget(button_crop, 2, 0, 1, 1)
-        action_grid.addWidget(HLine(), 3, 0, 1, 1)
-        action_grid.addWidget(button_open_patch, 4, 0, 1, 1)
-        action_grid.addWidget(button_open_rect, 5, 0, 1, 1)
-        action_grid.addWidget(button_open_history, 6, 0, 1, 1)
-        action_grid.addWidget(HLine(), 7, 0, 1, 1)
-        action_grid.addWidget(button_delete_patch, 8, 0, 1, 1)
-        action_grid.addWidget(button_delete_rect, 9, 0, 1, 1)
+        action_grid.addWidget(self.button_crop, 2, 0, 1, 1)
+        action_grid.addWidget(self.crop_progress, 3, 0, 1, 1)
+        action_grid.addWidget(self.crop_info, 4, 0, 1, 1)
+        action_grid.addWidget(HLine(), 5, 0, 1, 1)
+        action_grid.addWidget(button_open_patch, 6, 0, 1, 1)
+        action_grid.addWidget(button_open_rect, 7, 0, 1, 1)
+        action_grid.addWidget(button_open_history, 8, 0, 1, 1)
+        action_grid.addWidget(HLine(), 9, 0, 1, 1)
+        action_grid.addWidget(button_delete_patch, 10, 0, 1, 1)
+        action_grid.addWidget(button_delete_rect, 11, 0, 1, 1)
 
         config_box = QGroupBox('Config')
         config_box.setLayout(config_grid)
@@ -204,61 +317,155 @@ class CanvasCrop(QWidget):
         self.thumbnails.clear()
         self.crop_thumbnails.clear()
         self.rect_thumbnails.clear()
+        self.thumbnail_items.clear()
         # 2. add thumbnails
         for path in self.db.path_list[0]:
-            self.thumbnails.addItem(QListWidgetItem(QIcon(path), os.path.basename(path)))
+            self.add_thumbnail(self.thumbnails, self.thumbnail_loader, path)
 
     def update_crop_rect_images(self):
         # 1. clear all the existing thumbnails
         self.crop_thumbnails.clear()
         self.rect_thumbnails.clear()
+        self.thumbnail_items = {
+            path: (item, loader)
+            for path, (item, loader) in self.thumbnail_items.items() if loader is not self.result_loader
+        }
+        self.result_loader.clear()
         # 2. add thumbnails
-        for path in sorted(scandir(self.patch_folder, suffix=None, recursive=False, full_path=True)):
-            self.crop_thumbnails.addItem(QListWidgetItem(QIcon(path), os.path.basename(path)))
+        # outputs of all folders are in sub folders
+        for path in sorted(scandir(self.patch_folder, suffix=None, recursive=True, full_path=True)):
+            self.add_thumbnail(self.crop_thumbnails, self.result_loader, path)
         if os.path.isdir(self.rect_folder):
-            for path in sorted(scandir(self.rect_folder, suffix=None, recursive=False, full_path=True)):
-                self.rect_thumbnails.addItem(QListWidgetItem(QIcon(path), os.path.basename(path)))
+            for path in sorted(scandir(self.rect_folder, suffix=None, recursive=True, full_path=True)):
+                self.add_thumbnail(self.rect_thumbnails, self.result_loader, path)
+
+    def add_thumbnail(self, list_widget, loader, path):
+        item = QListWidgetItem(self.placeholder_icon, os.path.basename(path))
+        list_widget.addItem(item)
+        self.thumbnail_items[path] = (item, loader)
+        self.show_thumbnail(path)
+
+    def show_thumbnail(self, path):
+        # called when adding an item, and when its thumbnail is ready
+        if path in self.thumbnail_items:
+            item, loader = self.thumbnail_items[path]
+            pixmap = loader.get(path)
+            if pixmap is not None and not pixmap.isNull():
+                item.setIcon(QIcon(pixmap))
+
+    def get_rect(self):
+        return [
+            int(self.edit_start_h.text()),
+            int(self.edit_start_w.text()),
+            int(self.edit_len_h.text()),
+            int(self.edit_len_w.text())
+        ]
+
+    def add_rect(self):
+        try:
+            self.rects.append(self.get_rect())
+        except ValueError as error:
+            show_msg(icon='Critical', title='Title', text=f'Wrong input: {error}', timeout=None)
+            return
+        self.rects_label.setText('Rects:\n' + '\n'.join(f' ({", ".join(map(str, rect))})' for rect in self.rects))
+
+    def clear_rects(self):
+        self.rects = []
+        self.rects_label.setText('Rects: current')
 
     def crop_images(self):
         # 1. check all images has the same shape
         # TODO
         # 2. crop
+        if self.crop_worker is not None and self.crop_worker.isRunning():
+            return
         try:
-            start_h = int(self.edit_start_h.text())
-            start_w = int(self.edit_start_w.text())
-            len_h = int(self.edit_len_h.text())
-            len_w = int(self.edit_len_w.text())
+            # crop all the added rectangles, or the current one if no rectangle is added
+            rects = self.rects if self.rects else [self.get_rect()]
             ratio = int(self.edit_ratio.text())
             mode = self.combo_mode.currentText()
             line_width = int(self.edit_line_width.text())
             line_color = self.combo_line_color.currentText()
+            compress_level = int(self.edit_level.text())
         except ValueError as error:
             show_msg(icon='Critical', title='Title', text=f'Wrong input: {error}', timeout=None)
             return 0
 
-        try:
-            crop_images(
-                self.db.path_list[0], [start_h, start_w, len_h, len_w],
-                self.patch_folder,
-                enlarge_ratio=ratio,
-                interpolation=mode,
-                line_width=line_width,
-                color=line_color,
-                rect_folder=self.rect_folder)
-        except Exception as error:
-            show_msg(icon='Critical', title='Title', text=f'Crop error: {error}', timeout=None)
+        crop_kwargs = dict(
+            rect_pos=rects,
+            patch_folder=self.patch_folder,
+            enlarge_ratio=ratio,
+            interpolation=mode,
+            line_width=line_width,
+            color=line_color,
+            rect_folder=self.rect_folder,
+            output_format=self.combo_format.currentText(),
+            compress_level=compress_level)
+        if self.check_all_folders.isChecked() and self.db.get_folder_len() > 1:
+            # crop all the compare folders in one run, outputs are in sub folders named by the folders
+            crop_func = crop_folders
+            crop_kwargs.update(
+                path_lists=self.db.path_list,
+                folder_names=get_folder_names(self.db.folder_list),
+                align=self.combo_align.currentText())
+            num_total = sum(len(paths) for paths in self.db.path_list)
+        else:
+            crop_func = crop_images
+            crop_kwargs['img_list'] = self.db.path_list[0]
+            num_total = len(self.db.path_list[0])
+        # when all the images have been decoded for showing, crop them in the current process from the image cache,
+        # which is faster than decoding them again in worker processes
+        if crop_func is crop_images:
+            paths = crop_kwargs['img_list']
+        else:
+            paths = [path for folder_paths in crop_kwargs['path_lists'] for path in folder_paths]
+        cached = get_image_cache().get_rgb_arrays(paths)
+        if len(cached) == len(set(paths)):
+            run_kwargs = dict(crop_kwargs, crop_func=crop_func, cached=cached)
+            self.crop_worker = CropWorker(crop_cached, run_kwargs, self)
         else:
-            # update crop info to txt
-            self.record_crop_history(self.db.path_list[0][0], [start_h, start_w, len_h, len_w], ratio, mode)
-            # show cropped image
-            self.update_crop_rect_images()
-
-    def record_crop_history(self, path, pos, ratio, mode):
-        pos_str = ', '.join(map(str, pos))
-        content = f'{strftime("%Y%m%d-%H%M%S", localtime())} {path} ({pos_str}) {ratio} {mode}\n'
+            self.crop_worker = CropWorker(crop_func, crop_kwargs, self)
+        self.crop_worker.progress.connect(self.show_crop_progress)
+        start_time = time()
+        self.crop_worker.done.connect(lambda results: self.crop_done(results, crop_kwargs, start_time))
+        self.crop_worker.failed.connect(self.crop_failed)
+        self.button_crop.setEnabled(False)
+        self.crop_progress.setRange(0, num_total)
+        self.crop_progress.setValue(0)
+        self.crop_info.setText('')
+        self.crop_worker.start()
+
+    def show_crop_progress(self, num_done, num_total):
+        # num_total may be less than the number of images, when aligning folders
+        self.crop_progress.setMaximum(num_total)
+        self.crop_progress.setValue(num_done)
+        self.crop_progress.setFormat(f'%v / {num_total}')
+
+    def crop_done(self, results, crop_kwargs, start_time):
+        self.button_crop.setEnabled(True)
+        total_time = time() - start_time
+        if results and isinstance(results[0], list):
+            # results of each folder
+            results = [result for folder_results in results for result in folder_results]
+        stats = get_encode_stats(results)
+        self.crop_info.setText(f'Encoded {stats["num_files"]} files\n{stats["bytes"] / 1024 / 1024:.1f} MB, '
+                               f'{stats["throughput"]:.1f} MB/s')
+        # record crop info, so that it can be replayed
+        self.record_crop_history(results, crop_kwargs, total_time)
+        # show cropped image
+        self.update_crop_rect_images()
+
+    def crop_failed(self, error):
+        self.button_crop.setEnabled(True)
+        show_msg(icon='Critical', title='Title', text=f'Crop error: {error}', timeout=None)
+
+    def record_crop_history(self, results, crop_kwargs, total_time):
+        crop_kwargs = dict(crop_kwargs)
+        if 'img_list' in crop_kwargs:
+            # crop_images saves outputs in the output folders directly
+            crop_kwargs.update(path_lists=[crop_kwargs.pop('img_list')], folder_names=[''])
         try:
-            with open(os.path.join(ROOT_DIR, 'history_crop.txt'), 'a') as f:
-                f.write(content)
+            append_crop_record(make_crop_record(results=results, total_time=total_time, **crop_kwargs))
         except Exception as error:
             show_msg(icon='Warning', title='Title', text=f'Record crop history error: {error}', timeout=None)
 
@@ -295,12 +502,15 @@ class CanvasCrop(QWidget):
             show_msg(icon='Critical', title='Title', text=f'Open error: {error}', timeout=None)
 
     def open_history_file(self):
+        if not os.path.exists(CROP_HISTORY_PATH):
+            show_msg(icon='Information', title='Title', text=f'No crop history yet: {CROP_HISTORY_PATH}')
+            return
         try:
             if sys.platform == 'win32':
-                os.startfile(os.path.join(ROOT_DIR, 'history_crop.txt'))
+                os.startfile(CROP_HISTORY_PATH)
             else:
                 opener = 'open' if sys.platform == 'darwin' else 'xdg-open'
-                subprocess.call([opener, os.path.join(ROOT_DIR, 'history_crop.txt')])
+                subprocess.call([opener, CROP_HISTORY_PATH])
         except Exception as error:
             show_msg(icon='Critical', title='Title', text=f'Open error: {error}', timeout=None)
 
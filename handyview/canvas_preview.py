@@ -0,0 +1,130 @@
+import os
+from PyQt5 import QtCore
+from PyQt5.QtCore import QAbstractListModel, QModelIndex, QSize, QTimer
+from PyQt5.QtGui import QColor, QPixmap
+from PyQt5.QtWidgets import QGridLayout, QListView, QWidget
+
+from handyview.thumbnail import ThumbnailLoader
+
+
+class ThumbnailModel(QAbstractListModel):
+    """List model of image paths. Thumbnails are provided by the loader."""
+
+    def __init__(self, paths, loader, parent=None):
+        super(ThumbnailModel, self).__init__(parent)
+        self.paths = paths
+        self.rows = {path: row for row, path in enumerate(paths)}
+        self.loader = loader
+        self.loader.thumbnail_ready.connect(self.thumbnail_ready)
+
+        self.placeholder = QPixmap(loader.size)
+        self.placeholder.fill(QColor(211, 211, 211))
+
+    def rowCount(self, parent=QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(self.paths)
+
+    def data(self, index, role=QtCore.Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        path = self.paths[index.row()]
+        if role == QtCore.Qt.DisplayRole:
+            return os.path.basename(path)
+        elif role == QtCore.Qt.DecorationRole:
+            # only called for the visible cells
+            pixmap = self.loader.get(path)
+            if pixmap is None or pixmap.isNull():
+                return self.placeholder
+            return pixmap
+        elif role == QtCore.Qt.ToolTipRole:
+            return path
+        return None
+
+    def thumbnail_ready(self, path):
+        row = self.rows.get(path)
+        if row is not None:
+            index = self.index(row)
+            self.dataChanged.emit(index, index, [QtCore.Qt.DecorationRole])
+
+
+class CanvasPreview(QWidget):
+    """Preview canvas, showing the thumbnails of the current folder in a grid.
+
+    It uses model/view, so that only the visible cells are painted. Thumbnails are
+    decoded only for the visible and near-visible cells, by a worker pool.
+    Click a cell to view it in the main canvas.
+    """
+
+    def __init__(self, parent, db):
+        super(CanvasPreview, self).__init__()
+        self.parent = parent
+        self.db = db  # database
+
+        self.thumbnail_size = QSize(200, 150)
+        self.loader = ThumbnailLoader(self.thumbnail_size, parent=self)
+        self.model = ThumbnailModel(self.db.path_list[self.db.fidx], self.loader, self)
+
+        # initialize widgets and layout
+        self.init_widgets_layout()
+
+        # coalesce scroll and resize events before scheduling thumbnails
+        self.visible_timer = QTimer(self)
+        self.visible_timer.setSingleShot(True)
+        self.visible_timer.setInterval(50)
+        self.visible_timer.timeout.connect(self.update_visible_cells)
+        self.view.verticalScrollBar().valueChanged.connect(self.visible_timer.start)
+
+        self.goto_index(self.db.pidx)
+
+    def init_widgets_layout(self):
+        self.view = QListView()
+        self.view.setViewMode(QListView.IconMode)
+        self.view.setIconSize(self.thumbnail_size)
+        self.view.setGridSize(QSize(self.thumbnail_size.width() + 20, self.thumbnail_size.height() + 40))
+        # uniform item sizes: the view does not query the data of every item for layout
+        self.view.setUniformItemSizes(True)
+        self.view.setMovement(QListView.Static)
+        self.view.setResizeMode(QListView.Adjust)
+        self.view.setLayoutMode(QListView.Batched)
+        self.view.setBatchSize(1000)
+        self.view.setVerticalScrollMode(QListView.ScrollPerPixel)
+        self.view.setModel(self.model)
+        self.view.clicked.connect(self.open_image)
+        self.view.activated.connect(self.open_image)
+
+        main_layout = QGridLayout(self)
+        main_layout.addWidget(self.view, 0, 0, 1, 1)
+
+    def update_visible_cells(self):
+        """Schedule thumbnails for the visible cells, and one page before and after them."""
+        grid = self.view.gridSize()
+        viewport = self.view.viewport()
+        num_col = max(1, viewport.width() // grid.width())
+        num_page = (viewport.height() // grid.height() + 2) * num_col
+        first = self.view.verticalScrollBar().value() // grid.height() * num_col
+        start = max(0, first - num_page)
+        end = min(len(self.model.paths), first + 2 * num_page)
+        self.loader.set_wanted(self.model.paths[start:end])
+
+    def resizeEvent(self, event):
+        super(CanvasPreview, self).resizeEvent(event)
+        self.visible_timer.start()
+
+    def goto_index(self, index):
+        self.db.pidx = index
+        model_index = self.model.index(self.db.pidx)
+        self.view.setCurrentIndex(model_index)
+        self.view.scrollTo(model_index, QListView.PositionAtCenter)
+        self.visible_timer.start()
+
+    def open_image(self, index):
+        self.db.pidx = index.row()
+        # switch after returning from the signal, as switching canvas deletes this widget
+        QTimer.singleShot(0, self.parent.switch_main_canvas)
+
+    def keyPressEvent(self, event):
+        if event.key() == QtCore.Qt.Key_Escape:
+            QTimer.singleShot(0, self.parent.switch_main_canvas)
+        elif event.key() == QtCore.Qt.Key_F11:
+            self.parent.switch_fullscreen()
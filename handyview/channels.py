@@ -0,0 +1,51 @@
+"""
+Channel views: a single channel (R, G, B, alpha) or a YCbCr channel of an image, shown as a gray image, e.g., for
+checking chroma artifacts.
+
+R, G, B and alpha are strided views of the 0xAARRGGBB pixels, without copying. YCbCr channels are computed from
+them (BT.601, limited range).
+"""
+import numpy as np
+import sys
+
+CHANNEL_MODES = ('RGB', 'R', 'G', 'B', 'A', 'Y', 'Cb', 'Cr')
+# byte offsets of channels in 0xAARRGGBB values
+_BYTE_IDX = {'A': 3, 'R': 2, 'G': 1, 'B': 0} if sys.byteorder == 'little' else {'A': 0, 'R': 1, 'G': 2, 'B': 3}
+# BT.601 (limited range) as in MATLAB rgb2ycbcr, the same as metrics.to_y_channel
+_YCBCR = {
+    'Y': ((65.481, 128.553, 24.966), 16.),
+    'Cb': ((-37.797, -74.203, 112.0), 128.),
+    'Cr': ((112.0, -93.786, -18.214), 128.),
+}
+
+_BAND = 256
+
+
+def extract_channel(argb, mode):
+    """A channel of an image.
+
+    Args:
+        argb (ndarray): (h, w) uint32 array of 0xAARRGGBB values, e.g., from image_cache.qimage_to_argb.
+        mode (str): Channel in CHANNEL_MODES (except 'RGB').
+
+    Returns:
+        ndarray: (h, w) uint8 channel. It is a (read-only) strided view of argb for R, G, B and alpha.
+    """
+    height, width = argb.shape
+    channels = argb.view(np.uint8).reshape(height, width, 4)
+    if mode in _BYTE_IDX:
+        return channels[..., _BYTE_IDX[mode]]
+    if mode not in _YCBCR:
+        raise ValueError(f'Unknown channel mode: {mode}. Supported ones are {CHANNEL_MODES}.')
+    (kr, kg, kb), offset = _YCBCR[mode]
+    out = np.empty((height, width), dtype=np.uint8)
+    red, green, blue = (channels[..., _BYTE_IDX[name]] for name in 'RGB')
+    for start in range(0, height, _BAND):
+        rows = slice(start, start + _BAND)
+        value = red[rows] * np.float32(kr / 255)
+        value += green[rows] * np.float32(kg / 255)
+        value += blue[rows] * np.float32(kb / 255)
+        value += offset + 0.5
+        np.clip(value, 0, 255, out=value)
+        out[rows] = value
+    return out
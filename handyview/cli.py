@@ -0,0 +1,387 @@
+"""
+Command line tools without GUI. They do not import Qt, so they can run on servers without a display.
+
+Usage:
+    python -m handyview.cli crop job.yml [--summary summary.json] [--num_workers 8] [--history history.jsonl]
+    python -m handyview.cli replay [ID ...] [--last 1] [--force] [--list]
+    python -m handyview.cli metrics GT_FOLDER RESULT_FOLDER [...] [--crop_border 4] [--y] [--csv metrics.csv]
+    python -m handyview.cli roi FOLDER --rect START_H START_W LEN_H LEN_W [--csv roi_stats.csv]
+
+Crop runs (of the GUI and of job specs) are recorded in ~/.cache/handyview/history_crop.jsonl (or --history).
+`replay` re-runs the records with the given ids (or the last ones), skipping images whose outputs are newer than them.
+
+`metrics` evaluates PSNR / SSIM of result folders against the first folder, and prints the mean of each folder.
+Per-image results are cached, and only new or modified images are evaluated again.
+
+`roi` computes the statistics (mean, std, min / max) of the same rect in all the images of a folder.
+
+An example job spec (yaml or json). Options at the top level are the defaults of all jobs,
+and can be overridden in each job. Relative paths are relative to the job spec file.
+
+    enlarge_ratio: 2
+    interpolation: bicubic  # bicubic | bilinear | nearest
+    line_width: 2  # 0 for not drawing rectangles
+    color: yellow  # a color or a list of colors for rectangles
+    align: index  # index | name, for aligning images in folders
+    output_format: png  # png | webp | tiff, all lossless
+    compress_level: 1  # 0 (fastest) to 9 (smallest). TIFF is uncompressed
+    jobs:
+      - name: fig1
+        folders: [datasets/GT, results/ESRGAN, results/RealESRGAN]
+        rects: [[100, 200, 64, 64], [300, 50, 32, 48]]  # each is [start_h, start_w, len_h, len_w]
+        output: figures/fig1  # patches are saved in <output>/crop_patch/<folder name>
+      - name: fig2
+        folders: [results/RealESRGAN]
+        include_names: ['0801']
+        rects: [[10, 20, 64, 64]]
+        output: figures/fig2
+        line_width: 0
+      - name: fig3
+        folders: [datasets/GT, results/ESRGAN]
+        rects: [[100, 200, 64, 64]]
+        output: figures/fig3
+        montage:  # also save comparison figures in <output>/montage. `montage: true` for the default options
+          full_index: 0  # index of the folder shown in full, null for patches only
+          labels: [GT, ESRGAN]  # default: folder names
+          padding: 4
+          font_size: 16
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+from handyview.batch_metrics import evaluate_folders, write_csv, write_json
+from handyview.crop import get_crop_tasks, get_encode_stats, get_folder_names, run_crop_tasks, split_results
+from handyview.crop_history import (CROP_HISTORY_PATH, append_crop_record, load_crop_records, make_crop_record,
+                                    replay_crop_records)
+from handyview.montage import get_montage_tasks, run_montage_tasks
+from handyview.roi_stats import batch_roi_stats, summarize_roi_stats, write_roi_csv
+from handyview.utils import get_img_list
+
+# options that can be set at the top level and in each job
+JOB_DEFAULTS = dict(
+    enlarge_ratio=2,
+    interpolation='bicubic',
+    line_width=0,
+    color='yellow',
+    align='index',
+    output_format='png',
+    compress_level=1)
+
+# options of the montage in a job
+MONTAGE_OPTIONS = ('labels', 'full_index', 'line_width', 'padding', 'font_size', 'background')
+
+
+def load_spec(spec_path):
+    """Load a job spec in json or yaml."""
+    with open(spec_path, 'r', encoding='utf-8') as f:
+        if spec_path.endswith(('.yml', '.yaml')):
+            try:
+                import yaml
+            except ImportError:
+                raise ImportError('Please install PyYAML to read yaml job specs: pip install pyyaml')
+            return yaml.safe_load(f)
+        return json.load(f)
+
+
+def crop(spec_path, summary_path=None, num_workers=None, history_path=None):
+    """Run all the crop jobs in a job spec. Images of all the jobs are scheduled together on one process pool.
+
+    Args:
+        spec_path (str): Path of the job spec.
+        summary_path (str): Path of the json summary. None for printing to stdout. Default: None.
+        num_workers (int): Number of worker processes. None for the number of CPU cores. Default: None.
+        history_path (str): Path of the crop history. None for history_crop.jsonl in the cache dir. Default: None.
+
+    Returns:
+        dict: Summary.
+    """
+    spec = load_spec(spec_path)
+    spec_dir = os.path.dirname(os.path.abspath(spec_path))
+    defaults = {key: spec.get(key, value) for key, value in JOB_DEFAULTS.items()}
+    if num_workers is None:
+        num_workers = spec.get('num_workers')
+
+    start_time = time.time()
+    tasks, montage_tasks, job_infos = [], [], []
+    for job_idx, job in enumerate(spec['jobs']):
+        options = {key: job.get(key, value) for key, value in defaults.items()}
+        folders = [os.path.join(spec_dir, folder) for folder in job['folders']]
+        path_lists = [
+            get_img_list(folder, job.get('include_names'), job.get('exclude_names'), job.get('exact_exclude_names'))
+            for folder in folders
+        ]
+        for folder, paths in zip(folders, path_lists):
+            if not paths:
+                raise ValueError(f'No images in {folder}')
+        output = os.path.join(spec_dir, job['output'])
+        # no sub folders for one folder
+        folder_names = get_folder_names(folders) if len(folders) > 1 else ['']
+        record_kwargs = dict(
+            rect_pos=job['rects'],
+            patch_folder=os.path.join(output, 'crop_patch'),
+            rect_folder=os.path.join(output, 'draw_rect'),
+            folder_names=folder_names,
+            **options)
+        job_tasks, path_lists = get_crop_tasks(path_lists, **record_kwargs)
+        tasks.extend(job_tasks)
+        num_montage = 0
+        if job.get('montage'):
+            num_montage = len(path_lists[0])
+            montage_options = job['montage'] if isinstance(job['montage'], dict) else {}
+            montage_options = {key: montage_options[key] for key in MONTAGE_OPTIONS if key in montage_options}
+            montage_options.setdefault('labels', get_folder_names(folders))
+            montage_tasks.extend(
+                get_montage_tasks(
+                    path_lists,
+                    job['rects'],
+                    os.path.join(output, 'montage'),
+                    enlarge_ratio=options['enlarge_ratio'],
+                    interpolation=options['interpolation'],
+                    color=options['color'],
+                    output_format=options['output_format'],
+                    compress_level=options['compress_level'],
+                    **montage_options))
+        job_infos.append((job.get('name',
+                                  f'job{job_idx}'), folders, path_lists, len(job_tasks), num_montage, record_kwargs))
+
+    def print_progress(num_done, num_total, result):
+        print(f'[{num_done}/{num_total}] {result["path"]} {result["time"]:.3f}s', file=sys.stderr)
+
+    results = run_crop_tasks(tasks, num_workers, print_progress)
+    montage_results = run_montage_tasks(montage_tasks, num_workers, print_progress) if montage_tasks else []
+
+    summary = {'spec': os.path.abspath(spec_path), 'num_images': len(tasks), 'jobs': []}
+    start, montage_start = 0, 0
+    for name, folders, path_lists, num_task, num_montage, record_kwargs in job_infos:
+        job_results = results[start:start + num_task]
+        start += num_task
+        crop_time = sum(result['time'] for result in job_results)
+        try:
+            append_crop_record(
+                make_crop_record(path_lists, job_results, crop_time, name=name, **record_kwargs), history_path)
+        except OSError as error:
+            # the crops are done, only the history is not recorded
+            print(f'Warning: failed to record the crop history: {error}', file=sys.stderr)
+        folder_results = split_results(job_results, path_lists)
+        folder_summaries = [dict(folder=folder, results=result) for folder, result in zip(folders, folder_results)]
+        job_montages = montage_results[montage_start:montage_start + num_montage]
+        montage_start += num_montage
+        job_time = sum(result['time'] for result in job_results + job_montages)
+        job_summary = dict(name=name, folders=folder_summaries, time=job_time)
+        if num_montage:
+            job_summary['montage'] = job_montages
+        summary['jobs'].append(job_summary)
+    summary['total_time'] = time.time() - start_time
+    summary['encode'] = get_encode_stats(results)
+    print(
+        f'Cropped {len(tasks)} images in {summary["total_time"]:.2f}s. Encoded {summary["encode"]["num_files"]} files, '
+        f'{summary["encode"]["throughput"]:.1f} MB/s',
+        file=sys.stderr)
+
+    content = json.dumps(summary, indent=2)
+    if summary_path is None:
+        print(content)
+    else:
+        with open(summary_path, 'w', encoding='utf-8') as f:
+            f.write(content)
+    return summary
+
+
+def replay(ids=None, last=None, history_path=None, force=False, num_workers=None, summary_path=None):
+    """Replay crop records in the crop history.
+
+    Args:
+        ids (list[str]): Ids of the records. None for the last records. Default: None.
+        last (int): Number of the last records to replay, when ids is None. Default: None (1).
+        history_path (str): Path of the crop history. None for history_crop.jsonl in the cache dir. Default: None.
+        force (bool): Whether to crop images whose outputs are up to date. Default: False.
+        num_workers (int): Number of worker processes. None for the number of CPU cores. Default: None.
+        summary_path (str): Path of the json summary. None for printing to stdout. Default: None.
+
+    Returns:
+        dict: Summary.
+    """
+    records = load_crop_records(history_path)
+    if ids:
+        record_dict = {record['id']: record for record in records}
+        for record_id in ids:
+            if record_id not in record_dict:
+                raise ValueError(f'No crop record with id {record_id}')
+        records = [record_dict[record_id] for record_id in ids]
+    else:
+        records = records[-(last or 1):] if records else []
+
+    def print_progress(num_done, num_total, result):
+        print(f'[{num_done}/{num_total}] {result["path"]} {result["time"]:.3f}s', file=sys.stderr)
+
+    start_time = time.time()
+    replays = replay_crop_records(records, force, num_workers, print_progress)
+    results = [result for replay in replays for result in replay['results']]
+    summary = dict(history=history_path or CROP_HISTORY_PATH, records=replays, total_time=time.time() - start_time)
+    summary['encode'] = get_encode_stats(results)
+    num_skipped = sum(replay['num_skipped'] for replay in replays)
+    print(
+        f'Replayed {len(records)} records: cropped {len(results)} images, skipped {num_skipped} up-to-date images '
+        f'in {summary["total_time"]:.2f}s',
+        file=sys.stderr)
+
+    content = json.dumps(summary, indent=2)
+    if summary_path is None:
+        print(content)
+    else:
+        with open(summary_path, 'w', encoding='utf-8') as f:
+            f.write(content)
+    return summary
+
+
+def list_records(history_path=None):
+    """Print the crop records in the crop history, one line for each."""
+    for record in load_crop_records(history_path):
+        num_images = sum(len(paths) for paths in record['path_lists'])
+        rects = ' '.join(f'({", ".join(map(str, rect))})' for rect in record['rects'])
+        print(f'{record["id"]} {record.get("name") or ""} {num_images} images {rects} {record["enlarge_ratio"]} '
+              f'{record["interpolation"]} -> {record["patch_folder"]}')
+
+
+def metrics(folders,
+            crop_border=0,
+            test_y_channel=False,
+            align='name',
+            csv_path=None,
+            json_path=None,
+            num_workers=None,
+            use_cache=True):
+    """Evaluate PSNR / SSIM of folders against the first folder.
+
+    Args:
+        folders (list[str]): Folders. The first one is the reference (e.g., GT).
+        crop_border (int): Pixels cropped from each border. Default: 0.
+        test_y_channel (bool): Whether to test on the Y channel. Default: False.
+        align (str): Align mode, see crop.align_folders. Default: 'name'.
+        csv_path (str): Path of the CSV report. Default: None.
+        json_path (str): Path of the json report. Default: None.
+        num_workers (int): Number of worker processes. None for the number of CPU cores. Default: None.
+        use_cache (bool): Whether to use the metrics cache. Default: True.
+
+    Returns:
+        dict: Report.
+    """
+    path_lists = [get_img_list(folder) for folder in folders]
+    for folder, paths in zip(folders, path_lists):
+        if not paths:
+            raise ValueError(f'No images in {folder}')
+
+    def print_progress(num_done, num_total, _):
+        print(f'\r[{num_done}/{num_total}]', end='', file=sys.stderr)
+
+    report = evaluate_folders(
+        path_lists,
+        crop_border,
+        test_y_channel,
+        align,
+        folders=folders,
+        num_workers=num_workers,
+        use_cache=use_cache,
+        progress_callback=print_progress)
+    print(
+        f'\rEvaluated {report["num_evaluated"]} pairs ({report["num_cached"]} cached) in {report["time"]:.2f}s',
+        file=sys.stderr)
+    for folder, psnr, ssim in zip(report['folders'], report['mean']['psnr'], report['mean']['ssim']):
+        psnr = f'{psnr:.4f}' if psnr is not None else '-'
+        ssim = f'{ssim:.4f}' if ssim is not None else '-'
+        print(f'{folder}\tPSNR: {psnr}\tSSIM: {ssim}')
+    if csv_path is not None:
+        write_csv(report, csv_path)
+    if json_path is not None:
+        write_json(report, json_path)
+    return report
+
+
+def roi(folder, rect, csv_path=None, num_workers=None):
+    """Statistics of the same rect in all the images of a folder.
+
+    Args:
+        folder (str): Folder.
+        rect (list[int]): (start_h, start_w, len_h, len_w).
+        csv_path (str): Path of the CSV report. Default: None.
+        num_workers (int): Number of worker processes. None for the number of CPU cores. Default: None.
+
+    Returns:
+        list[dict]: Result of each image. See roi_stats.roi_stats_one_image.
+    """
+    paths = get_img_list(folder)
+    if not paths:
+        raise ValueError(f'No images in {folder}')
+
+    def print_progress(num_done, num_total, _):
+        print(f'\r[{num_done}/{num_total}]', end='', file=sys.stderr)
+
+    results = batch_roi_stats(paths, rect, num_workers, print_progress)
+    print('', file=sys.stderr)
+    for result in results:
+        mean = ', '.join(f'{value:.2f}' for value in result['mean'])
+        std = ', '.join(f'{value:.2f}' for value in result['std'])
+        print(f'{os.path.basename(result["path"])}\tmean: ({mean})\tstd: ({std})')
+    summary = summarize_roi_stats(results)
+    if summary['num_images'] > 0:
+        print(f'Largest shift of ROI means: {summary["max_shift"]:.2f} in {summary["max_shift_path"]}')
+    if csv_path is not None:
+        write_roi_csv(results, csv_path)
+    return results
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(prog='python -m handyview.cli', description='HandyView command line tools.')
+    subparsers = parser.add_subparsers(dest='command')
+    crop_parser = subparsers.add_parser('crop', help='Crop patches and draw rectangles, driven by a job spec.')
+    crop_parser.add_argument('spec', help='Job spec (json or yaml).')
+    crop_parser.add_argument('--summary', default=None, help='Path of the json summary. Default: stdout.')
+    crop_parser.add_argument('--num_workers', type=int, default=None, help='Default: the number of CPU cores.')
+    crop_parser.add_argument('--history', default=None, help='Path of the crop history.')
+    replay_parser = subparsers.add_parser('replay', help='Replay crop records in the crop history.')
+    replay_parser.add_argument('ids', nargs='*', help='Ids of the records. Default: the last records.')
+    replay_parser.add_argument('--last', type=int, default=None, help='Number of the last records. Default: 1.')
+    replay_parser.add_argument('--history', default=None, help='Path of the crop history.')
+    replay_parser.add_argument('--force', action='store_true', help='Also crop images with up-to-date outputs.')
+    replay_parser.add_argument('--list', action='store_true', help='List the records instead of replaying.')
+    replay_parser.add_argument('--summary', default=None, help='Path of the json summary. Default: stdout.')
+    replay_parser.add_argument('--num_workers', type=int, default=None, help='Default: the number of CPU cores.')
+    metrics_parser = subparsers.add_parser('metrics', help='Evaluate PSNR / SSIM of folders against the first one.')
+    metrics_parser.add_argument('folders', nargs='+', help='The reference folder, and the folders to evaluate.')
+    metrics_parser.add_argument('--crop_border', type=int, default=0, help='Pixels cropped from each border.')
+    metrics_parser.add_argument('--y', action='store_true', help='Test on the Y channel.')
+    metrics_parser.add_argument('--align', default='name', choices=['name', 'index'], help='Default: name.')
+    metrics_parser.add_argument('--csv', default=None, help='Path of the CSV report.')
+    metrics_parser.add_argument('--json', default=None, help='Path of the json report.')
+    metrics_parser.add_argument('--num_workers', type=int, default=None, help='Default: the number of CPU cores.')
+    metrics_parser.add_argument('--no_cache', action='store_true', help='Do not use the metrics cache.')
+    roi_parser = subparsers.add_parser('roi', help='Statistics of the same rect in all the images of a folder.')
+    roi_parser.add_argument('folder', help='Folder.')
+    roi_parser.add_argument(
+        '--rect', type=int, nargs=4, required=True, metavar=('START_H', 'START_W', 'LEN_H', 'LEN_W'), help='Rect.')
+    roi_parser.add_argument('--csv', default=None, help='Path of the CSV report.')
+    roi_parser.add_argument('--num_workers', type=int, default=None, help='Default: the number of CPU cores.')
+    args = parser.parse_args(args)
+
+    if args.command == 'crop':
+        crop(args.spec, args.summary, args.num_workers, args.history)
+    elif args.command == 'replay' and args.list:
+        list_records(args.history)
+    elif args.command == 'replay':
+        replay(args.ids, args.last, args.history, args.force, args.num_workers, args.summary)
+    elif args.command == 'metrics':
+        if len(args.folders) < 2:
+            parser.error('metrics requires a reference folder and at least one folder to evaluate')
+        metrics(args.folders, args.crop_border, args.y, args.align, args.csv, args.json, args.num_workers,
+                not args.no_cache)
+    elif args.command == 'roi':
+        roi(args.folder, args.rect, args.csv, args.num_workers)
+    else:
+        parser.print_help()
+
+
+if __name__ == '__main__':
+    main()
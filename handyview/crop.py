@@ -0,0 +1,726 @@
+"""
+Crop engine: crop patches from images and draw rectangles on images.
+"""
+import io
+import multiprocessing
+import os
+import struct
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from PIL import Image, ImageDraw, TiffImagePlugin, TiffTags, features
+
+from handyview.hdr import HIGH_BIT_DEPTH_MODES, is_hdr_path, pil_to_array, read_high_bit_depth, tone_map
+from handyview.sources import get_array_layouts, open_file, set_array_layouts
+
+# in RGB
+COLOR_TABLE = {
+    'yellow': (255, 255, 0),
+    'green': (0, 255, 0),
+    'red': (255, 0, 0),
+    'magenta': (255, 0, 255),
+    'matlab_blue': (0, 114, 189),
+    'matlab_orange': (217, 83, 25),
+    'matlab_yellow': (237, 177, 32),
+    'matlab_purple': (126, 47, 142),
+    'matlab_green': (119, 172, 48),
+    'matlab_liblue': (77, 190, 238),
+    'matlab_brown': (162, 20, 47)
+}
+
+INTERPOLATIONS = {'bicubic': Image.BICUBIC, 'bilinear': Image.BILINEAR, 'nearest': Image.NEAREST}
+
+# format: (extension, Pillow format)
+OUTPUT_FORMATS = {'png': ('.png', 'PNG'), 'webp': ('.webp', 'WEBP'), 'tiff': ('.tif', 'TIFF')}
+
+# TIFF tags for decoding the samples of a tile (strip): bits per sample, compression, photometric, fill order, samples
+# per pixel, planar configuration, predictor, extra samples, sample format, jpeg tables and YCbCr tags
+_TIFF_SAMPLE_TAGS = (258, 259, 262, 266, 277, 284, 317, 338, 339, 347, 529, 530, 531, 532)
+
+
+def save_image(img, path, output_format='png', compress_level=1):
+    """Encode and save an image atomically: it is first written to a temporary file and then renamed,
+    so that an interrupted crop never leaves incomplete outputs.
+
+    Args:
+        img (PIL.Image): Image.
+        path (str): Output path.
+        output_format (str): png | webp | tiff. All of them are lossless. Default: 'png'.
+        compress_level (int): 0 (fastest) to 9 (smallest). PNG: zlib level. WebP: compression effort.
+            TIFF: always uncompressed. Default: 1.
+
+    Returns:
+        dict: Output path, file size (bytes) and encoding time (seconds).
+    """
+    start_time = time.time()
+    tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    pil_format = OUTPUT_FORMATS[output_format][1]
+    try:
+        if output_format == 'png':
+            img.save(tmp_path, pil_format, compress_level=compress_level)
+        elif output_format == 'webp':
+            img.save(
+                tmp_path, pil_format, lossless=True, quality=compress_level * 100 // 9, method=compress_level * 6 // 9)
+        else:
+            img.save(tmp_path, pil_format, compression=None)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return {'path': path, 'bytes': os.path.getsize(path), 'time': time.time() - start_time}
+
+
+class OutputWriter():
+    """Encode and save images with worker threads, so that encoding overlaps decoding and cropping.
+
+    Pillow releases the GIL when encoding, so threads run in parallel. The queue is bounded: submit blocks when
+    there are max_pending images waiting, so that decoded images do not pile up in memory.
+
+    Args:
+        num_threads (int): Number of encoding threads. Default: 2.
+        max_pending (int): Max number of submitted images that are not saved. Default: 8.
+    """
+
+    def __init__(self, num_threads=2, max_pending=8):
+        self._executor = ThreadPoolExecutor(num_threads)
+        self._slots = threading.BoundedSemaphore(max_pending)
+
+    def submit(self, img, path, output_format='png', compress_level=1):
+        """Submit an image for save_image. Returns a future of the save_image result."""
+        self._slots.acquire()
+        try:
+            future = self._executor.submit(save_image, img, path, output_format, compress_level)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
+
+
+# writer of the current process, shared by the crop tasks in it
+_writer = None
+_writer_pid = None
+
+
+def get_writer():
+    global _writer, _writer_pid
+    # threads are not inherited by forked processes
+    if _writer is None or _writer_pid != os.getpid():
+        _writer, _writer_pid = OutputWriter(), os.getpid()
+    return _writer
+
+
+def _replace_extents(tile, extents):
+    # tiles are named tuples since Pillow 11, and plain tuples before
+    if hasattr(tile, '_replace'):
+        return tile._replace(extents=extents)
+    return (tile[0], extents) + tuple(tile[2:])
+
+
+def _is_row_sequential(img):
+    """Whether the image has one tile, whose rows are decoded from top to bottom."""
+    if len(img.tile) != 1 or img.tile[0][1][:2] != (0, 0):
+        return False
+    codec, args = img.tile[0][0], img.tile[0][3]
+    if img.format == 'PNG':
+        # interlaced (Adam7) rows are spread over the whole data
+        return codec == 'zip' and not img.info.get('interlace')
+    if img.format == 'JPEG':
+        # progressive jpeg refines all rows in each scan
+        return codec == 'jpeg' and not img.info.get('progressive') and not img.info.get('progression')
+    if img.format == 'TIFF':
+        # uncompressed, top to bottom
+        return codec == 'raw' and isinstance(args, tuple) and len(args) >= 3 and args[2] == 1
+    return False
+
+
+def decode_region(f, box):
+    """Decode the region of an image that covers a box, without decoding the whole image when possible.
+
+    - Tiled or striped TIFF: only the tiles (strips) intersecting the box are decoded. Compressed ones are decoded
+      by libtiff, one decoder call per tile (see _decode_libtiff_tiles). Palette and planar TIFF are not supported.
+    - Non-interlaced PNG, baseline JPEG and uncompressed single-strip TIFF: rows are decoded from the top, and
+      decoding stops after the last row of the box. The columns outside the box are decoded as well, and JPEG is
+      decoded at full size (without draft), as patches are cropped at full resolution.
+    - Others: decode the whole image.
+
+    Args:
+        f (file): Image file object.
+        box (tuple[int]): (left, upper, right, lower) in the full image.
+
+    Returns:
+        tuple: (PIL.Image, (x, y)). The decoded image and its top-left position in the full image.
+    """
+    img = Image.open(f)
+    w, h = img.size
+    x0, y0, x1, y1 = max(box[0], 0), max(box[1], 0), min(box[2], w), min(box[3], h)
+    # the orientation tag transposes the decoded tiles
+    if x0 >= x1 or y0 >= y1 or (img.format == 'TIFF' and img.tag_v2.get(274, 1) != 1):
+        img.load()
+        return img, (0, 0)
+
+    if img.format == 'TIFF' and img.tile[0][0] == 'libtiff':
+        # libtiff decodes the whole image in one call
+        region = _decode_libtiff_tiles(img, f, (x0, y0, x1, y1))
+        if region is not None:
+            return region
+    elif img.format == 'TIFF' and len(img.tile) > 1:
+        # tiles are decoded independently. Decode the bounding region of the tiles intersecting the box
+        tiles = [
+            tile for tile in img.tile if tile[1][0] < x1 and tile[1][2] > x0 and tile[1][1] < y1 and tile[1][3] > y0
+        ]
+        left, upper = min(tile[1][0] for tile in tiles), min(tile[1][1] for tile in tiles)
+        right, lower = max(tile[1][2] for tile in tiles), max(tile[1][3] for tile in tiles)
+        img.tile = [
+            _replace_extents(tile, (tile[1][0] - left, tile[1][1] - upper, tile[1][2] - left, tile[1][3] - upper))
+            for tile in tiles
+        ]
+        img._size = (right - left, lower - upper)
+        img.load()
+        return img, (left, upper)
+
+    if _is_row_sequential(img):
+        img.tile = [_replace_extents(img.tile[0], (0, 0, w, y1))]
+        img._size = (w, y1)
+        try:
+            img.load()
+        except OSError:
+            # libjpeg reports an error when stopping before the last row, though the decoded rows are complete.
+            # It is raised after decoding, when the tiles have been consumed. Errors while reading (e.g., truncated
+            # files) leave the tiles, and the whole image is decoded again, which reports them as usual
+            if img.format != 'JPEG' or img.tile:
+                f.seek(0)
+                img = Image.open(f)
+                img.load()
+        return img, (0, 0)
+
+    img.load()
+    return img, (0, 0)
+
+
+def _decode_libtiff_tiles(img, f, box):
+    """Decode the tiles (strips) of a TIFF compressed by libtiff intersecting a box.
+
+    Each tile is decoded by libtiff as a TIFF of its own in memory, which has the tile as its only strip, and the
+    sample tags of the image.
+
+    Returns:
+        tuple | None: (PIL.Image, (x, y)) as decode_region. None if the image is not supported, or has only one tile.
+    """
+    tags = img.tag_v2
+    w, h = img.size
+    if img.mode in ('P', 'PA') or tags.get(284, 1) != 1:
+        return None
+    tiled = 324 in tags
+    if tiled:
+        tile_w, tile_h, offsets, byte_counts = tags[322], tags[323], tags[324], tags[325]
+    else:
+        tile_w, tile_h, offsets, byte_counts = w, tags.get(278, h), tags[273], tags[279]
+    num_x = -(-w // tile_w)
+    if tile_w >= w and tile_h >= h or len(offsets) < num_x * -(-h // tile_h):
+        return None
+    x0, y0, x1, y1 = box
+    tx0, ty0, tx1, ty1 = x0 // tile_w, y0 // tile_h, (x1 - 1) // tile_w + 1, (y1 - 1) // tile_h + 1
+    left, upper = tx0 * tile_w, ty0 * tile_h
+    region = Image.new(img.mode, (min(tx1 * tile_w, w) - left, min(ty1 * tile_h, h) - upper))
+    for ty in range(ty0, ty1):
+        for tx in range(tx0, tx1):
+            idx = ty * num_x + tx
+            f.seek(offsets[idx])
+            data = f.read(byte_counts[idx])
+            # tiles are padded to the full size, and the last strip is not
+            size = (tile_w, tile_h) if tiled else (w, min(tile_h, h - ty * tile_h))
+            tile = _open_tiff_strip(tags, size, data)
+            tile.load()
+            region.paste(tile, (tx * tile_w - left, ty * tile_h - upper))
+    return region, (left, upper)
+
+
+def _open_tiff_strip(tags, size, data):
+    ifd = TiffImagePlugin.ImageFileDirectory_v2(prefix=tags.prefix)
+    for tag in _TIFF_SAMPLE_TAGS:
+        if tag in tags:
+            ifd.tagtype[tag] = tags.tagtype[tag]
+            ifd[tag] = tags[tag]
+    ifd[256], ifd[257] = size
+    ifd[278] = size[1]
+    ifd.tagtype[273] = ifd.tagtype[279] = TiffTags.LONG
+    # the strip offset is relative to the end of the directory, where the data is put (see ImageFileDirectory_v2)
+    ifd[273] = (0, )
+    ifd[279] = (len(data), )
+    header = tags.prefix + struct.pack('<HL' if tags.prefix == b'II' else '>HL', 42, 8)
+    return Image.open(io.BytesIO(header + ifd.tobytes(8) + data))
+
+
+def open_image(path, box=None):
+    """Decode an image for the engines (crop, montage and ROI statistics), also for virtual paths.
+
+    Arrays (.npy / .yuv frames) and HDR images, which PIL cannot read, are read by hdr.read_high_bit_depth and tone
+    mapped to 8-bit (exposure 0, linear), as shown in the GUI with the default tone mapping. So are 16-bit and float
+    images decoded by PIL (e.g., float TIFF), which cannot be saved in most output formats.
+
+    Args:
+        path (str): Image path.
+        box (tuple[int]): (left, upper, right, lower). Only decode the region covering it when possible, see
+            decode_region. None for the whole image. Default: None.
+
+    Returns:
+        tuple: (PIL.Image, (x, y)). The decoded image and its top-left position in the full image.
+    """
+    if is_hdr_path(path):
+        try:
+            return Image.fromarray(tone_map(read_high_bit_depth(path))), (0, 0)
+        except ImportError as error:
+            # OpenCV is optional, and only required by EXR / HDR images
+            raise ImportError(f'Cannot open {path}: {error}') from None
+    with open_file(path) as f:
+        if box is None:
+            img, origin = Image.open(f), (0, 0)
+            img.load()
+        else:
+            img, origin = decode_region(f, box)
+    if img.mode in HIGH_BIT_DEPTH_MODES:
+        img = Image.fromarray(tone_map(pil_to_array(img)))
+    return img, origin
+
+
+def crop_one_image(path,
+                   rects,
+                   patch_folder,
+                   enlarge_ratio=2,
+                   interpolation='bicubic',
+                   line_width=0,
+                   colors=('yellow', ),
+                   rect_folder=None,
+                   output_format='png',
+                   compress_level=1):
+    """Crop patches from one image, and draw the rectangles on it.
+
+    The image is decoded only once. All the patches and the rect image are from the decoded image.
+    When the rect image is not required, only the region covering the rectangles is decoded if possible.
+    Outputs are encoded by the writer of the current process, and saved when returning.
+
+    Args:
+        path (str): Image path.
+        rects (list[list[int]]): Rectangles. Each is (start_h, start_w, len_h, len_w).
+        colors (list[str]): Rectangle color for each rectangle.
+        Others are the same as crop_images.
+
+    Returns:
+        dict: Result, including the output paths, the time (in seconds), and the encoded bytes and encoding time.
+    """
+    result, futures = submit_crop_one_image(get_writer(), path, rects, patch_folder, enlarge_ratio, interpolation,
+                                            line_width, colors, rect_folder, output_format, compress_level)
+    return wait_outputs(result, futures)
+
+
+def submit_crop_one_image(writer,
+                          path,
+                          rects,
+                          patch_folder,
+                          enlarge_ratio=2,
+                          interpolation='bicubic',
+                          line_width=0,
+                          colors=('yellow', ),
+                          rect_folder=None,
+                          output_format='png',
+                          compress_level=1,
+                          decoded=None):
+    """Same as crop_one_image, but returns once the outputs are submitted to the writer.
+
+    Args:
+        decoded (ndarray): The decoded (h, w, 3) uint8 RGB image of path (e.g., from the image cache of the GUI),
+            so that the file is not decoded again. None for decoding the file. Default: None.
+        Others are the same as crop_one_image.
+
+    Returns:
+        tuple: (result, futures). Call wait_outputs to wait for the outputs and complete the result.
+    """
+    start_time = time.time()
+    box = (min(rect[1] for rect in rects), min(rect[0] for rect in rects), max(rect[1] + rect[3] for rect in rects),
+           max(rect[0] + rect[2] for rect in rects))
+    if decoded is not None:
+        if line_width > 0:
+            img, (origin_w, origin_h) = Image.fromarray(decoded), (0, 0)
+        else:
+            # only the region of the rectangles is copied
+            h, w = decoded.shape[:2]
+            x0, y0 = min(max(box[0], 0), w), min(max(box[1], 0), h)
+            img = Image.fromarray(decoded[y0:max(min(box[3], h), y0), x0:max(min(box[2], w), x0)])
+            origin_w, origin_h = x0, y0
+    else:
+        # rectangles are drawn on the whole image
+        img, (origin_w, origin_h) = open_image(path, None if line_width > 0 else box)
+    patch_paths, rect_path = get_output_paths(path, len(rects), patch_folder, line_width, rect_folder, output_format)
+    result = {'path': path, 'patch_paths': patch_paths, 'rect_path': rect_path, 'start_time': start_time}
+    futures = []
+
+    for idx, (start_h, start_w, len_h, len_w) in enumerate(rects):
+        # crop patch
+        start_h, start_w = start_h - origin_h, start_w - origin_w
+        patch = img.crop((start_w, start_h, start_w + len_w, start_h + len_h))
+        # enlarge patch if necessary
+        if enlarge_ratio > 1:
+            w, h = patch.size
+            patch = patch.resize((w * enlarge_ratio, h * enlarge_ratio), resample=INTERPOLATIONS[interpolation])
+        futures.append(writer.submit(patch, patch_paths[idx], output_format, compress_level))
+
+    # draw rectangles
+    if line_width > 0:
+        # patches have been cropped, so draw on the decoded image directly when it is already RGB
+        img_rect = img if img.mode == 'RGB' else img.convert('RGB')
+        draw = ImageDraw.Draw(img_rect)
+        for (start_h, start_w, len_h, len_w), color in zip(rects, colors):
+            draw.rectangle(((start_w, start_h), (start_w + len_w, start_h + len_h)),
+                           outline=COLOR_TABLE[color],
+                           width=line_width)
+        futures.append(writer.submit(img_rect, rect_path, output_format, compress_level))
+    return result, futures
+
+
+def get_output_paths(path, num_rects, patch_folder, line_width=0, rect_folder=None, output_format='png'):
+    """Output paths of crop_one_image.
+
+    Returns:
+        tuple: (patch_paths, rect_path). rect_path is None when not drawing rectangles.
+    """
+    base_name = os.path.splitext(os.path.basename(path))[0]
+    ext = OUTPUT_FORMATS[output_format][0]
+    if num_rects == 1:
+        patch_paths = [os.path.join(patch_folder, f'{base_name}_patch{ext}')]
+    else:
+        patch_paths = [os.path.join(patch_folder, f'{base_name}_patch{idx}{ext}') for idx in range(num_rects)]
+    rect_path = os.path.join(rect_folder, f'{base_name}_rect{ext}') if line_width > 0 else None
+    return patch_paths, rect_path
+
+
+def wait_outputs(result, futures):
+    """Wait for the outputs submitted by submit_crop_one_image, and complete the result."""
+    outputs = [future.result() for future in futures]
+    result['bytes'] = sum(output['bytes'] for output in outputs)
+    result['encode_time'] = sum(output['time'] for output in outputs)
+    result['time'] = time.time() - result.pop('start_time')
+    return result
+
+
+def get_encode_stats(results):
+    """Summarize the encoding of crop results.
+
+    Returns:
+        dict: Number of output files, encoded bytes, encoding time (summed over threads) and throughput (MB/s).
+    """
+    num_files = sum(len(result['patch_paths']) + (result['rect_path'] is not None) for result in results)
+    num_bytes = sum(result['bytes'] for result in results)
+    encode_time = sum(result['encode_time'] for result in results)
+    throughput = num_bytes / 1024 / 1024 / encode_time if encode_time > 0 else 0
+    return {'num_files': num_files, 'bytes': num_bytes, 'encode_time': encode_time, 'throughput': throughput}
+
+
+def _parse_crop_args(rect_pos, interpolation, color, output_format='png'):
+    if isinstance(rect_pos[0], int):
+        rects = [list(rect_pos)]
+    else:
+        rects = [list(rect) for rect in rect_pos]
+    colors = [color] * len(rects) if isinstance(color, str) else list(color)
+    for name in colors:
+        if name not in COLOR_TABLE:
+            raise ValueError(f'Unsupported color: {name}')
+    if interpolation not in INTERPOLATIONS:
+        raise ValueError(f'Unsupported interpolation: {interpolation}')
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError(f'Unsupported output format: {output_format}')
+    if output_format == 'webp' and not features.check('webp'):
+        raise ValueError('Pillow is built without WebP support')
+    return rects, colors
+
+
+def run_crop_tasks(tasks, num_workers=None, progress_callback=None, decoded=None):
+    """Run crop_one_image for tasks in a process pool. In the current process, when num_workers <= 1.
+
+    Args:
+        tasks (list[tuple]): Each is (path, kwargs) for crop_one_image.
+        num_workers (int): See crop_images.
+        progress_callback (func): See crop_images.
+        decoded (dict): See crop_images.
+
+    Returns:
+        list[dict]: Result for each task, in the order of tasks.
+    """
+    if num_workers is None:
+        num_workers = os.cpu_count() or 1
+    num_workers = min(num_workers, len(tasks))
+
+    if num_workers <= 1:
+        return _run_crop_tasks_in_process(tasks, progress_callback, decoded)
+
+    # each worker crops a chunk of consecutive images, so that it also decodes the next image while the outputs of
+    # the previous image are being encoded. Chunks are small enough to balance the workers
+    chunk_size = min(-(-len(tasks) // (num_workers * 2)), 8)
+    chunks = [tasks[idx:idx + chunk_size] for idx in range(0, len(tasks), chunk_size)]
+    num_done = 0
+
+    def chunk_progress_callback(num_chunks_done, num_chunks, chunk_results):
+        nonlocal num_done
+        for result in chunk_results:
+            num_done += 1
+            progress_callback(num_done, len(tasks), result)
+
+    chunk_results = run_in_pool(crop_image_chunk, [(chunk, {}) for chunk in chunks], num_workers,
+                                chunk_progress_callback if progress_callback is not None else None)
+    return [result for results in chunk_results for result in results]
+
+
+def crop_image_chunk(tasks):
+    """Run crop tasks in a worker process of run_crop_tasks.
+
+    Returns:
+        list[dict]: Result for each task, in the order of tasks.
+    """
+    return _run_crop_tasks_in_process(tasks)
+
+
+def _run_crop_tasks_in_process(tasks, progress_callback=None, decoded=None):
+    # decode the next image while the outputs of the previous image are being encoded
+    results = [None] * len(tasks)
+    writer = get_writer()
+    pending = None
+    for idx in range(len(tasks) + 1):
+        if idx < len(tasks):
+            path, kwargs = tasks[idx]
+            submitted = submit_crop_one_image(writer, path, decoded=decoded.get(path) if decoded else None, **kwargs)
+        else:
+            submitted = None
+        if pending is not None:
+            results[idx - 1] = wait_outputs(*pending)
+            if progress_callback is not None:
+                progress_callback(idx, len(tasks), results[idx - 1])
+        pending = submitted
+    return results
+
+
+def run_in_pool(func, tasks, num_workers, progress_callback=None):
+    """Run func for tasks in a process pool.
+
+    Args:
+        func (func): A module-level function, so that it can be pickled.
+        tasks (list[tuple]): Each is (arg, kwargs) for func(arg, **kwargs).
+        num_workers (int): Number of worker processes.
+        progress_callback (func): Called after each task with (num_done, num_total, result). Default: None.
+
+    Returns:
+        list: Result for each task, in the order of tasks.
+    """
+    results = [None] * len(tasks)
+    # spawn (rather than fork) workers, as the GUI process has other threads running. Spawned workers do not
+    # inherit module states, so the layouts of arrays (e.g., the frame size of a .yuv file) are passed to them
+    executor = ProcessPoolExecutor(
+        num_workers,
+        mp_context=multiprocessing.get_context('spawn'),
+        initializer=set_array_layouts,
+        initargs=(get_array_layouts(), ))
+    futures = {}
+    try:
+        futures = {executor.submit(func, arg, **kwargs): idx for idx, (arg, kwargs) in enumerate(tasks)}
+        for num_done, future in enumerate(as_completed(futures), 1):
+            idx = futures[future]
+            results[idx] = future.result()
+            if progress_callback is not None:
+                progress_callback(num_done, len(tasks), results[idx])
+    finally:
+        for future in futures:
+            future.cancel()
+        executor.shutdown(wait=True)
+    return results
+
+
+def crop_images(img_list,
+                rect_pos,
+                patch_folder,
+                enlarge_ratio=2,
+                interpolation='bicubic',
+                line_width=0,
+                color='yellow',
+                rect_folder=None,
+                output_format='png',
+                compress_level=1,
+                num_workers=None,
+                progress_callback=None,
+                decoded=None):
+    """Crop patches from images, and draw rectangles on images.
+
+    Images are processed in parallel by a process pool. Each image is decoded
+    once, and all the patches and the rect image are from the decoded image.
+    Without drawing rectangles (line_width=0), only the region of the
+    rectangles is decoded for the formats supporting it (see decode_region).
+    Outputs are encoded by writer threads (see OutputWriter).
+
+    Args:
+        img_list (list[str]): Image paths.
+        rect_pos (list[int] | list[list[int]]): One rectangle (start_h, start_w, len_h, len_w),
+            or a list of rectangles.
+        patch_folder (str): Folder for the cropped patches.
+        enlarge_ratio (int): Enlarge ratio for patches. Default: 2.
+        interpolation (str): Interpolation for enlarging: bicubic | bilinear | nearest. Default: 'bicubic'.
+        line_width (int): Line width of the rectangles. 0 for not drawing rectangles. Default: 0.
+        color (str | list[str]): Rectangle color in COLOR_TABLE, or a color for each rectangle. Default: 'yellow'.
+        rect_folder (str): Folder for the images with rectangles. Default: None.
+        output_format (str): Output format: png | webp | tiff. Default: 'png'.
+        compress_level (int): 0 (fastest) to 9 (smallest), see save_image. Default: 1.
+        num_workers (int): Number of worker processes. None for the number of CPU cores, and 0 for processing in
+            the current process. Default: None.
+        progress_callback (func): Called after each image with (num_done, num_total, result). Default: None.
+        decoded (dict): Decoded images, path -> (h, w, 3) uint8 RGB array (e.g., views of the image cache of the
+            GUI). These images are not decoded again. Only used when processing in the current process, as worker
+            processes do not share memory. Default: None.
+
+    Returns:
+        list[dict]: Result for each image, in the order of img_list.
+    """
+    rects, colors = _parse_crop_args(rect_pos, interpolation, color, output_format)
+
+    # make temp folder
+    os.makedirs(patch_folder, exist_ok=True)
+    if line_width > 0:
+        os.makedirs(rect_folder, exist_ok=True)
+
+    kwargs = dict(
+        rects=rects,
+        patch_folder=patch_folder,
+        enlarge_ratio=enlarge_ratio,
+        interpolation=interpolation,
+        line_width=line_width,
+        colors=colors,
+        rect_folder=rect_folder,
+        output_format=output_format,
+        compress_level=compress_level)
+    return run_crop_tasks([(path, kwargs) for path in img_list], num_workers, progress_callback, decoded)
+
+
+def align_folders(path_lists, align='index'):
+    """Align images in several folders.
+
+    Args:
+        path_lists (list[list[str]]): Image paths of each folder.
+        align (str): 'index': the i-th images of all folders are aligned. Folders are truncated to the shortest.
+            'name': images with the same name (without extension) are aligned. Names not in all the folders are
+            skipped. Default: 'index'.
+
+    Returns:
+        list[list[str]]: Aligned image paths of each folder, with the same length.
+    """
+    if align == 'index':
+        length = min(len(paths) for paths in path_lists)
+        return [list(paths[:length]) for paths in path_lists]
+    elif align == 'name':
+        name_dicts = [{os.path.splitext(os.path.basename(path))[0]: path for path in paths} for paths in path_lists]
+        names = [name for name in name_dicts[0] if all(name in name_dict for name_dict in name_dicts[1:])]
+        return [[name_dict[name] for name in names] for name_dict in name_dicts]
+    raise ValueError(f'Unsupported align mode: {align}')
+
+
+def get_folder_names(folders):
+    """Names of the output sub folders for folders. Duplicated base names are suffixed by the folder index."""
+    names = [os.path.basename(os.path.normpath(folder)) for folder in folders]
+    return [f'{name}_{idx}' if names.count(name) > 1 else name for idx, name in enumerate(names)]
+
+
+def get_crop_tasks(path_lists,
+                   rect_pos,
+                   patch_folder,
+                   enlarge_ratio=2,
+                   interpolation='bicubic',
+                   line_width=0,
+                   color='yellow',
+                   rect_folder=None,
+                   output_format='png',
+                   compress_level=1,
+                   folder_names=None,
+                   align='index'):
+    """Get the tasks of cropping several folders, for run_crop_tasks. Output folders are created.
+
+    Arguments are the same as crop_folders.
+
+    Returns:
+        tuple: (tasks, path_lists). Tasks (list[tuple]) are in the order of the aligned path_lists.
+    """
+    rects, colors = _parse_crop_args(rect_pos, interpolation, color, output_format)
+    path_lists = align_folders(path_lists, align)
+    if folder_names is None:
+        folder_names = get_folder_names([os.path.dirname(paths[0]) if paths else '' for paths in path_lists])
+
+    tasks = []
+    for paths, name in zip(path_lists, folder_names):
+        kwargs = dict(
+            rects=rects,
+            patch_folder=os.path.join(patch_folder, name),
+            enlarge_ratio=enlarge_ratio,
+            interpolation=interpolation,
+            line_width=line_width,
+            colors=colors,
+            rect_folder=os.path.join(rect_folder, name) if line_width > 0 else None,
+            output_format=output_format,
+            compress_level=compress_level)
+        os.makedirs(kwargs['patch_folder'], exist_ok=True)
+        if line_width > 0:
+            os.makedirs(kwargs['rect_folder'], exist_ok=True)
+        tasks.extend((path, kwargs) for path in paths)
+    return tasks, path_lists
+
+
+def crop_folders(path_lists,
+                 rect_pos,
+                 patch_folder,
+                 enlarge_ratio=2,
+                 interpolation='bicubic',
+                 line_width=0,
+                 color='yellow',
+                 rect_folder=None,
+                 output_format='png',
+                 compress_level=1,
+                 folder_names=None,
+                 align='index',
+                 num_workers=None,
+                 progress_callback=None,
+                 decoded=None):
+    """Crop the same rectangles from several folders (e.g., GT and the results of different methods) in one run.
+
+    Images of all the folders are scheduled together on one process pool. Outputs of each folder are saved in a
+    sub folder of patch_folder (and rect_folder).
+
+    Args:
+        path_lists (list[list[str]]): Image paths of each folder.
+        folder_names (list[str]): Names of the output sub folders. None for get_folder_names with the folders of
+            the first images. '' for saving in patch_folder (and rect_folder) directly. Default: None.
+        align (str): Align mode, see align_folders. Default: 'index'.
+        Others are the same as crop_images. progress_callback counts the images of all folders.
+
+    Returns:
+        list[list[dict]]: Results of each folder, in the order of the aligned images.
+    """
+    tasks, path_lists = get_crop_tasks(
+        path_lists,
+        rect_pos,
+        patch_folder,
+        enlarge_ratio=enlarge_ratio,
+        interpolation=interpolation,
+        line_width=line_width,
+        color=color,
+        rect_folder=rect_folder,
+        output_format=output_format,
+        compress_level=compress_level,
+        folder_names=folder_names,
+        align=align)
+    results = run_crop_tasks(tasks, num_workers, progress_callback, decoded)
+    return split_results(results, path_lists)
+
+
+def split_results(results, path_lists):
+    """Split the results of run_crop_tasks by folders."""
+    folder_results, start = [], 0
+    for paths in path_lists:
+        folder_results.append(results[start:start + len(paths)])
+        start += len(paths)
+    return folder_results
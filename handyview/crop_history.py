@@ -0,0 +1,162 @@
+"""
+Crop history: each crop run is appended as one json line to history_crop.jsonl in the user cache dir
+(~/.cache/handyview), with all the parameters, the input images, the outputs and the timings, so that it can be
+replayed by the crop engine.
+"""
+import json
+import os
+import time
+import uuid
+
+from handyview.crop import _parse_crop_args, get_crop_tasks, get_encode_stats, get_output_paths, run_crop_tasks
+from handyview.sources import getmtime
+from handyview.utils import CACHE_DIR
+
+# not in the installed package, which may be read-only or shared by users
+CROP_HISTORY_PATH = os.path.join(CACHE_DIR, 'history_crop.jsonl')
+
+# keys of the crop results saved in records
+OUTPUT_KEYS = ('path', 'patch_paths', 'rect_path', 'time')
+
+
+def make_crop_record(path_lists,
+                     results,
+                     total_time,
+                     rect_pos,
+                     patch_folder,
+                     enlarge_ratio=2,
+                     interpolation='bicubic',
+                     line_width=0,
+                     color='yellow',
+                     rect_folder=None,
+                     output_format='png',
+                     compress_level=1,
+                     folder_names=None,
+                     align='index',
+                     name=None):
+    """Make a history record of a crop run.
+
+    Args:
+        path_lists (list[list[str]]): Image paths of each folder. For crop_images, it is [img_list].
+        results (list[dict]): Results of all the images, in the order of the aligned images.
+        total_time (float): Time of the run in seconds.
+        folder_names (list[str]): Names of the output sub folders. For crop_images, it is [''].
+        name (str): Name of the run, e.g., the job name in a job spec. Default: None.
+        Others are the same as crop.crop_folders.
+
+    Returns:
+        dict: Record.
+    """
+    rects, _ = _parse_crop_args(rect_pos, interpolation, color, output_format)
+    return dict(
+        id=f'{time.strftime("%Y%m%d-%H%M%S", time.localtime())}-{uuid.uuid4().hex[:6]}',
+        name=name,
+        path_lists=path_lists,
+        folder_names=folder_names,
+        align=align,
+        rects=rects,
+        enlarge_ratio=enlarge_ratio,
+        interpolation=interpolation,
+        line_width=line_width,
+        color=color,
+        patch_folder=os.path.abspath(patch_folder),
+        rect_folder=os.path.abspath(rect_folder) if rect_folder else None,
+        output_format=output_format,
+        compress_level=compress_level,
+        outputs=[{
+            key: result[key]
+            for key in OUTPUT_KEYS
+        } for result in results],
+        total_time=total_time,
+        encode=get_encode_stats(results))
+
+
+def append_crop_record(record, history_path=None):
+    """Append a record to the crop history."""
+    history_path = history_path or CROP_HISTORY_PATH
+    os.makedirs(os.path.dirname(os.path.abspath(history_path)), exist_ok=True)
+    with open(history_path, 'a', encoding='utf-8') as f:
+        f.write(json.dumps(record) + '\n')
+
+
+def load_crop_records(history_path=None):
+    """Load the records in the crop history. Broken lines (e.g., from an interrupted write) are skipped."""
+    history_path = history_path or CROP_HISTORY_PATH
+    if not os.path.exists(history_path):
+        return []
+    records = []
+    with open(history_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                pass
+    return records
+
+
+def is_up_to_date(path, output_paths):
+    """Whether all the outputs exist and are newer than the source image."""
+    try:
+        src_mtime = getmtime(path)
+        return all(os.path.getmtime(output_path) >= src_mtime for output_path in output_paths)
+    except OSError:
+        return False
+
+
+def get_replay_tasks(record, force=False):
+    """Get the crop tasks of a record, for run_crop_tasks. Output folders are created.
+
+    Args:
+        record (dict): Record.
+        force (bool): Whether to crop images whose outputs are up to date. Default: False.
+
+    Returns:
+        tuple: (tasks, num_skipped).
+    """
+    tasks, _ = get_crop_tasks(
+        record['path_lists'],
+        record['rects'],
+        record['patch_folder'],
+        enlarge_ratio=record['enlarge_ratio'],
+        interpolation=record['interpolation'],
+        line_width=record['line_width'],
+        color=record['color'],
+        rect_folder=record['rect_folder'],
+        output_format=record['output_format'],
+        compress_level=record['compress_level'],
+        folder_names=record['folder_names'],
+        align=record['align'])
+    if force:
+        return tasks, 0
+    outdated = []
+    for path, kwargs in tasks:
+        patch_paths, rect_path = get_output_paths(path, len(kwargs['rects']), kwargs['patch_folder'],
+                                                  kwargs['line_width'], kwargs['rect_folder'], kwargs['output_format'])
+        if not is_up_to_date(path, patch_paths + ([rect_path] if rect_path else [])):
+            outdated.append((path, kwargs))
+    return outdated, len(tasks) - len(outdated)
+
+
+def replay_crop_records(records, force=False, num_workers=None, progress_callback=None):
+    """Replay crop records. Images of all the records are scheduled together on one process pool.
+
+    Args:
+        records (list[dict]): Records.
+        force (bool): Whether to crop images whose outputs are up to date. Default: False.
+        num_workers (int): See crop.crop_images.
+        progress_callback (func): See crop.crop_images.
+
+    Returns:
+        list[dict]: For each record, its id, the number of skipped images, and the results of the cropped images.
+    """
+    tasks, replays = [], []
+    for record in records:
+        record_tasks, num_skipped = get_replay_tasks(record, force)
+        tasks.extend(record_tasks)
+        replays.append(dict(id=record['id'], name=record.get('name'), num_skipped=num_skipped, num=len(record_tasks)))
+    results = run_crop_tasks(tasks, num_workers, progress_callback)
+    start = 0
+    for replay in replays:
+        replay['results'] = results[start:start + replay.pop('num')]
+        start += len(replay['results'])
+    return replays
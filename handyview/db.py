@@ -1,9 +1,9 @@
-import hashlib
-import imagehash
 import os
 from PIL import Image, ImageFile
 
-from handyview.utils import FORMATS, ROOT_DIR, get_img_list, scandir, sizeof_fmt
+from handyview.image_cache import get_image_cache
+from handyview.sources import get_source_error, is_source, normalize_source_path
+from handyview.utils import FORMATS, ROOT_DIR, get_img_list, scandir
 from handyview.widgets import show_msg
 
 # for loading large image file
@@ -40,6 +40,10 @@ class HVDB():
 
         # for selection pos in crop canvas
         self.selection_pos = [0, 0, 0, 0]
+        # shown channel (see channels.CHANNEL_MODES), kept when browsing and switching canvases
+        self.channel_mode = 'RGB'
+        # target frame rate of playback, kept when switching canvases
+        self.playback_fps = 24
 
         self.recursive_scan_folder = False
 
@@ -47,11 +51,14 @@ class HVDB():
 
     def get_init_path_list(self):
         """get path list when first launch (double click or from cmd)"""
-        # if init_path is a folder, try to get the first image
-        if os.path.isdir(self.init_path):
+        self.init_path = normalize_source_path(self.init_path)
+        # if init_path is a folder (or a source, e.g., an archive), try to get the first image
+        if os.path.isdir(self.init_path) or is_source(self.init_path):
             self.recursive_scan_folder = True
             self.path_list[0] = list(scandir(self.init_path, suffix=FORMATS, recursive=True, full_path=True))
-            self.init_path = self.path_list[0][0]
+            # no images (e.g., an empty archive) is reported as a wrong path below
+            if self.path_list[0]:
+                self.init_path = self.path_list[0][0]
         else:
             self.recursive_scan_folder = False
 
@@ -77,7 +84,9 @@ class HVDB():
             # save open file history
             self.save_open_history()
         else:
-            show_msg('Critical', 'Critical', f'Wrong init path! {self.init_path}')
+            # e.g., compressed tar archives
+            error = get_source_error(self.init_path)
+            show_msg('Critical', 'Critical', f'Wrong init path! {self.init_path}' + (f'\n{error}' if error else ''))
 
     def save_open_history(self):
         try:
@@ -117,6 +126,21 @@ class HVDB():
                 self._pidx = self.get_path_len() - 1
 
     def add_cmp_folder(self, cmp_path):
+        """Add the folder of cmp_path (or the source itself, e.g., an archive) as a compare folder.
+
+        Raises:
+            ValueError: The source cannot be opened (e.g., a compressed tar), or has no images.
+        """
+        cmp_path = normalize_source_path(cmp_path)
+        if is_source(cmp_path):
+            # use the first image to locate the folder in the source
+            first_path = next(scandir(cmp_path, suffix=FORMATS, recursive=True, full_path=True), None)
+            if first_path is None:
+                raise ValueError(f'No images in {cmp_path}')
+            cmp_path = first_path
+        elif get_source_error(cmp_path) is not None:
+            # e.g., compressed tar archives
+            raise ValueError(get_source_error(cmp_path))
         folder = os.path.dirname(cmp_path)
         self.folder_list.append(folder)
         paths = get_img_list(folder, self._include_names, self._exclude_names, self._exact_exclude_names)
@@ -151,6 +175,22 @@ class HVDB():
                 self.is_same_len = False
         return self.is_same_len, img_len_list
 
+    def reorder(self, path_orders):
+        """Reorder images of each folder (e.g., sorted by metrics).
+
+        Args:
+            path_orders (list[list[str]]): Ordered paths of each folder, aligned across folders (e.g., by name), so
+                that the i-th images of all the folders are still aligned after reordering. Images not in it (e.g.,
+                names missing in other folders) are kept at the end, in their original order.
+        """
+        for fidx, ordered in enumerate(path_orders[:len(self.path_list)]):
+            index_dict = {path: idx for idx, path in enumerate(self.path_list[fidx])}
+            indices = [index_dict[path] for path in ordered if path in index_dict]
+            chosen = set(indices)
+            indices += [idx for idx in range(len(self.path_list[fidx])) if idx not in chosen]
+            for lists in (self.path_list, self.file_size_list, self.md5_list, self.phash_list):
+                lists[fidx] = [lists[fidx][idx] for idx in indices]
+
     def get_folder(self, folder=None, fidx=None):
         if folder is None:
             if fidx is None:
@@ -168,52 +208,49 @@ class HVDB():
             fidx += self.get_folder_len()
         fidx = fidx % self.get_folder_len()
 
+        # folders may have different lengths
         if pidx < 0:
-            pidx += self.get_path_len()
-        pidx = pidx % self.get_path_len()
+            pidx += self.get_path_len(fidx)
+        pidx = pidx % self.get_path_len(fidx)
 
         path = self.path_list[fidx][pidx]
         return path, fidx, pidx
 
     def get_shape(self, fidx=None, pidx=None):
         path = self.get_path(fidx, pidx)[0]
-        try:
-            with Image.open(path) as lazy_img:
-                width, height = lazy_img.size
-        except FileNotFoundError:
-            show_msg('Critical', 'Critical', f'Cannot open {path}')
-        return width, height
+        # from the image cache. Images and their information are read by the image loader
+        entry = get_image_cache().get_entry(path)
+        if not entry.qimg.isNull():
+            return entry.qimg.width(), entry.qimg.height()
+        # read from the header for the formats that Qt cannot decode. (0, 0) while loading
+        return entry.info.get('shape', (0, 0))
 
     def get_color_type(self, fidx=None, pidx=None):
         path = self.get_path(fidx, pidx)[0]
-        try:
-            with Image.open(path) as lazy_img:
-                color_type = lazy_img.mode
-        except FileNotFoundError:
-            show_msg('Critical', 'Critical', f'Cannot open {path}')
-        return color_type
+        return get_image_cache().get_entry(path).info.get('color_type', 'Unknown')
 
     def get_file_size(self, fidx=None, pidx=None):
         path, fidx, pidx = self.get_path(fidx, pidx)
         file_size = self.file_size_list[fidx][pidx]
         if file_size is None:
-            file_size = sizeof_fmt(os.path.getsize(path))
+            file_size = get_image_cache().get_entry(path).info.get('file_size')
+            if file_size is None:
+                # not loaded yet, or failed to read
+                return 'Unknown'
             self.file_size_list[fidx][pidx] = file_size
         return file_size
 
     def get_fingerprint(self, fidx=None, pidx=None):
+        """(md5, phash) of an image, computed by the image loader. (None, None) if they are not computed (e.g.,
+        missing files)."""
         path, fidx, pidx = self.get_path(fidx, pidx)
-        # md5
-        md5 = self.md5_list[fidx][pidx]
-        if md5 is None:
-            data = open(path, 'rb').read()
-            md5 = hashlib.md5(data).hexdigest()
-            self.md5_list[fidx][pidx] = md5
-        # phash (perceptual hash)
-        phash = self.phash_list[fidx][pidx]
-        if phash is None:
-            phash = imagehash.phash(Image.open(path))
-            self.phash_list[fidx][pidx] = phash
+        md5, phash = self.md5_list[fidx][pidx], self.phash_list[fidx][pidx]
+        if md5 is None or phash is None:
+            info = get_image_cache().get_entry(path).info
+            if 'md5' not in info:
+                return None, None
+            md5, phash = info['md5'], info['phash']
+            self.md5_list[fidx][pidx], self.phash_list[fidx][pidx] = md5, phash
         return (md5, phash)
 
     def get_folder_len(self):
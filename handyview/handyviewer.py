@@ -1,3 +1,4 @@
+import multiprocessing
 import os
 import sys
 from PyQt5 import QtCore
@@ -6,10 +7,19 @@ from PyQt5.QtWidgets import (QApplication, QDockWidget, QFileDialog, QGridLayout
                              QMainWindow, QTabWidget, QToolBar, QVBoxLayout, QWidget)
 
 import handyview.actions as actions
+from handyview.batch_metrics import evaluate_folders, get_metric_gaps, sort_by_gap
 from handyview.canvas import Canvas
-from handyview.canvas_crop import CanvasCrop
+from handyview.canvas_crop import CanvasCrop, CropWorker
+from handyview.canvas_preview import CanvasPreview
 from handyview.canvas_video import CanvasVideo
+from handyview.channels import CHANNEL_MODES
 from handyview.db import HVDB
+from handyview.image_cache import get_image_cache
+from handyview.image_loader import get_image_loader
+from handyview.patch_preview import PatchPreview
+from handyview.roi_panel import RoiStatsPanel
+from handyview.sources import (ARRAY_LAYOUTS, YUV_PIX_FMTS, get_array_layout, parse_yuv_name, set_array_layout,
+                               split_array_path)
 from handyview.utils import ROOT_DIR
 from handyview.widgets import HLine, MessageDialog, show_msg
 
@@ -90,10 +100,16 @@ class MainWindow(QMainWindow):
                 self.empty = True
         # initialize HVDB (handyview database), which stores the path info
         self.hvdb = HVDB(init_path)
+        if self.hvdb.get_path_len() == 0:
+            # no images in the init path (e.g., an empty or compressed archive), which has been reported by HVDB
+            self.hvdb = HVDB(os.path.join(ROOT_DIR, 'icon.png'))
+            self.empty = True
 
         self.full_screen = False
         self.canvas_type = 'main'
         self.center_canvas = CenterWidget(self, self.hvdb)
+        # background worker of sort_by_metric_gap
+        self.metrics_worker = None
 
         # initialize UI
         # read version from file
@@ -104,6 +120,8 @@ class MainWindow(QMainWindow):
         self.init_toolbar()
         # self.init_statusbar()
         self.init_central_window()
+        self.add_patch_dock_window()
+        self.add_roi_dock_window()
         self.add_dock_window()
 
     def init_menubar(self):
@@ -117,6 +135,7 @@ class MainWindow(QMainWindow):
         file_menu.addSeparator()
         file_menu.addAction(actions.refresh(self))
         file_menu.addAction(actions.goto_index(self))
+        file_menu.addAction(actions.set_array_layout(self))
         file_menu.addSeparator()
         file_menu.addAction(actions.include_file_name(self))
         file_menu.addAction(actions.exclude_file_name(self))
@@ -132,6 +151,11 @@ class MainWindow(QMainWindow):
         compare_menu.addAction(actions.compare(self))
         compare_menu.addAction(actions.clear_compare(self))
         compare_menu.addAction(actions.set_fingerprint(self))
+        compare_menu.addAction(actions.toggle_metrics(self))
+        compare_menu.addAction(actions.toggle_diff(self))
+        compare_menu.addAction(actions.sort_by_metric_gap(self))
+        compare_menu.addAction(actions.toggle_wipe_compare(self))
+        compare_menu.addAction(actions.toggle_flicker_compare(self))
 
         # Layouts
         layout_menu = menubar.addMenu('&Layout(布局)')
@@ -148,6 +172,17 @@ class MainWindow(QMainWindow):
         # View
         layout_menu = menubar.addMenu('&View(查看)')
         layout_menu.addAction(actions.auto_zoom_dialog(self))
+        layout_menu.addAction(actions.toggle_patch_preview(self))
+        layout_menu.addAction(actions.toggle_roi_stats(self))
+        layout_menu.addAction(actions.cycle_hover_neighborhood(self))
+        layout_menu.addAction(actions.toggle_pixel_values(self))
+        layout_menu.addAction(actions.increase_exposure(self))
+        layout_menu.addAction(actions.decrease_exposure(self))
+        layout_menu.addAction(actions.toggle_display_gamma(self))
+        layout_menu.addAction(actions.next_channel_mode(self))
+        layout_menu.addAction(actions.previous_channel_mode(self))
+        layout_menu.addAction(actions.toggle_playback(self))
+        layout_menu.addAction(actions.set_playback_fps(self))
 
         # Help
         help_menu = menubar.addMenu('&Help(帮助)')
@@ -228,6 +263,7 @@ class MainWindow(QMainWindow):
         color_grid.addWidget(self.center_canvas.canvas.mouse_color_title, 0, 0, 1, 1)
         color_grid.addWidget(self.center_canvas.canvas.mouse_color_label, 0, 1, 1, 3)
         color_grid.addWidget(self.center_canvas.canvas.mouse_rgb_label, 1, 0, 1, 3)
+        color_grid.addWidget(self.center_canvas.canvas.mouse_neighbor_label, 2, 0, 1, 4)
         layout.addLayout(color_grid, 2, 0, 1, 3)
         layout.addWidget(HLine(), 3, 0, 1, 3)
         layout.addWidget(self.center_canvas.canvas.selection_pos_label, 4, 0, 1, 3)
@@ -249,6 +285,52 @@ class MainWindow(QMainWindow):
 
         self.addDockWidget(QtCore.Qt.RightDockWidgetArea, self.dock_info)
 
+        # the main canvas is re-created when switching canvas
+        self.center_canvas.canvas.image_changed.connect(self.patch_preview.schedule_update)
+        self.center_canvas.canvas.qviews[0].selection_signal.connect(self.patch_preview.schedule_update)
+        self.center_canvas.canvas.image_changed.connect(self.roi_panel.schedule_update)
+        self.center_canvas.canvas.qviews[0].selection_signal.connect(self.roi_panel.schedule_update)
+
+    def add_patch_dock_window(self):
+        # live preview of the enlarged patches in the selection rect. Hidden by default
+        self.dock_patch = QDockWidget('Patch Preview', self)
+        self.dock_patch.setAllowedAreas(QtCore.Qt.LeftDockWidgetArea | QtCore.Qt.RightDockWidgetArea)
+        self.dock_patch.setFeatures(QDockWidget.DockWidgetMovable
+                                    | QDockWidget.DockWidgetFloatable
+                                    | QDockWidget.DockWidgetClosable)
+        self.patch_preview = PatchPreview(self, self.hvdb)
+        self.dock_patch.setWidget(self.patch_preview)
+        self.addDockWidget(QtCore.Qt.RightDockWidgetArea, self.dock_patch)
+        self.dock_patch.hide()
+
+    def toggle_patch_preview(self):
+        self.dock_patch.setVisible(not self.dock_patch.isVisible())
+
+    def add_roi_dock_window(self):
+        # live statistics of the selection rect. Hidden by default
+        self.dock_roi = QDockWidget('ROI Statistics', self)
+        self.dock_roi.setAllowedAreas(QtCore.Qt.LeftDockWidgetArea | QtCore.Qt.RightDockWidgetArea)
+        self.dock_roi.setFeatures(QDockWidget.DockWidgetMovable
+                                  | QDockWidget.DockWidgetFloatable
+                                  | QDockWidget.DockWidgetClosable)
+        self.roi_panel = RoiStatsPanel(self, self.hvdb)
+        self.dock_roi.setWidget(self.roi_panel)
+        self.addDockWidget(QtCore.Qt.RightDockWidgetArea, self.dock_roi)
+        self.dock_roi.hide()
+
+    def toggle_roi_stats(self):
+        self.dock_roi.setVisible(not self.dock_roi.isVisible())
+
+    def cycle_hover_neighborhood(self):
+        # pixel values under the cursor are only shown in the main canvas
+        if self.canvas_type != 'main':
+            self.switch_main_canvas()
+        hover_inspector = self.center_canvas.canvas.hover_inspector
+        sizes = (0, 3, 5, 7)
+        size = sizes[(sizes.index(hover_inspector.neighbor_size) + 1) % len(sizes)]
+        hover_inspector.set_neighbor_size(size)
+        self.set_statusbar(f'Hover neighborhood: {size}x{size}' if size else 'Hover neighborhood: off')
+
     # ---------------------------------------
     # slots: open and history
     # ---------------------------------------
@@ -297,6 +379,48 @@ class MainWindow(QMainWindow):
         self.center_canvas.canvas.update_path_list()
         self.center_canvas.canvas.show_image(init=False)
 
+    def set_array_layout(self):
+        """Set the layout of the current .npy array (the axes of an image), or the frame size and pixel format of
+        the current .yuv file. Then the file is opened again with the layout."""
+        if self.canvas_type != 'main':
+            self.switch_main_canvas()
+        root = split_array_path(self.hvdb.get_path()[0])[0]
+        if root is None:
+            show_msg('Warning', 'Warning!', 'The current image is not in a .npy or .yuv file.')
+            return
+        layout = get_array_layout(root)
+        if root.endswith(('.npy', '.NPY')):
+            items = ['Auto'] + list(ARRAY_LAYOUTS)
+            current = items.index(layout['layout']) if 'layout' in layout else 0
+            text, ok = QInputDialog.getItem(self, 'Array Layout', 'Axes of an image (leading axes are frames):', items,
+                                            current, False)
+            if not ok:
+                return
+            set_array_layout(root, layout=None if text == 'Auto' else text)
+        else:
+            options = parse_yuv_name(root)
+            options.update(layout)
+            width, height = options.get('width', 1920), options.get('height', 1080)
+            default = f'{width}x{height} {options["pix_fmt"]} {options["matrix"]}'
+            pix_fmts = ', '.join(YUV_PIX_FMTS)
+            text, ok = QInputDialog.getText(self, 'YUV Layout',
+                                            f'Frame size, pixel format ({pix_fmts}) and matrix (bt601, bt709):',
+                                            QLineEdit.Normal, default)
+            if not ok:
+                return
+            options = parse_yuv_name(text)
+            if 'width' not in options:
+                show_msg('Warning', 'Warning!', f'Cannot find the frame size (e.g., 1920x1080) in {text}.')
+                return
+            set_array_layout(root, **options)
+        # frames are decoded again with the new layout
+        get_image_cache().clear()
+        get_image_loader().clear()
+        self.hvdb.init_path = root
+        self.hvdb.get_init_path_list()
+        self.center_canvas.canvas.show_image(init=True)
+        self.center_canvas.canvas_crop.update_db(self.hvdb)
+
     def goto_index(self):
         index, ok = QInputDialog.getText(self, 'Go to index', 'Index:', QLineEdit.Normal, '1')
         if ok:
@@ -355,7 +479,8 @@ class MainWindow(QMainWindow):
         if self.canvas_type != 'main':
             self.switch_main_canvas()
 
-        key, ok = QFileDialog.getOpenFileName(self, 'Select an image', os.path.join(self.hvdb.get_folder(), '../'))
+        key, ok = QFileDialog.getOpenFileName(self, 'Select an image',
+                                              os.path.normpath(os.path.join(self.hvdb.get_folder(), '../')))
         if ok:
             self.center_canvas.canvas.add_cmp_folder(key)
 
@@ -415,7 +540,11 @@ class MainWindow(QMainWindow):
                 self.canvas_type = 'compare'
 
     def switch_preview_canvas(self):
-        show_msg('Information', '^_^', text=('Has not implemented yet.\nContributions are welcome!\n尚未实现, 欢迎贡献!'))
+        if self.canvas_type != 'preview':
+            self.dock_info.close()
+            self.center_canvas.canvas = CanvasPreview(self, self.hvdb)
+            self.setCentralWidget(self.center_canvas.canvas)
+            self.canvas_type = 'preview'
 
     # ---------------------------------------
     # slots: canvas tabs
@@ -442,19 +571,164 @@ class MainWindow(QMainWindow):
         msg.exec_()
 
     def set_fingerprint(self):
+        # preview canvas has no zoom and fingerprint
+        if self.canvas_type == 'preview':
+            self.switch_main_canvas()
         if self.center_canvas.canvas.show_fingerprint:
             self.center_canvas.canvas.show_fingerprint = False
         else:
             self.center_canvas.canvas.show_fingerprint = True
         self.center_canvas.canvas.show_image()
 
+    def toggle_pixel_values(self):
+        if self.canvas_type == 'preview':
+            self.switch_main_canvas()
+        self.center_canvas.canvas.toggle_pixel_values()
+
+    def set_tone_mapping(self, exposure, gamma):
+        """Tone mapping of high bit-depth and HDR images. 8-bit images are not affected."""
+        if self.canvas_type == 'preview':
+            self.switch_main_canvas()
+        get_image_cache().set_tone_mapping(exposure, gamma)
+        self.center_canvas.canvas.show_image()
+        self.set_statusbar(f'Tone mapping of high bit-depth images: exposure {exposure:+.1f}, gamma {gamma:g}')
+
+    def increase_exposure(self):
+        exposure, gamma = get_image_cache().tone_mapping
+        self.set_tone_mapping(exposure + 0.5, gamma)
+
+    def decrease_exposure(self):
+        exposure, gamma = get_image_cache().tone_mapping
+        self.set_tone_mapping(exposure - 0.5, gamma)
+
+    def toggle_display_gamma(self):
+        exposure, gamma = get_image_cache().tone_mapping
+        self.set_tone_mapping(exposure, 1. if gamma != 1 else 2.2)
+
+    def set_channel_mode(self, step):
+        """Cycle the shown channel in CHANNEL_MODES. It is kept when browsing and comparing folders."""
+        if self.canvas_type == 'preview':
+            self.switch_main_canvas()
+        idx = CHANNEL_MODES.index(self.hvdb.channel_mode)
+        self.hvdb.channel_mode = CHANNEL_MODES[(idx + step) % len(CHANNEL_MODES)]
+        self.center_canvas.canvas.show_image()
+        self.set_statusbar(f'Channel: {self.hvdb.channel_mode}')
+
+    def next_channel_mode(self):
+        self.set_channel_mode(1)
+
+    def previous_channel_mode(self):
+        self.set_channel_mode(-1)
+
+    def toggle_wipe_compare(self):
+        # in-view compare is in the main canvas
+        if self.canvas_type != 'main':
+            self.switch_main_canvas()
+        self.center_canvas.canvas.set_inview_compare('wipe')
+
+    def toggle_flicker_compare(self):
+        if self.canvas_type != 'main':
+            self.switch_main_canvas()
+        self.center_canvas.canvas.set_inview_compare('flicker')
+
+    def toggle_playback(self):
+        # the preview canvas has no playback
+        if self.canvas_type == 'preview':
+            self.switch_main_canvas()
+        self.center_canvas.canvas.toggle_playback()
+
+    def set_playback_fps(self):
+        # the preview canvas has no playback
+        if self.canvas_type == 'preview':
+            self.switch_main_canvas()
+        fps, ok = QInputDialog.getDouble(self, 'Playback FPS', 'Target frame rate (fps):', self.hvdb.playback_fps, 1,
+                                         240, 1)
+        if ok:
+            self.hvdb.playback_fps = fps
+            self.center_canvas.canvas.player.set_fps(fps)
+            self.set_statusbar(f'Playback: {fps:g} fps')
+
+    def toggle_metrics(self):
+        # preview canvas has no metrics
+        if self.canvas_type == 'preview':
+            self.switch_main_canvas()
+        self.center_canvas.canvas.show_metrics = not self.center_canvas.canvas.show_metrics
+        self.center_canvas.canvas.show_image()
+
+    def toggle_diff(self):
+        # preview canvas has no metrics
+        if self.canvas_type == 'preview':
+            self.switch_main_canvas()
+        self.center_canvas.canvas.show_diff = not self.center_canvas.canvas.show_diff
+        self.center_canvas.canvas.show_image()
+
+    def sort_by_metric_gap(self):
+        """Evaluate PSNR / SSIM of all the images against the first folder, and sort images by the metric gap of the
+        current compare folder (to the best of the others), so that failure cases come first."""
+        if self.hvdb.get_folder_len() < 2:
+            show_msg('Warning', 'Warning!', 'Please add compare folders first.')
+            return
+        if self.metrics_worker is not None and self.metrics_worker.isRunning():
+            return
+        metric, ok = QInputDialog.getItem(self, 'Sort by Metric Gap', 'Metric (against the first folder):',
+                                          ['psnr', 'ssim', 'psnr_y', 'ssim_y'], 0, False)
+        if not ok:
+            return
+        crop_border, ok = QInputDialog.getInt(self, 'Sort by Metric Gap', 'Crop border:', 0, 0, 1024)
+        if not ok:
+            return
+        kwargs = dict(
+            path_lists=self.hvdb.path_list,
+            crop_border=crop_border,
+            test_y_channel=metric.endswith('_y'),
+            # the same as the metrics command. Images are aligned by name, as folders may have different lengths
+            align='name',
+            folders=self.hvdb.folder_list)
+        self.metrics_worker = CropWorker(evaluate_folders, kwargs, self)
+        self.metrics_worker.progress.connect(
+            lambda num_done, num_total: self.set_statusbar(f'Evaluating {metric}: {num_done} / {num_total}'))
+        self.metrics_worker.done.connect(lambda report: self.sort_by_report(report, metric.split('_')[0]))
+        self.metrics_worker.failed.connect(
+            lambda error: show_msg('Critical', 'Critical', f'Evaluate error: {error}', timeout=None))
+        self.set_statusbar(f'Evaluating {metric}...')
+        self.metrics_worker.start()
+
+    def sort_by_report(self, report, metric):
+        if not report['images']:
+            show_msg('Warning', 'Warning!', 'No images with the same names in all the folders.')
+            return
+        # the compare folder shown currently, or the first compare folder for the reference folder
+        fidx = max(self.hvdb.fidx - 1, 0)
+        gaps = get_metric_gaps(report, metric, fidx)
+        order = sort_by_gap(gaps)
+        images = [report['images'][idx] for idx in order]
+        path_orders = [[image['ref_path'] for image in images]]
+        path_orders.extend([image['paths'][cidx] for image in images] for cidx in range(len(report['folders']) - 1))
+        self.hvdb.reorder(path_orders)
+        self.hvdb.pidx = 0
+        self.center_canvas.canvas.show_image()
+
+        means = '\n'.join(f'{folder}: {value:.4f}' for folder, value in zip(report['folders'], report['mean'][metric])
+                          if value is not None)
+        failures = '\n'.join(f'{report["images"][idx]["name"]}: {gaps[idx]:+.4f}' for idx in order[:5]
+                             if gaps[idx] is not None)
+        show_msg(
+            'Information', 'Sort by Metric Gap', f'Mean {metric}:\n{means}\n\nSorted by the {metric} gap of '
+            f'{report["folders"][fidx]}. Failure cases:\n{failures}\n\nRefresh (F5) to restore the order.')
+
     # ---------------------------------------
     # slots: auto zoom
     # ---------------------------------------
     def auto_zoom(self):
+        # preview canvas has no zoom and fingerprint
+        if self.canvas_type == 'preview':
+            self.switch_main_canvas()
         self.center_canvas.canvas.auto_zoom()
 
     def auto_zoom_dialog(self):
+        # preview canvas has no zoom and fingerprint
+        if self.canvas_type == 'preview':
+            self.switch_main_canvas()
         target_zoom_width = self.center_canvas.canvas.auto_zoom()
         target_zoom_width, ok = QInputDialog.getText(self, 'Auto Zoom', 'Fix image width: (0 for cancelling auto zoom)',
                                                      QLineEdit.Normal, str(target_zoom_width))
@@ -477,6 +751,9 @@ def create_new_window(init_path=None):
 
 
 if __name__ == '__main__':
+    # for crop workers in the frozen executable
+    multiprocessing.freeze_support()
+
     import platform
     if platform.system() == 'Windows':
         # set the icon in the task bar
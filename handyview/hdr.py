@@ -0,0 +1,210 @@
+"""
+High bit-depth (16-bit) and HDR (float) images.
+
+The original values are kept for the pixel readout and metrics, and images are shown by tone mapping:
+value * 2^exposure, clipped to the white level, and encoded by a gamma. 8-bit and 16-bit images are mapped by a
+lookup table, and float images by numpy.
+
+EXR and HDR (Radiance) files are read by OpenCV, which is optional: pip install opencv-python.
+"""
+import io
+import numpy as np
+import os
+import sys
+from functools import lru_cache
+from PIL import Image
+
+from handyview.sources import ARRAY_FORMATS, get_array_source, open_file, read_bytes
+
+# formats that are only opened by this module
+HDR_FORMATS = ('.exr', '.EXR', '.hdr', '.HDR') + ARRAY_FORMATS
+# PIL modes with more than 8 bits
+HIGH_BIT_DEPTH_MODES = ('I;16', 'I;16B', 'I;16L', 'I', 'F')
+
+_BAND = 256
+# raw modes of 16-bit RGB(A) images -> the raw modes with the swapped byte order (N for the native order)
+_SWAPPED_BYTE_ORDERS = {';16B': ';16L', ';16L': ';16B', ';16N': ';16B' if sys.byteorder == 'little' else ';16L'}
+
+
+def is_hdr_path(path):
+    return path.endswith(HDR_FORMATS)
+
+
+def _read_cv2(path):
+    # OpenCV disables EXR by default
+    os.environ.setdefault('OPENCV_IO_ENABLE_OPENEXR', '1')
+    try:
+        import cv2
+    except ImportError:
+        raise ImportError('Please install OpenCV to open EXR / HDR images: pip install opencv-python')
+    # decode from bytes, which also works for images in archives
+    img = cv2.imdecode(
+        np.frombuffer(read_bytes(path), dtype=np.uint8), cv2.IMREAD_UNCHANGED | cv2.IMREAD_ANYDEPTH
+        | cv2.IMREAD_ANYCOLOR)
+    if img is None:
+        raise ValueError(f'Cannot read {path}')
+    if img.ndim == 3:
+        # BGR(A) -> RGB(A)
+        img = img[..., [2, 1, 0, 3][:img.shape[2]]]
+    return img
+
+
+def read_high_bit_depth(path):
+    """Read an image with its original values, if it has more than 8 bits per channel.
+
+    .npy and .yuv files (and their frames) are read by ArraySource (memory mapped), EXR / HDR files by OpenCV, and
+    16-bit / 32-bit gray images and 16-bit RGB(A) PNG / TIFF by PIL (see _read_rgb_16bit).
+
+    Args:
+        path (str): Image path.
+
+    Returns:
+        ndarray | None: (h, w) or (h, w, c) uint16 or float32 array (any dtype for .npy files, and RGB for .yuv
+            files). None for 8-bit images, which are read as usual.
+    """
+    if path.endswith(ARRAY_FORMATS):
+        source, member = get_array_source(path)
+        if source is not None:
+            return source.read_array(member)
+        # .npy files in archives
+        return np.load(io.BytesIO(read_bytes(path)))
+    if path.endswith(('.exr', '.EXR', '.hdr', '.HDR')):
+        return _read_cv2(path)
+    with open_file(path) as f, Image.open(f) as img:
+        if img.mode in HIGH_BIT_DEPTH_MODES:
+            img.load()
+            return pil_to_array(img)
+        rgb_16bit = img.mode in ('RGB', 'RGBA') and img.tile and _get_rawmode(img.tile[0][3]).endswith(
+            tuple(_SWAPPED_BYTE_ORDERS))
+    if rgb_16bit:
+        return _read_rgb_16bit(path)
+    return None
+
+
+def _get_rawmode(args):
+    # tile args are the raw mode, or a tuple starting with the raw mode (e.g., for TIFF)
+    return args if isinstance(args, str) else str(args[0])
+
+
+def _swap_byte_order(args):
+    rawmode = _get_rawmode(args)
+    rawmode = rawmode[:-4] + _SWAPPED_BYTE_ORDERS[rawmode[-4:]]
+    return rawmode if isinstance(args, str) else (rawmode, ) + tuple(args[1:])
+
+
+def _read_rgb_16bit(path):
+    """Read a 16-bit RGB(A) image by PIL, as a (h, w, c) uint16 array.
+
+    PIL decodes it to 8-bit, i.e., the high bytes. The low bytes are decoded again with the byte order of the raw mode
+    swapped, so that the values are the same as decoded by Qt in the GUI (without OpenCV).
+    """
+    planes = []
+    for swapped in (False, True):
+        with open_file(path) as f, Image.open(f) as img:
+            if swapped:
+                # tiles are namedtuples in recent versions of PIL
+                img.tile = [
+                    tile._replace(args=_swap_byte_order(tile[3])) if hasattr(tile, '_replace') else tile[:3] +
+                    (_swap_byte_order(tile[3]), ) for tile in img.tile
+                ]
+            img.load()
+            planes.append(np.asarray(img, dtype=np.uint16))
+    return planes[0] << 8 | planes[1]
+
+
+def pil_to_array(img):
+    """Original values of a PIL image in HIGH_BIT_DEPTH_MODES, as a (h, w) uint16 or float32 array."""
+    arr = np.asarray(img)
+    # 32-bit integers are mostly 16-bit values
+    if arr.dtype == np.int32:
+        arr = arr.astype(np.uint16) if 0 <= arr.min() and arr.max() <= 65535 else arr.astype(np.float32)
+    return arr
+
+
+def get_array_type(arr):
+    """Color type of a high bit-depth image, e.g., 'uint16 x3'."""
+    channels = arr.shape[2] if arr.ndim == 3 else 1
+    return f'{arr.dtype} x{channels}'
+
+
+def get_value_range(arr):
+    """Values mapped to black and white: [0, max of the type] for uint8 / uint16, and [0, 1] for floats.
+
+    Other integers (e.g., int32 from PIL, or .npy files) are in [0, 65535] if they fit, as they are mostly 16-bit
+    values (the same as pil_to_array). Otherwise, they are mapped by their data range.
+    """
+    if arr.dtype in (np.uint8, np.uint16):
+        return 0, np.iinfo(arr.dtype).max
+    if not np.issubdtype(arr.dtype, np.integer) or arr.size == 0:
+        return 0, 1
+    low, high = int(arr.min()), int(arr.max())
+    if 0 <= low and high <= 65535:
+        return 0, 65535
+    return low, max(high, low + 1)
+
+
+def to_metric_range(arr):
+    """Scale an image to [0, 255] for metrics, keeping its precision (float64 for high bit-depth images).
+    The alpha channel is dropped."""
+    if arr.ndim == 3:
+        arr = arr[..., 0] if arr.shape[2] == 1 else arr[..., :3]
+    if arr.dtype == np.uint8:
+        return arr
+    low, high = get_value_range(arr)
+    arr = np.asarray(arr, dtype=np.float64)
+    if low != 0:
+        arr = arr - low
+    return arr * (255. / (high - low))
+
+
+@lru_cache(maxsize=8)
+def get_lut(num_levels, exposure=0., gamma=1.):
+    """Lookup table from integer values in [0, num_levels) to uint8, for tone_map."""
+    values = np.arange(num_levels, dtype=np.float64) * (2.**exposure / (num_levels - 1))
+    np.clip(values, 0, 1, out=values)
+    if gamma != 1:
+        values **= 1. / gamma
+    return (values * 255 + 0.5).astype(np.uint8)
+
+
+def tone_map(arr, exposure=0., gamma=1.):
+    """Map an image to uint8 for display.
+
+    Args:
+        arr (ndarray): (h, w) or (h, w, c) image. Integers are in the range of get_value_range, and floats in [0, 1]
+            (larger values are clipped, unless lowered by exposure).
+        exposure (float): Exposure in stops. Values are multiplied by 2^exposure. Default: 0.
+        gamma (float): Gamma for encoding. 1 for linear, 2.2 for a display gamma. Default: 1.
+
+    Returns:
+        ndarray: (h, w) gray or (h, w, 3) RGB uint8 image. The alpha channel is dropped.
+    """
+    if arr.ndim == 3:
+        arr = arr[..., 0] if arr.shape[2] == 1 else arr[..., :3]
+    if arr.dtype in (np.uint8, np.uint16):
+        return get_lut(np.iinfo(arr.dtype).max + 1, exposure, gamma)[arr]
+    if np.issubdtype(arr.dtype, np.integer) or arr.dtype == np.bool_:
+        low, high = get_value_range(arr)
+        if (low, high) == (0, 65535):
+            return get_lut(65536, exposure, gamma)[arr.astype(np.uint16)]
+        arr = (arr.astype(np.float32) - np.float32(low)) / np.float32(high - low)
+    out = np.empty(arr.shape, dtype=np.uint8)
+    scale = np.float32(2.**exposure)
+    # in bands of rows, to bound the memory of float buffers
+    for start in range(0, arr.shape[0], _BAND):
+        band = np.multiply(arr[start:start + _BAND], scale, dtype=np.float32)
+        np.nan_to_num(band, copy=False, nan=0, posinf=1, neginf=0)
+        np.clip(band, 0, 1, out=band)
+        if gamma != 1:
+            np.power(band, np.float32(1. / gamma), out=band)
+        band *= 255
+        band += 0.5
+        out[start:start + _BAND] = band
+    return out
+
+
+def format_values(values):
+    """Format pixel values: integers as they are, and floats with 4 significant digits."""
+    if np.issubdtype(np.asarray(values).dtype, np.integer):
+        return ', '.join(str(int(value)) for value in values)
+    return ', '.join(f'{float(value):.4g}' for value in values)
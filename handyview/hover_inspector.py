@@ -0,0 +1,133 @@
+import numpy as np
+from PyQt5.QtCore import QObject, QTimer
+from PyQt5.QtGui import QColor
+from PyQt5.QtWidgets import QApplication
+
+from handyview.hdr import format_values
+from handyview.image_cache import qimage_to_argb
+
+
+class HoverInspector(QObject):
+    """Show the cursor position and the pixel values under the cursor in the dock labels.
+
+    Mouse move events only record the latest position. Labels are updated once per display frame, from a numpy
+    view of the shown image, and only the labels whose values have changed are updated (setStyleSheet re-runs style
+    resolution and is the most expensive). Values of an N x N neighborhood can also be shown, which is updated at
+    the same rate, so that it adds no cost to mouse move events. For high bit-depth and HDR images, the original
+    (16-bit or float) values are shown instead of the tone mapped ones.
+
+    Args:
+        pos_label (QLabel): Label of the cursor position.
+        color_label (ColorLabel): Label of the pixel color.
+        rgba_label (QLabel): Label of the RGBA values.
+        neighbor_label (QLabel): Label of the neighborhood values. It is hidden when the neighborhood is off.
+    """
+
+    def __init__(self, pos_label, color_label, rgba_label, neighbor_label):
+        super(HoverInspector, self).__init__()
+        self.pos_label = pos_label
+        self.color_label = color_label
+        self.rgba_label = rgba_label
+        self.neighbor_label = neighbor_label
+        # 0 for not showing the neighborhood. Otherwise, an odd size
+        self.neighbor_size = 0
+        self.neighbor_label.hide()
+
+        self.qimg = None
+        # (h, w) uint32 view of the image in 0xAARRGGBB, created at the first hover of an image
+        self.pixels = None
+        # original values of high bit-depth images. None for 8-bit images
+        self.raw = None
+        # the latest scene position, and the last shown values of each label
+        self.pos = None
+        self.shown = {}
+
+        rate = QApplication.primaryScreen().refreshRate() if QApplication.primaryScreen() else 60
+        self.update_timer = QTimer(self)
+        self.update_timer.setSingleShot(True)
+        self.update_timer.setInterval(max(1, int(1000 / max(rate, 1))))
+        self.update_timer.timeout.connect(self.update_labels)
+
+    def set_image(self, qimg, raw=None):
+        """Set the shown image, and its original values for high bit-depth images. Values under the cursor are
+        updated for the new image."""
+        if qimg is not self.qimg or raw is not self.raw:
+            self.qimg = qimg
+            self.raw = raw
+            self.pixels = None
+            self.schedule_update()
+
+    def set_neighbor_size(self, size):
+        self.neighbor_size = size
+        self.neighbor_label.setVisible(size > 0)
+        self.shown.pop('neighbor', None)
+        self.schedule_update()
+
+    def hover(self, x_pos, y_pos):
+        """Record the cursor position (in the scene) of a mouse move event. Labels are updated in the next frame."""
+        self.pos = (x_pos, y_pos)
+        self.schedule_update()
+
+    def schedule_update(self):
+        # do not restart an active timer, so that continuous moves are shown at the refresh rate
+        if self.pos is not None and not self.update_timer.isActive():
+            self.update_timer.start()
+
+    def get_pixels(self):
+        if self.pixels is None and self.qimg is not None and not self.qimg.isNull():
+            self.pixels = qimage_to_argb(self.qimg)
+        return self.pixels
+
+    def set_label(self, key, value, setter):
+        # skip the update if the value is the same as the shown one
+        if self.shown.get(key) != value:
+            self.shown[key] = value
+            setter(value)
+
+    def update_labels(self):
+        x_pos, y_pos = self.pos
+        self.set_label('pos', f'Cursor position:\n (ignore zoom)\n Height(y): {y_pos:.1f}\n Width(x):  {x_pos:.1f}',
+                       self.pos_label.setText)
+
+        pixels = self.get_pixels()
+        height, width = pixels.shape if pixels is not None else (0, 0)
+        # if cursor is out of image, the text will be red
+        inside = 0 < x_pos < width and 0 < y_pos < height
+        self.set_label('pos_color', 'QLabel {color : black;}' if inside else 'QLabel {color : red;}',
+                       self.pos_label.setStyleSheet)
+        if not inside:
+            return
+
+        x, y = int(x_pos), int(y_pos)
+        pixel = int(pixels[y, x])
+        self.set_label('color', pixel, lambda value: self.color_label.fill(QColor(value)))
+        if self.raw is not None:
+            self.set_label('rgba', f' ({format_values(np.atleast_1d(self.raw[y, x]))})', self.rgba_label.setText)
+        else:
+            r, g, b, a = (pixel >> 16) & 255, (pixel >> 8) & 255, pixel & 255, pixel >> 24
+            self.set_label('rgba', f' ({r:03d}, {g:03d}, {b:03d}, {a:03d})', self.rgba_label.setText)
+
+        if self.neighbor_size > 0:
+            half = self.neighbor_size // 2
+            y0, y1 = max(y - half, 0), min(y + half + 1, height)
+            x0, x1 = max(x - half, 0), min(x + half + 1, width)
+            if self.raw is not None:
+                block = self.raw[y0:y1, x0:x1]
+                texts = [[format_values(np.atleast_1d(value)).replace(' ', '') for value in row] for row in block]
+            else:
+                block = pixels[y0:y1, x0:x1].tolist()
+                texts = [[f'{(value >> 16) & 255:3d},{(value >> 8) & 255:3d},{value & 255:3d}' for value in row]
+                         for row in block]
+            cell_width = max(len(text) for row in texts for text in row)
+            rows = []
+            for row_y in range(y - half, y + half + 1):
+                cells = []
+                for col_x in range(x - half, x + half + 1):
+                    if y0 <= row_y < y1 and x0 <= col_x < x1:
+                        cells.append(texts[row_y - y0][col_x - x0].rjust(cell_width))
+                    else:
+                        cells.append(' ' * cell_width)
+                rows.append('  '.join(cells))
+            self.set_label('neighbor',
+                           f'Neighborhood ({self.neighbor_size}x{self.neighbor_size}, RGB):\n' + '\n'.join(rows),
+                           self.neighbor_label.setText)
@@ -0,0 +1,362 @@
+"""
+Decoded images shared by canvases and panels, so that an image is decoded once
+when it is shown, and other views (e.g., patch preview) read the decoded pixels.
+
+The decoded QImage is viewed as numpy arrays without copying (qimage_to_array, qimage_to_argb), and numpy arrays
+(e.g., heatmaps) are wrapped as QImage without copying (array_to_qimage). PIL images (e.g., for imagehash) are
+made from the arrays, which copies the pixels but does not decode the file again.
+16-bit QImages are viewed as uint16 arrays (qimage_to_uint16), so that their original values are kept.
+"""
+import hashlib
+import imagehash
+import numpy as np
+import sys
+from collections import OrderedDict
+from PIL import Image
+from PyQt5.QtGui import QImage
+
+from handyview.hdr import get_array_type, is_hdr_path, read_high_bit_depth, to_metric_range, tone_map
+from handyview.sources import getmtime, is_virtual_path, open_file, read_bytes
+
+_QIMAGE_16BIT_FORMATS = (QImage.Format_RGBA64, QImage.Format_RGBX64, QImage.Format_Grayscale16)
+
+
+def decode_qimage(path):
+    """Decode an image (also for virtual paths) to QImage. A null QImage if failing to decode."""
+    if is_virtual_path(path):
+        return QImage.fromData(read_bytes(path))
+    return QImage(path)
+
+
+class _QImageBuffer():
+    """Expose the pixels of a QImage by the numpy array interface. Arrays keep a reference to it, so that the
+    QImage is alive as long as the arrays."""
+
+    def __init__(self, qimg):
+        self.qimg = qimg
+        ptr = qimg.constBits()
+        self.__array_interface__ = dict(shape=(qimg.sizeInBytes(), ), typestr='|u1', data=(int(ptr), True), version=3)
+
+
+def qimage_to_array(qimg):
+    """View a QImage as a (h, w, 3) uint8 RGB array, without copying when possible.
+
+    RGB32 / ARGB32 (4 bytes per pixel) and RGB888 images are viewed directly. Other formats are converted to RGB32
+    first. The array is read-only.
+
+    Args:
+        qimg (QImage): Image.
+
+    Returns:
+        ndarray: (h, w, 3) uint8 array in RGB.
+    """
+    if qimg.format() not in (QImage.Format_RGB32, QImage.Format_ARGB32, QImage.Format_RGB888):
+        qimg = qimg.convertToFormat(QImage.Format_RGB32)
+    height, width = qimg.height(), qimg.width()
+    arr = np.asarray(_QImageBuffer(qimg)).reshape(height, qimg.bytesPerLine())
+    if qimg.format() == QImage.Format_RGB888:
+        return arr[:, :width * 3].reshape(height, width, 3)
+    arr = arr[:, :width * 4].reshape(height, width, 4)
+    # RGB32 is 0xAARRGGBB in native byte order: B, G, R, A in memory on little-endian machines
+    return arr[..., 2::-1] if sys.byteorder == 'little' else arr[..., 1:]
+
+
+def qimage_to_argb(qimg):
+    """View a QImage as a (h, w) uint32 array of 0xAARRGGBB values (the same as QImage.pixel), without copying
+    when possible.
+
+    RGB32 / ARGB32 images are viewed directly. Other formats are converted to ARGB32 first. The array is read-only.
+
+    Args:
+        qimg (QImage): Image.
+
+    Returns:
+        ndarray: (h, w) uint32 array.
+    """
+    if qimg.format() not in (QImage.Format_RGB32, QImage.Format_ARGB32):
+        qimg = qimg.convertToFormat(QImage.Format_ARGB32)
+    height, width = qimg.height(), qimg.width()
+    # rows of 32-bit images are always 4-byte aligned, without padding
+    return np.asarray(_QImageBuffer(qimg)).view(np.uint32).reshape(height, width)
+
+
+def array_to_qimage(arr):
+    """Wrap a uint8 array as QImage, without copying.
+
+    The QImage shares the memory of the array, and keeps a reference to it. Qt does not know the reference, so keep
+    the array alive while the QImage (or a shallow copy of it in Qt) is used.
+
+    Args:
+        arr (ndarray): (h, w) gray, (h, w, 3) RGB or (h, w, 4) RGBA uint8 array.
+
+    Returns:
+        QImage: Image.
+    """
+    if arr.dtype != np.uint8:
+        raise ValueError(f'Only uint8 arrays are supported, but got {arr.dtype}.')
+    if arr.ndim == 3 and arr.shape[2] == 1:
+        arr = arr[..., 0]
+    # QImage requires contiguous pixels in each row
+    if arr.strides[-1] != 1 or (arr.ndim == 3 and arr.strides[1] != arr.shape[2]):
+        arr = np.ascontiguousarray(arr)
+    height, width = arr.shape[:2]
+    if arr.ndim == 2:
+        qformat = QImage.Format_Grayscale8
+    elif arr.shape[2] == 3:
+        qformat = QImage.Format_RGB888
+    elif arr.shape[2] == 4:
+        qformat = QImage.Format_RGBA8888
+    else:
+        raise ValueError(f'Unsupported array shape: {arr.shape}.')
+    qimg = QImage(arr.data, width, height, arr.strides[0], qformat)
+    qimg._array = arr
+    return qimg
+
+
+def qimage_to_uint16(qimg):
+    """View a 16-bit QImage (RGBA64, RGBX64 or Grayscale16) as a (h, w, 3) or (h, w) uint16 array, without copying.
+    The alpha channel is dropped."""
+    height, width = qimg.height(), qimg.width()
+    arr = np.asarray(_QImageBuffer(qimg)).view(np.uint16).reshape(height, qimg.bytesPerLine() // 2)
+    if qimg.format() == QImage.Format_Grayscale16:
+        return arr[:, :width]
+    # 16-bit halfword-ordered R, G, B, A
+    return arr[:, :width * 4].reshape(height, width, 4)[..., :3]
+
+
+def qimage_to_pil(qimg):
+    """Convert a QImage to a PIL RGB image (e.g., for imagehash). Pixels are copied, but not decoded again."""
+    return Image.fromarray(qimage_to_array(qimg))
+
+
+def load_image(path, tone_mapping=(0., 1.)):
+    """Decode an image, with its mtime. It only reads the file, so that it can run in worker threads.
+
+    High bit-depth images are also read with their original values, and shown as their tone mapped images.
+
+    Args:
+        path (str): Image path.
+        tone_mapping (tuple[float]): (exposure, gamma) of tone mapping. See hdr.tone_map. Default: (0, 1).
+
+    Returns:
+        tuple: (qimg, mtime, raw, error). qimg is a null QImage if failing to decode, and error is the message (or
+            None). raw is the array with original values for high bit-depth images, and None otherwise.
+    """
+    try:
+        mtime = getmtime(path)
+    except OSError as error:
+        return QImage(), None, None, str(error)
+    if is_hdr_path(path):
+        try:
+            raw = read_high_bit_depth(path)
+        except (ImportError, OSError, ValueError) as error:
+            # e.g., OpenCV is not installed, or the frame size of a .yuv file is unknown
+            return QImage(), mtime, None, str(error)
+        return array_to_qimage(tone_map(raw, *tone_mapping)), mtime, raw, None
+
+    qimg, raw = decode_qimage(path), None
+    if qimg.isNull():
+        # e.g., float TIFF
+        try:
+            raw = read_high_bit_depth(path)
+        except Exception:
+            raw = None
+    elif qimg.format() in _QIMAGE_16BIT_FORMATS:
+        raw = qimage_to_uint16(qimg)
+    if raw is None:
+        return qimg, mtime, None, None
+    return array_to_qimage(tone_map(raw, *tone_mapping)), mtime, raw, None
+
+
+def read_color_type(path, raw=None):
+    """Color type of an image, e.g., 'RGB' (the PIL mode), with the array type of high bit-depth images."""
+    if is_hdr_path(path):
+        return get_array_type(raw) if raw is not None else 'Unknown'
+    try:
+        with open_file(path) as f, Image.open(f) as lazy_img:
+            color_type = lazy_img.mode
+    except Exception:
+        color_type = 'Unknown'
+    if raw is not None:
+        color_type = f'{color_type} ({get_array_type(raw)})'
+    return color_type
+
+
+def read_shape(path):
+    """(width, height) of an image from its header, without decoding. (0, 0) if failing to read."""
+    try:
+        with open_file(path) as f, Image.open(f) as lazy_img:
+            return lazy_img.size
+    except Exception:
+        return 0, 0
+
+
+def compute_fingerprint(path, qimg):
+    """md5 of the file, and phash (perceptual hash) of the decoded image.
+
+    phash is computed from the decoded image, rather than decoding the file again. The formats that Qt cannot decode
+    are decoded by PIL.
+    """
+    md5 = hashlib.md5(read_bytes(path)).hexdigest()
+    if qimg.isNull():
+        with open_file(path) as f:
+            phash = imagehash.phash(Image.open(f))
+    else:
+        phash = imagehash.phash(qimage_to_pil(qimg))
+    return md5, phash
+
+
+class CacheEntry():
+    """A cached image.
+
+    qimg is the shown image, mtime the file mtime when decoding, and raw the original values of high bit-depth
+    images (None for 8-bit images). qimg is mapped from raw with tone_mapping. error is the message if failing to
+    decode. info is a dict of other information read with the image (e.g., file size), filled by the image loader.
+    """
+    __slots__ = ('qimg', 'mtime', 'raw', 'tone_mapping', 'error', 'info')
+
+    def __init__(self, qimg, mtime, raw, tone_mapping, error=None, info=None):
+        self.qimg = qimg
+        self.mtime = mtime
+        self.raw = raw
+        self.tone_mapping = tone_mapping
+        self.error = error
+        self.info = info or {}
+
+    def nbytes(self):
+        return self.qimg.sizeInBytes() + (self.raw.nbytes if self.raw is not None else 0)
+
+
+class ImageCache():
+    """LRU cache of decoded images (QImage), bounded by memory.
+
+    Images are keyed by path. Cached images are returned without reading the file, so that the GUI thread does not
+    touch the disk for them. They are validated by the image loader (see handyview.image_loader), which reads the
+    files in worker threads and decodes them again when they have been modified.
+    High bit-depth and HDR images (see handyview.hdr) are kept with their original values, and shown as their
+    tone mapped 8-bit images. When the tone mapping changes, images are mapped again from the original values,
+    without decoding.
+    It is only used in the GUI thread.
+
+    Args:
+        max_bytes (int): Max memory of cached images. The latest image is always kept. Default: 1 GB.
+    """
+
+    def __init__(self, max_bytes=1024**3):
+        self.max_bytes = max_bytes
+        # path -> CacheEntry
+        self._cache = OrderedDict()
+        self._bytes = 0
+        # (exposure, gamma) of tone mapping
+        self.tone_mapping = (0., 1.)
+        # path -> error message of the latest failed decode
+        self.errors = {}
+        # called with the paths that are not in the cache when they are got, e.g., to load them in workers
+        self.miss_handler = None
+
+    def set_tone_mapping(self, exposure=0., gamma=1.):
+        """Set the tone mapping of high bit-depth images. Cached images are mapped again when they are got."""
+        self.tone_mapping = (float(exposure), float(gamma))
+
+    def lookup(self, path):
+        """The cached entry of path (tone mapped with the current mapping), without reading the file. None if it
+        is not cached."""
+        entry = self._cache.get(path)
+        if entry is None:
+            return None
+        self._cache.move_to_end(path)
+        if entry.raw is not None and entry.tone_mapping != self.tone_mapping:
+            self._bytes -= entry.nbytes()
+            entry.qimg = array_to_qimage(tone_map(entry.raw, *self.tone_mapping))
+            entry.tone_mapping = self.tone_mapping
+            self._bytes += entry.nbytes()
+        return entry
+
+    def put(self, path, qimg, mtime, raw, tone_mapping, error=None, info=None):
+        """Cache a decoded image (see load_image), e.g., from the image loader. Returns the entry."""
+        if error is None:
+            self.errors.pop(path, None)
+        else:
+            self.errors[path] = error
+        self.pop(path)
+        entry = CacheEntry(qimg, mtime, raw, tone_mapping, error, info)
+        self._cache[path] = entry
+        self._bytes += entry.nbytes()
+        while self._bytes > self.max_bytes and len(self._cache) > 1:
+            self._bytes -= self._cache.popitem(last=False)[1].nbytes()
+        # mapped again if the tone mapping has changed during decoding
+        return self.lookup(path)
+
+    def get_entry(self, path):
+        """The cached entry of path, without reading the file. For images not in the cache, it is a placeholder
+        with a null image and no information, and miss_handler is called (the image loader loads them in workers)."""
+        entry = self.lookup(path)
+        if entry is None:
+            if self.miss_handler is not None:
+                self.miss_handler(path)
+            entry = CacheEntry(QImage(), None, None, self.tone_mapping)
+        return entry
+
+    def get(self, path):
+        """Decoded image (tone mapped for high bit-depth images). A null image if it is not loaded yet."""
+        return self.get_entry(path).qimg
+
+    def get_raw(self, path):
+        """Original values of a high bit-depth image, as a (h, w) or (h, w, c) array. None for 8-bit images."""
+        return self.get_entry(path).raw
+
+    def peek(self, path):
+        """The cached entry of path, without reading the file or updating the LRU order. None if it is not cached
+        or its image is mapped with another tone mapping."""
+        entry = self._cache.get(path)
+        if entry is None or entry.tone_mapping != self.tone_mapping:
+            return None
+        return entry
+
+    def get_array(self, path):
+        """Decoded image as a (h, w, 3) uint8 RGB array. See qimage_to_array."""
+        return qimage_to_array(self.get(path))
+
+    def get_metric_array(self, path):
+        """Image for metrics (e.g., PSNR): the original values in [0, 255] (see hdr.to_metric_range) for high
+        bit-depth images, and the 8-bit RGB array otherwise."""
+        entry = self.get_entry(path)
+        return qimage_to_array(entry.qimg) if entry.raw is None else to_metric_range(entry.raw)
+
+    def get_rgb_arrays(self, paths):
+        """Arrays of the cached RGB images (without alpha) in paths, without reading the files.
+
+        They are read-only views of the cached images, and can be read by other threads (e.g., the crop engine).
+        Images with other formats (e.g., gray, alpha or high bit depth) are skipped, as they are not the same as the
+        images decoded by PIL. The files may have been modified after decoding, so users compare the mtimes in
+        their threads.
+
+        Returns:
+            dict: path -> ((h, w, 3) uint8 array, mtime when decoding).
+        """
+        arrays = {}
+        for path in paths:
+            entry = self.peek(path)
+            if entry is not None and entry.qimg.format() == QImage.Format_RGB32:
+                arrays[path] = (qimage_to_array(entry.qimg), entry.mtime)
+        return arrays
+
+    def pop(self, path):
+        entry = self._cache.pop(path, None)
+        if entry is not None:
+            self._bytes -= entry.nbytes()
+
+    def clear(self):
+        self._cache.clear()
+        self._bytes = 0
+        self.errors.clear()
+
+
+_image_cache = None
+
+
+def get_image_cache():
+    global _image_cache
+    if _image_cache is None:
+        _image_cache = ImageCache()
+    return _image_cache
@@ -0,0 +1,252 @@
+"""
+Images loaded asynchronously by a worker pool, so that the GUI thread never waits for the disk (e.g., network
+drives or archives on slow storage).
+
+Workers read and decode the files (see image_cache.load_image), and results are put into the image cache in the GUI
+thread. Cached images are validated by their mtime, and only decoded again when the files have been modified. Other
+information of the shown images (file size, color type and fingerprints) is also read by workers. Images got from the
+cache before they are loaded (e.g., by panels) are requested as well.
+"""
+import time
+from PyQt5 import QtCore
+from PyQt5.QtCore import QObject, QRunnable, QThreadPool, QTimer
+
+from handyview.image_cache import compute_fingerprint, get_image_cache, load_image, read_color_type, read_shape
+from handyview.sources import getmtime, getsize
+from handyview.utils import sizeof_fmt
+
+# information keys of cache entries filled by the loader
+INFO_KEYS = ('file_size', 'color_type')
+FINGERPRINT_KEYS = ('md5', 'phash')
+
+
+class _Emitter(QObject):
+    """Deliver results from workers to the GUI thread. It lives as long as the application."""
+    done = QtCore.pyqtSignal(object, str, object)
+    skipped = QtCore.pyqtSignal(object, str)
+
+
+_emitter = None
+_pool = None
+
+
+def _get_emitter_and_pool():
+    global _emitter, _pool
+    if _emitter is None:
+        _emitter = _Emitter()
+        # a separate pool from thumbnails, so that loading the shown images does not queue behind thumbnails
+        _pool = QThreadPool()
+    return _emitter, _pool
+
+
+class _LoaderState():
+    """States shared with workers. Results of an old state (e.g., before clearing the cache) are dropped."""
+
+    def __init__(self):
+        # None for all paths
+        self.wanted = None
+
+
+class _LoadResult():
+    """Result of a load task. qimg, mtime, raw and error are from image_cache.load_image, and decoded is False if
+    the cached image is still up to date (and not decoded again)."""
+    __slots__ = ('qimg', 'mtime', 'raw', 'error', 'tone_mapping', 'decoded', 'info')
+
+    def __init__(self, mtime, tone_mapping):
+        self.qimg = None
+        self.mtime = mtime
+        self.raw = None
+        self.error = None
+        self.tone_mapping = tone_mapping
+        self.decoded = False
+        self.info = {}
+
+
+class _LoadTask(QRunnable):
+
+    def __init__(self, state, path, known_entry, tone_mapping, fingerprint):
+        super(_LoadTask, self).__init__()
+        self.state = state
+        self.path = path
+        # (mtime, qimg, raw, info) of the cached image, or None
+        self.known_entry = known_entry
+        self.tone_mapping = tone_mapping
+        self.fingerprint = fingerprint
+
+    def run(self):
+        emitter = _get_emitter_and_pool()[0]
+        wanted = self.state.wanted
+        if wanted is not None and self.path not in wanted:
+            # browsed over before the task starts
+            emitter.skipped.emit(self.state, self.path)
+            return
+        try:
+            result = self.load()
+        except Exception as error:
+            result = _LoadResult(None, self.tone_mapping)
+            result.decoded = True
+            result.error = str(error)
+        try:
+            emitter.done.emit(self.state, self.path, result)
+        except RuntimeError:
+            # the application has quit while loading
+            pass
+
+    def load(self):
+        try:
+            mtime = getmtime(self.path)
+        except OSError:
+            mtime = None
+        result = _LoadResult(mtime, self.tone_mapping)
+        if self.known_entry is not None and mtime is not None and self.known_entry[0] == mtime:
+            _, qimg, raw, known_info = self.known_entry
+        else:
+            qimg, result.mtime, raw, result.error = load_image(self.path, self.tone_mapping)
+            result.qimg, result.raw, result.decoded = qimg, raw, True
+            known_info = {}
+        if result.error is not None:
+            return result
+        info = result.info
+        if 'file_size' not in known_info:
+            info['file_size'] = sizeof_fmt(getsize(self.path))
+        if 'color_type' not in known_info:
+            info['color_type'] = read_color_type(self.path, raw)
+        if qimg.isNull() and 'shape' not in known_info:
+            # e.g., formats that Qt cannot decode. The size is read from the header
+            info['shape'] = read_shape(self.path)
+        if self.fingerprint and 'md5' not in known_info:
+            info['md5'], info['phash'] = compute_fingerprint(self.path, qimg)
+        return result
+
+
+class ImageLoader(QObject):
+    """Load images with a worker pool into the image cache.
+
+    Requests of the same path are merged while it is loading. If a load does not finish in timeout seconds (e.g.,
+    a stalled network drive), failed is emitted, so that the GUI can show it. The stalled read still occupies a
+    worker, and its result is cached if it finishes later.
+
+    Args:
+        timeout (float): Timeout in seconds. Default: 10.
+        parent (QObject): Parent. Default: None.
+    """
+    # path, whether a shown (cached) image has been modified and decoded again
+    loaded = QtCore.pyqtSignal(str, bool)
+    # path, error message
+    failed = QtCore.pyqtSignal(str, str)
+
+    def __init__(self, timeout=10, parent=None):
+        super(ImageLoader, self).__init__(parent)
+        self.timeout = timeout
+        self._state = _LoaderState()
+        # path -> start time of the loading
+        self._pending = {}
+        emitter, self.pool = _get_emitter_and_pool()
+        emitter.done.connect(self._on_done)
+        emitter.skipped.connect(self._on_skipped)
+        # fingerprint option of the latest request
+        self._fingerprint = False
+        self.timeout_timer = QTimer(self)
+        self.timeout_timer.setInterval(500)
+        self.timeout_timer.timeout.connect(self._check_timeout)
+        get_image_cache().miss_handler = self.request_missing
+
+    @staticmethod
+    def is_ready(path, fingerprint=False):
+        """Whether an image (and its information) is in the image cache."""
+        entry = get_image_cache().lookup(path)
+        if entry is None:
+            return False
+        keys = INFO_KEYS + FINGERPRINT_KEYS if fingerprint else INFO_KEYS
+        return entry.error is not None or all(key in entry.info for key in keys)
+
+    def is_loading(self, path):
+        return path in self._pending
+
+    def request(self, paths, fingerprint=False, validate=True):
+        """Load images (or validate the cached ones) in workers.
+
+        Args:
+            paths (list[str]): Image paths.
+            fingerprint (bool): Whether to compute md5 and phash. Default: False.
+            validate (bool): Whether to validate the cached images by their mtime. Default: True.
+        """
+        self._fingerprint = fingerprint
+        cache = get_image_cache()
+        for path in paths:
+            if path in self._pending or (not validate and self.is_ready(path, fingerprint)):
+                continue
+            entry = cache.lookup(path)
+            known_entry = None if entry is None else (entry.mtime, entry.qimg, entry.raw, dict(entry.info))
+            self._pending[path] = time.monotonic()
+            self.pool.start(_LoadTask(self._state, path, known_entry, cache.tone_mapping, fingerprint))
+        if self._pending and not self.timeout_timer.isActive():
+            self.timeout_timer.start()
+
+    def request_missing(self, path):
+        """Load an image that is got from the image cache before it is loaded (e.g., the current image of another
+        folder in the patch preview). It is also wanted, so that the task is not skipped."""
+        if self._state.wanted is not None:
+            self._state.wanted.add(path)
+        self.request([path], self._fingerprint)
+
+    def set_wanted(self, paths):
+        """Only load the wanted paths (e.g., the shown images). Queued tasks for other paths are skipped, so that
+        browsing fast does not queue loads of the images that are browsed over. Running tasks are not interrupted."""
+        self._state.wanted = set(paths)
+
+    def clear(self):
+        """Drop the results of running tasks, e.g., when the image cache is cleared."""
+        self._state = _LoaderState()
+        self._pending.clear()
+
+    def _check_timeout(self):
+        now = time.monotonic()
+        for path, start in list(self._pending.items()):
+            # reported once. It is still pending, so that a stalled path does not take more workers
+            if start is not None and now - start > self.timeout:
+                self._pending[path] = None
+                self.failed.emit(path, f'Timed out after {self.timeout:g} s')
+        if all(start is None for start in self._pending.values()):
+            self.timeout_timer.stop()
+
+    def _on_skipped(self, state, path):
+        if state is not self._state:
+            return
+        self._pending.pop(path, None)
+        # wanted again after the task was skipped
+        if self._state.wanted is None or path in self._state.wanted:
+            self.request([path], self._fingerprint)
+
+    def _on_done(self, state, path, result):
+        if state is not self._state:
+            return
+        self._pending.pop(path, None)
+        cache = get_image_cache()
+        entry = cache.lookup(path)
+        # failed paths are decoded again when they are shown again, but each failure is reported once
+        known_error = cache.errors.get(path)
+        if result.decoded:
+            changed = entry is not None and entry.mtime != result.mtime
+            cache.put(path, result.qimg, result.mtime, result.raw, result.tone_mapping, result.error, result.info)
+        elif entry is None or entry.mtime != result.mtime:
+            # evicted (or decoded again) while validating
+            self.request([path], self._fingerprint)
+            return
+        else:
+            changed = False
+            entry.info.update(result.info)
+        if result.error is not None and result.error != known_error:
+            self.failed.emit(path, result.error)
+        self.loaded.emit(path, changed)
+
+
+_image_loader = None
+
+
+def get_image_loader():
+    """The image loader shared by canvases, which are re-created when switching layouts."""
+    global _image_loader
+    if _image_loader is None:
+        _image_loader = ImageLoader()
+    return _image_loader
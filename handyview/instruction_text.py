@@ -16,7 +16,19 @@ Shift +  ← →:       Fast previous/next image, step = 10
 Ctrl + Shift + ↑ ↓: Control separate view for zoom in/out
 
 ▶ Other Keys
+F2:                 Show pixel values of the 3x3 / 5x5 / 7x7 neighborhood under the cursor (cycle)
+F3:                 Show/hide the statistics (mean, std, histogram) of the rectangular
+F4:                 Show/hide the live patch preview of the rectangular
+F7:                 (Compare) Show/hide PSNR / SSIM against the first folder
+F8:                 (Compare) Show/hide the difference heatmap against the first folder
 F9:                 Change background color (white or light gray)
+F10:                Show/hide pixel values on pixels when zoom ratio >= 20
+E / Shift + E:      Increase/decrease exposure of 16-bit / HDR images by 0.5 stop
+G:                  Switch gamma of 16-bit / HDR images (linear or 2.2)
+W:                  (Compare) Wipe compare with the first (or second) folder, drag the split line
+Shift + W:          (Compare) Flicker compare with the first (or second) folder
+X / Shift + X:      Show the next/previous channel (RGB, R, G, B, A, Y, Cb, Cr)
+P:                  Play/stop the images at a fixed frame rate (View → Playback FPS), in lockstep in all views
 R:                  Reset zoom ration to 1
 C:                  (Compare): switch images under single-view compare mode
 V:                  Switch images under single-view compare mode
@@ -49,7 +61,19 @@ Shift + 方向键 ← →:      快速图像切换, 步长为10
 Ctrl + Shift + 方向键 ↑ ↓: 多视图下, 单独控制一个视图的缩放
 
 ▶ 其他键盘操作
+F2:                      显示光标处 3x3 / 5x5 / 7x7 邻域的像素值 (循环切换)
+F3:                      显示/隐藏 矩形框区域的统计信息 (均值, 标准差, 直方图)
+F4:                      显示/隐藏 矩形框区域的放大 patch 实时预览
+F7:                      (比较模式) 显示/隐藏 与第一个文件夹的 PSNR / SSIM
+F8:                      (比较模式) 显示/隐藏 与第一个文件夹的差异热力图
 F9:                      切换画布背景颜色, 白色/浅灰色
+F10:                     显示/隐藏 像素值 (缩放倍率 >= 20 时显示在像素上)
+E / Shift + E:           增加/减少 16-bit / HDR 图像的曝光 (0.5 档)
+G:                       切换 16-bit / HDR 图像的 gamma (线性 或 2.2)
+W:                       (比较模式) 与第一个 (或第二个) 文件夹分割线对比, 可拖动分割线
+Shift + W:               (比较模式) 与第一个 (或第二个) 文件夹闪烁对比
+X / Shift + X:           显示 下一个/上一个 通道 (RGB, R, G, B, A, Y, Cb, Cr)
+P:                       以固定帧率 播放/停止 图像序列 (查看 → Playback FPS), 所有视图同步播放
 R:                       (Reset) 重置图像缩放为1
 C:                       (Compare) 单视图比较模式下, 图像切换
 V:                       单视图比较模式下, 图像切换.
@@ -0,0 +1,205 @@
+"""
+Image quality metrics (PSNR, SSIM) and difference heatmaps, computed by vectorized numpy.
+
+PSNR and SSIM follow BasicSR: images are in [0, 255], SSIM uses an 11x11 Gaussian window (sigma 1.5) on the valid
+region, and the Y channel is the one of ITU-R BT.601 YCbCr.
+"""
+import numpy as np
+from collections import OrderedDict
+
+# rows processed at a time, to bound the memory of float buffers for large images.
+# SSIM buffers of a smaller band stay in the CPU cache between filtering passes
+_BAND = 256
+_SSIM_BAND = 64
+
+_gaussian = np.exp(-(np.arange(11) - 5)**2 / (2 * 1.5**2))
+GAUSSIAN_KERNEL = _gaussian / _gaussian.sum()
+
+
+def _jet_lut():
+    x = np.linspace(0, 1, 256)
+    lut = np.stack([np.clip(1.5 - np.abs(4 * x - offset), 0, 1) for offset in (3, 2, 1)], axis=1)
+    return (lut * 255).round().astype(np.uint8)
+
+
+# colormap of difference heatmaps: blue (no difference) -> red (large difference)
+JET_LUT = _jet_lut()
+
+
+def to_y_channel(img):
+    """Y channel (in [16, 235]) of an RGB image in [0, 255].
+
+    Args:
+        img (ndarray): (h, w, 3) RGB image.
+
+    Returns:
+        ndarray: (h, w, 1) float64 Y channel.
+    """
+    return (img @ np.array([65.481, 128.553, 24.966]) / 255. + 16.)[..., None]
+
+
+def _prepare(img, img2, crop_border, test_y_channel):
+    if img.shape != img2.shape:
+        raise ValueError(f'Image shapes are different: {img.shape}, {img2.shape}.')
+    if img.ndim == 2:
+        img, img2 = img[..., None], img2[..., None]
+    if crop_border > 0:
+        img = img[crop_border:-crop_border, crop_border:-crop_border]
+        img2 = img2[crop_border:-crop_border, crop_border:-crop_border]
+    if test_y_channel and img.shape[2] == 3:
+        img, img2 = to_y_channel(img), to_y_channel(img2)
+    return img, img2
+
+
+def calculate_psnr(img, img2, crop_border=0, test_y_channel=False):
+    """PSNR (Peak Signal-to-Noise Ratio).
+
+    Args:
+        img (ndarray): (h, w, c) or (h, w) image in [0, 255].
+        img2 (ndarray): Image with the same shape.
+        crop_border (int): Pixels cropped from each border. Default: 0.
+        test_y_channel (bool): Whether to test on the Y channel. Default: False.
+
+    Returns:
+        float: PSNR in dB. inf for identical images.
+    """
+    img, img2 = _prepare(img, img2, crop_border, test_y_channel)
+    sse = 0.
+    for start in range(0, img.shape[0], _BAND):
+        diff = img[start:start + _BAND].astype(np.float64) - img2[start:start + _BAND]
+        diff = diff.ravel()
+        sse += diff @ diff
+    mse = sse / img.size
+    if mse == 0:
+        return float('inf')
+    return float(10. * np.log10(255. * 255. / mse))
+
+
+def _filter_valid(img, kernel=GAUSSIAN_KERNEL):
+    """Separable filtering by a symmetric kernel on the last two axes, keeping the valid region only."""
+    size, half = len(kernel), len(kernel) // 2
+    kernel = kernel.astype(img.dtype)
+    for axis in (-2, -1):
+        length = img.shape[axis] - size + 1
+
+        def taps(idx):
+            return img[..., idx:idx + length, :] if axis == -2 else img[..., idx:idx + length]
+
+        out = taps(half) * kernel[half]
+        buf = np.empty_like(out)
+        # symmetric taps are added before multiplying, and buffers are reused
+        for idx in range(half):
+            np.add(taps(idx), taps(size - 1 - idx), out=buf)
+            buf *= kernel[idx]
+            out += buf
+        img = out
+    return img
+
+
+def _ssim_sum(img, img2):
+    """Sum of the SSIM map of one channel, and the number of its elements.
+
+    It is computed in float32. Second moments are computed on images shifted by 128, to keep the precision of
+    variances.
+    """
+    c1, c2 = (0.01 * 255)**2, (0.03 * 255)**2
+    margin = len(GAUSSIAN_KERNEL) - 1
+    h = img.shape[0]
+    total, num = 0., 0
+    for start in range(0, max(h - margin, 0), _SSIM_BAND):
+        x = img[start:start + _SSIM_BAND + margin].astype(np.float32) - 128
+        y = img2[start:start + _SSIM_BAND + margin].astype(np.float32) - 128
+        mu1, mu2, xx, yy, xy = _filter_valid(np.stack([x, y, x * x, y * y, x * y]))
+        sigma1_sq, sigma2_sq, sigma12 = xx - mu1 * mu1, yy - mu2 * mu2, xy - mu1 * mu2
+        mu1 += 128
+        mu2 += 128
+        ssim_map = ((2 * mu1 * mu2 + c1) * (2 * sigma12 + c2)) / ((mu1 * mu1 + mu2 * mu2 + c1) *
+                                                                  (sigma1_sq + sigma2_sq + c2))
+        total += ssim_map.sum(dtype=np.float64)
+        num += ssim_map.size
+    return total, num
+
+
+def calculate_ssim(img, img2, crop_border=0, test_y_channel=False):
+    """SSIM (Structural Similarity). The SSIM of each channel is computed, and then averaged.
+
+    Args:
+        img (ndarray): (h, w, c) or (h, w) image in [0, 255].
+        img2 (ndarray): Image with the same shape.
+        crop_border (int): Pixels cropped from each border. Default: 0.
+        test_y_channel (bool): Whether to test on the Y channel. Default: False.
+
+    Returns:
+        float: SSIM. nan for images smaller than the window.
+    """
+    img, img2 = _prepare(img, img2, crop_border, test_y_channel)
+    ssims = []
+    for channel in range(img.shape[2]):
+        total, num = _ssim_sum(img[..., channel], img2[..., channel])
+        ssims.append(total / num if num else float('nan'))
+    return float(np.mean(ssims))
+
+
+def compare_images(img, img2, crop_border=0):
+    """PSNR and SSIM on RGB and on the Y channel.
+
+    Returns:
+        dict: psnr, ssim, psnr_y and ssim_y.
+    """
+    return dict(
+        psnr=calculate_psnr(img, img2, crop_border),
+        ssim=calculate_ssim(img, img2, crop_border),
+        psnr_y=calculate_psnr(img, img2, crop_border, test_y_channel=True),
+        ssim_y=calculate_ssim(img, img2, crop_border, test_y_channel=True))
+
+
+def diff_heatmap(img, img2, gain=4):
+    """Heatmap of the absolute difference of two images.
+
+    The difference of a pixel is the max absolute difference of its channels, multiplied by gain, and colored by
+    JET_LUT: blue for no difference, and red for a difference >= 255 / gain.
+
+    Args:
+        img (ndarray): (h, w, c) uint8 image.
+        img2 (ndarray): Image with the same shape.
+        gain (float): Gain of differences. Default: 4.
+
+    Returns:
+        ndarray: (h, w, 3) uint8 heatmap in RGB.
+    """
+    if img.shape != img2.shape:
+        raise ValueError(f'Image shapes are different: {img.shape}, {img2.shape}.')
+    diff = np.abs(np.subtract(img, img2, dtype=np.int16))
+    if diff.ndim == 3:
+        diff = diff.max(axis=2)
+    diff = np.minimum(diff * gain, 255).astype(np.uint8)
+    return JET_LUT[diff]
+
+
+class PairCache():
+    """LRU cache of results of image pairs. Results are computed again when either image has been modified.
+
+    Args:
+        max_items (int): Max number of cached results. Default: 64.
+    """
+
+    def __init__(self, max_items=64):
+        self.max_items = max_items
+        self._cache = OrderedDict()
+
+    def get(self, key, mtimes):
+        """Cached result of key (e.g., a pair of paths), or None if missing or outdated."""
+        entry = self._cache.get(key)
+        if entry is None or entry[1] != mtimes:
+            return None
+        self._cache.move_to_end(key)
+        return entry[0]
+
+    def put(self, key, mtimes, result):
+        self._cache[key] = (result, mtimes)
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.max_items:
+            self._cache.popitem(last=False)
+
+    def clear(self):
+        self._cache.clear()
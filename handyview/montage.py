@@ -0,0 +1,278 @@
+"""
+Montage engine: lay out a full image and the enlarged patches of several folders into one comparison figure.
+
+Images are composed on numpy arrays: each row of patches is copied to the figure in one assignment, and the figure
+is encoded from memory.
+"""
+import numpy as np
+import os
+import time
+from functools import lru_cache
+from PIL import Image, ImageDraw, ImageFont
+
+from handyview.crop import (COLOR_TABLE, INTERPOLATIONS, OUTPUT_FORMATS, _parse_crop_args, align_folders,
+                            get_folder_names, open_image, run_in_pool, save_image)
+
+
+@lru_cache(maxsize=None)
+def _load_font(size):
+    for name in ('DejaVuSans.ttf', 'arial.ttf'):
+        try:
+            return ImageFont.truetype(name, size)
+        except OSError:
+            pass
+    try:
+        return ImageFont.load_default(size)
+    except TypeError:
+        # Pillow < 10.1 only has the bitmap font
+        return ImageFont.load_default()
+
+
+@lru_cache(maxsize=256)
+def render_label(text, font_size=16, background=(255, 255, 255)):
+    """Render a label once, as a (h, w, 3) uint8 array. Labels are shared by all the figures of a batch."""
+    font = _load_font(font_size)
+    left, top, right, bottom = ImageDraw.Draw(Image.new('RGB', (1, 1))).textbbox((0, 0), text, font=font)
+    img = Image.new('RGB', (max(right - left, 1), max(bottom - top, 1)), background)
+    ImageDraw.Draw(img).text((-left, -top), text, fill=(0, 0, 0), font=font)
+    label = np.asarray(img)
+    label.flags.writeable = False
+    return label
+
+
+def crop_array(img, rect, origin=(0, 0), fill=(0, 0, 0)):
+    """Crop a rectangle from an image array. Regions outside the image are filled.
+
+    Args:
+        img (ndarray): (h, w, 3) image.
+        rect (list[int]): [start_h, start_w, len_h, len_w] in the full image.
+        origin (tuple[int]): (x, y) of img in the full image, for images decoded by decode_region. Default: (0, 0).
+        fill (tuple[int]): Color of regions outside the image. Default: (0, 0, 0).
+
+    Returns:
+        ndarray: (len_h, len_w, 3) patch.
+    """
+    start_h, start_w, len_h, len_w = rect
+    start_h, start_w = start_h - origin[1], start_w - origin[0]
+    h, w = img.shape[:2]
+    if start_h >= 0 and start_w >= 0 and start_h + len_h <= h and start_w + len_w <= w:
+        return img[start_h:start_h + len_h, start_w:start_w + len_w]
+    patch = np.empty((len_h, len_w, 3), dtype=np.uint8)
+    patch[...] = fill
+    y0, x0, y1, x1 = max(start_h, 0), max(start_w, 0), min(start_h + len_h, h), min(start_w + len_w, w)
+    if y0 < y1 and x0 < x1:
+        patch[y0 - start_h:y1 - start_h, x0 - start_w:x1 - start_w] = img[y0:y1, x0:x1]
+    return patch
+
+
+def resize_array(img, size, interpolation='bicubic'):
+    """Resize an image array to size (w, h). Integer enlarging by nearest is done by numpy."""
+    h, w = img.shape[:2]
+    if (w, h) == tuple(size):
+        return img
+    if interpolation == 'nearest' and size[0] % w == 0 and size[1] % h == 0:
+        return img.repeat(size[1] // h, axis=0).repeat(size[0] // w, axis=1)
+    return np.asarray(Image.fromarray(img).resize(size, resample=INTERPOLATIONS[interpolation], reducing_gap=2.0))
+
+
+def draw_rect_array(img, rect, color, line_width):
+    """Draw a rectangle border on an image array in place. The border is inside the rectangle."""
+    start_h, start_w, len_h, len_w = rect
+    h, w = img.shape[:2]
+    y0, x0, y1, x1 = max(start_h, 0), max(start_w, 0), min(start_h + len_h, h), min(start_w + len_w, w)
+    if y0 >= y1 or x0 >= x1:
+        return
+    line_width = min(line_width, y1 - y0, x1 - x0)
+    img[y0:y0 + line_width, x0:x1] = color
+    img[y1 - line_width:y1, x0:x1] = color
+    img[y0:y1, x0:x0 + line_width] = color
+    img[y0:y1, x1 - line_width:x1] = color
+
+
+def _read_images(paths, rects, full_index):
+    """Decode the images. Only the region covering the rectangles is decoded, except for the full image."""
+    box = (min(rect[1] for rect in rects), min(rect[0] for rect in rects), max(rect[1] + rect[3] for rect in rects),
+           max(rect[0] + rect[2] for rect in rects))
+    imgs = []
+    for idx, path in enumerate(paths):
+        img, origin = open_image(path, None if idx == full_index else box)
+        imgs.append((np.asarray(img.convert('RGB')), origin))
+    return imgs
+
+
+def make_montage(paths,
+                 rect_pos,
+                 labels=None,
+                 enlarge_ratio=2,
+                 interpolation='bicubic',
+                 full_index=0,
+                 line_width=2,
+                 color='yellow',
+                 padding=4,
+                 font_size=16,
+                 background=(255, 255, 255)):
+    """Make a comparison figure of several images (e.g., GT and the results of different methods).
+
+    The full image (with rectangles) is on the left, scaled to the height of the patches. On the right, each row
+    holds the enlarged patches of a rectangle, one column for each image, with a label under each patch.
+
+    Args:
+        paths (list[str]): Image paths, one for each folder.
+        rect_pos (list[int] | list[list[int]]): One or several rectangles. Each is [start_h, start_w, len_h, len_w].
+        labels (list[str]): Labels of the columns. None for the names of the folders. [] for no labels.
+            Default: None.
+        enlarge_ratio (int): Enlarge ratio of patches. Default: 2.
+        interpolation (str): Interpolation for enlarging patches. bicubic | bilinear | nearest. Default: 'bicubic'.
+        full_index (int | None): Index of the image shown in full. None for no full image. Default: 0.
+        line_width (int): Line width of rectangles on the full image. 0 for not drawing. Default: 2.
+        color (str | list[str]): Rectangle color in COLOR_TABLE, or a color for each rectangle. Default: 'yellow'.
+        padding (int): Padding (in pixels) between and around the images. Default: 4.
+        font_size (int): Font size of labels. Default: 16.
+        background (tuple[int]): Background color in RGB. Default: (255, 255, 255).
+
+    Returns:
+        ndarray: (h, w, 3) uint8 figure in RGB.
+    """
+    rects, colors = _parse_crop_args(rect_pos, interpolation, color)
+    background = tuple(background)
+    if labels is None:
+        labels = get_folder_names([os.path.dirname(path) for path in paths])
+    imgs = _read_images(paths, rects, full_index)
+    num = len(paths)
+
+    # patches: one (num, ph, pw, 3) array for each rectangle
+    rows = []
+    for rect in rects:
+        size = (rect[3] * enlarge_ratio, rect[2] * enlarge_ratio)
+        rows.append(
+            np.stack([resize_array(crop_array(img, rect, origin), size, interpolation) for img, origin in imgs]))
+    label_arrays = [render_label(label, font_size, background) for label in labels]
+    label_h = max((label.shape[0] for label in label_arrays), default=0)
+    label_h = label_h + padding if label_h else 0
+
+    # layout
+    grid_h = sum(row.shape[1] + label_h for row in rows) + padding * (len(rows) - 1)
+    grid_w = max(num * (row.shape[2] + padding) for row in rows) - padding
+    full = None
+    if full_index is not None:
+        full, _ = imgs[full_index]
+        scale = grid_h / full.shape[0]
+        full = np.array(resize_array(full, (max(1, round(full.shape[1] * scale)), grid_h), 'bicubic'))
+        for rect, name in zip(rects, colors):
+            if line_width > 0:
+                rect = [round(value * scale) for value in rect]
+                draw_rect_array(full, rect, COLOR_TABLE[name], line_width)
+    full_w = full.shape[1] + padding if full is not None else 0
+    canvas = np.empty((grid_h + 2 * padding, full_w + grid_w + 2 * padding, 3), dtype=np.uint8)
+    canvas[...] = background
+
+    if full is not None:
+        canvas[padding:padding + grid_h, padding:padding + full.shape[1]] = full
+    y, x = padding, padding + full_w
+    for row in rows:
+        _, ph, pw, _ = row.shape
+        step = pw + padding
+        # blit the patches of a row at once: (num, ph, pw) -> (ph, num * step) with padding between columns
+        block = np.empty((ph, num, step, 3), dtype=np.uint8)
+        block[...] = background
+        block[:, :, :pw] = row.transpose(1, 0, 2, 3)
+        canvas[y:y + ph, x:x + num * step - padding] = block.reshape(ph, num * step, 3)[:, :num * step - padding]
+        for idx, label in enumerate(label_arrays):
+            # center the label under the patch, and clip long labels
+            lh, lw = label.shape[0], min(label.shape[1], pw)
+            left = x + idx * step + (pw - lw) // 2
+            top = y + ph + padding
+            canvas[top:top + lh, left:left + lw] = label[:, (label.shape[1] - lw) // 2:][:, :lw]
+        y += ph + label_h + padding
+    return canvas
+
+
+def montage_one_image(out_path, paths, rect_pos, output_format='png', compress_level=1, **kwargs):
+    """Make a montage by make_montage, and save it.
+
+    Args:
+        out_path (str): Output path.
+        paths (list[str]): Image paths, one for each folder.
+        rect_pos (list[int] | list[list[int]]): See make_montage.
+        output_format (str): Output format in OUTPUT_FORMATS. Default: 'png'.
+        compress_level (int): See crop.save_image. Default: 1.
+        kwargs (dict): Other arguments of make_montage.
+
+    Returns:
+        dict: Output path, encoded bytes, encoding time and the total time.
+    """
+    start_time = time.time()
+    canvas = make_montage(paths, rect_pos, **kwargs)
+    output = save_image(Image.fromarray(canvas), out_path, output_format, compress_level)
+    return {'path': out_path, 'bytes': output['bytes'], 'encode_time': output['time'], 'time': time.time() - start_time}
+
+
+def montage_folders(path_lists,
+                    rect_pos,
+                    out_folder,
+                    labels=None,
+                    align='index',
+                    output_format='png',
+                    compress_level=1,
+                    num_workers=None,
+                    progress_callback=None,
+                    **kwargs):
+    """Make a montage for each group of aligned images in several folders.
+
+    Args:
+        path_lists (list[list[str]]): Image paths of each folder.
+        rect_pos (list[int] | list[list[int]]): See make_montage.
+        out_folder (str): Output folder. Montages are named after the images in the first folder.
+        labels (list[str]): Labels of the folders. None for get_folder_names. Default: None.
+        align (str): Align mode, see crop.align_folders. Default: 'index'.
+        output_format (str): Output format in OUTPUT_FORMATS. Default: 'png'.
+        compress_level (int): See crop.save_image. Default: 1.
+        num_workers (int): Number of worker processes. None for the number of CPU cores. Montages are made in the
+            current process when num_workers <= 1. Default: None.
+        progress_callback (func): Called after each montage with (num_done, num_total, result). Default: None.
+        kwargs (dict): Other arguments of make_montage.
+
+    Returns:
+        list[dict]: Result for each montage, in the order of the aligned images.
+    """
+    path_lists = align_folders(path_lists, align)
+    tasks = get_montage_tasks(path_lists, rect_pos, out_folder, labels, output_format, compress_level, **kwargs)
+    return run_montage_tasks(tasks, num_workers, progress_callback)
+
+
+def get_montage_tasks(path_lists, rect_pos, out_folder, labels=None, output_format='png', compress_level=1, **kwargs):
+    """Get the tasks of making montages for aligned folders, for run_montage_tasks. The output folder is created.
+
+    Arguments are the same as montage_folders.
+
+    Returns:
+        list[tuple]: Tasks (out_path, kwargs), in the order of the aligned images.
+    """
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError(f'Unsupported output format: {output_format}')
+    if labels is None:
+        labels = get_folder_names([os.path.dirname(paths[0]) if paths else '' for paths in path_lists])
+    os.makedirs(out_folder, exist_ok=True)
+    ext = OUTPUT_FORMATS[output_format][0]
+    kwargs = dict(kwargs, rect_pos=rect_pos, labels=labels, output_format=output_format, compress_level=compress_level)
+    tasks = []
+    for paths in zip(*path_lists):
+        out_path = os.path.join(out_folder, os.path.splitext(os.path.basename(paths[0]))[0] + ext)
+        tasks.append((out_path, dict(kwargs, paths=list(paths))))
+    return tasks
+
+
+def run_montage_tasks(tasks, num_workers=None, progress_callback=None):
+    """Run montage_one_image for tasks (out_path, kwargs) in a process pool. In the current process, when
+    num_workers <= 1."""
+    if num_workers is None:
+        num_workers = os.cpu_count() or 1
+    num_workers = min(num_workers, len(tasks))
+    if num_workers > 1:
+        return run_in_pool(montage_one_image, tasks, num_workers, progress_callback)
+    results = []
+    for out_path, kwargs in tasks:
+        results.append(montage_one_image(out_path, **kwargs))
+        if progress_callback is not None:
+            progress_callback(len(results), len(tasks), results[-1])
+    return results
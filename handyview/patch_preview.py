@@ -0,0 +1,159 @@
+import os
+from PIL import Image
+from PyQt5 import QtCore
+from PyQt5.QtCore import QTimer
+from PyQt5.QtGui import QImage, QPixmap
+from PyQt5.QtWidgets import QApplication, QComboBox, QGridLayout, QLabel, QScrollArea, QSpinBox, QVBoxLayout, QWidget
+
+from handyview.image_cache import get_image_cache
+from handyview.image_loader import get_image_loader
+from handyview.widgets import HVLable
+
+
+def enlarge_qimage(qimg, size, interpolation='bicubic'):
+    """Enlarge (or shrink) a QImage to size.
+
+    Qt only provides nearest and bilinear scaling, so bicubic is done by Pillow.
+
+    Args:
+        qimg (QImage): Image.
+        size (tuple[int]): Target (width, height).
+        interpolation (str): nearest | bilinear | bicubic. Default: 'bicubic'.
+
+    Returns:
+        QImage: Resized image.
+    """
+    width, height = size
+    if interpolation == 'nearest':
+        return qimg.scaled(width, height, QtCore.Qt.IgnoreAspectRatio, QtCore.Qt.FastTransformation)
+    elif interpolation == 'bilinear':
+        return qimg.scaled(width, height, QtCore.Qt.IgnoreAspectRatio, QtCore.Qt.SmoothTransformation)
+    # RGBA is resized with premultiplied alpha, which is slower. Use RGB when possible
+    if qimg.hasAlphaChannel():
+        mode, qformat = 'RGBA', QImage.Format_RGBA8888
+    else:
+        mode, qformat = 'RGB', QImage.Format_RGB888
+    qimg = qimg.convertToFormat(qformat)
+    ptr = qimg.constBits()
+    ptr.setsize(qimg.sizeInBytes())
+    img = Image.frombuffer(mode, (qimg.width(), qimg.height()), bytes(ptr), 'raw', mode, qimg.bytesPerLine(), 1)
+    img = img.resize((width, height), resample=Image.BICUBIC, reducing_gap=2.0)
+    data = img.tobytes()
+    # copy, as the QImage does not own data
+    return QImage(data, width, height, width * len(mode), qformat).copy()
+
+
+class PatchPreview(QWidget):
+    """Show the enlarged patches of the selection rectangle, for the current image in every (compare) folder.
+
+    Patches are cropped from the decoded images in the image cache. Updates are coalesced to the display
+    refresh rate: moving the selection only starts a timer, and patches are updated once per frame.
+    Bicubic is slower than a frame for large patches, so bilinear is used while the selection is moving,
+    and patches are refined by bicubic once it stops.
+    """
+
+    def __init__(self, parent, db):
+        super(PatchPreview, self).__init__()
+        self.parent = parent
+        self.db = db
+        # max size of a shown patch, to keep updating cheap for large selections
+        self.max_size = 512
+
+        self.init_widgets_layout()
+
+        rate = QApplication.primaryScreen().refreshRate() if QApplication.primaryScreen() else 60
+        self.update_timer = QTimer(self)
+        self.update_timer.setSingleShot(True)
+        self.update_timer.setInterval(max(1, int(1000 / max(rate, 1))))
+        self.update_timer.timeout.connect(self.update_patches)
+        # refine by bicubic when there is no update for a while
+        self.refine_timer = QTimer(self)
+        self.refine_timer.setSingleShot(True)
+        self.refine_timer.setInterval(150)
+        self.refine_timer.timeout.connect(lambda: self.update_patches(refine=True))
+        # images of other folders are loaded after they are got here
+        get_image_loader().loaded.connect(self.on_image_loaded)
+
+    def init_widgets_layout(self):
+        label_ratio = HVLable('Ratio', self, color='blue')
+        self.spin_ratio = QSpinBox()
+        self.spin_ratio.setRange(1, 16)
+        self.spin_ratio.setValue(2)
+        self.spin_ratio.valueChanged.connect(self.schedule_update)
+        label_mode = HVLable('Mode', self, color='blue')
+        self.combo_mode = QComboBox()
+        self.combo_mode.addItems(['bicubic', 'nearest'])
+        self.combo_mode.currentTextChanged.connect(self.schedule_update)
+
+        # patches of folders
+        self.patch_widget = QWidget()
+        self.patch_layout = QVBoxLayout(self.patch_widget)
+        self.patch_layout.setAlignment(QtCore.Qt.AlignTop)
+        self.patch_labels = []
+        scroll_area = QScrollArea(widgetResizable=True)
+        scroll_area.setWidget(self.patch_widget)
+
+        layout = QGridLayout(self)
+        layout.addWidget(label_ratio, 0, 0, 1, 1)
+        layout.addWidget(self.spin_ratio, 0, 1, 1, 1)
+        layout.addWidget(label_mode, 0, 2, 1, 1)
+        layout.addWidget(self.combo_mode, 0, 3, 1, 1)
+        layout.addWidget(scroll_area, 1, 0, 1, 4)
+
+    def schedule_update(self):
+        # do not restart an active timer, so that continuous updates are shown at the refresh rate
+        if self.isVisible() and not self.update_timer.isActive():
+            self.update_timer.start()
+
+    def showEvent(self, event):
+        super(PatchPreview, self).showEvent(event)
+        self.schedule_update()
+
+    def on_image_loaded(self, path, changed):
+        if path in self.get_paths():
+            self.schedule_update()
+
+    def get_paths(self):
+        """Paths of the current image in every folder."""
+        if self.db.get_folder_len() > 1:
+            return [self.db.get_path(fidx=fidx)[0] for fidx in range(self.db.get_folder_len())]
+        return [self.db.get_path()[0]]
+
+    def set_num_labels(self, num):
+        while len(self.patch_labels) < num:
+            title = HVLable('', self, color='blue')
+            patch = QLabel(self)
+            self.patch_layout.addWidget(title)
+            self.patch_layout.addWidget(patch)
+            self.patch_labels.append((title, patch))
+        while len(self.patch_labels) > num:
+            for label in self.patch_labels.pop():
+                self.patch_layout.removeWidget(label)
+                label.deleteLater()
+
+    def update_patches(self, refine=False):
+        start_h, start_w, len_h, len_w = self.db.selection_pos
+        # the selection can be dragged towards the top left
+        if len_h < 0:
+            start_h, len_h = start_h + len_h, -len_h
+        if len_w < 0:
+            start_w, len_w = start_w + len_w, -len_w
+
+        paths = self.get_paths()
+        self.set_num_labels(len(paths))
+        ratio = self.spin_ratio.value()
+        scale = min(ratio, self.max_size / max(len_h, len_w, 1))
+        size = (max(1, round(len_w * scale)), max(1, round(len_h * scale)))
+        mode = self.combo_mode.currentText()
+        if mode == 'bicubic' and not refine:
+            mode = 'bilinear'
+            self.refine_timer.start()
+        for path, (title, patch) in zip(paths, self.patch_labels):
+            title.setText(os.path.basename(os.path.dirname(path)) + '/' + os.path.basename(path))
+            qimg = get_image_cache().get(path)
+            if len_h == 0 or len_w == 0 or qimg.isNull():
+                patch.clear()
+                continue
+            qimg = qimg.copy(start_w, start_h, len_w, len_h)
+            qimg = enlarge_qimage(qimg, size, mode)
+            patch.setPixmap(QPixmap.fromImage(qimg))
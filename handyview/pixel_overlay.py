@@ -0,0 +1,157 @@
+import math
+from collections import OrderedDict
+from PyQt5 import QtCore
+from PyQt5.QtCore import QLineF, QPointF
+from PyQt5.QtGui import QColor, QFont, QFontMetrics, QPainter, QPen, QPixmap
+
+from handyview.image_cache import qimage_to_argb
+
+# pixels (in each dimension) of a cached tile of the overlay
+TILE_SIZE = 16
+
+
+class PixelValueOverlay():
+    """Draw the RGB values (and grid lines) on pixels when zooming in a lot, like the image viewer of MATLAB.
+
+    Only the pixels in the exposed rect of the view are drawn, and their values are read from a zero-copy view of the
+    shown image, so the cost does not depend on the image size. Values are drawn by pre-rendered pixmaps of the 256
+    values (in light and dark), which are re-rendered only when the font size changes. The overlay is cached as
+    tiles for the current zoom ratio, so that panning only renders the tiles entering the view.
+
+    Args:
+        min_zoom (float): Min zoom ratio for showing values. Default: 20.
+        max_cells (int): Max number of drawn pixels, to bound the cost for huge views. Default: 40000.
+        max_tiles (int): Max number of cached tiles. Default: 256.
+    """
+
+    def __init__(self, min_zoom=20, max_cells=40000, max_tiles=256):
+        self.min_zoom = min_zoom
+        self.max_cells = max_cells
+        self.max_tiles = max_tiles
+        self.enabled = True
+        self.qimg = None
+        self.pixels = None
+        # light (bool) -> pixmaps of the 256 values, in the font size of _font_size
+        self._glyphs = {}
+        self._font_size = None
+        # (tile_y, tile_x) -> QPixmap, for the image and scale of _tiles_key
+        self._tiles = OrderedDict()
+        self._tiles_key = None
+
+    def set_image(self, qimg):
+        if qimg is not self.qimg:
+            self.qimg = qimg
+            self.pixels = None
+            # tiles of the previous image
+            self._tiles.clear()
+            self._tiles_key = None
+
+    def get_pixels(self):
+        if self.pixels is None and self.qimg is not None and not self.qimg.isNull():
+            self.pixels = qimage_to_argb(self.qimg)
+        return self.pixels
+
+    def get_glyphs(self, font_size, light):
+        if font_size != self._font_size:
+            self._glyphs.clear()
+            self._font_size = font_size
+        glyphs = self._glyphs.get(light)
+        if glyphs is None:
+            font = QFont('Courier')
+            font.setPixelSize(font_size)
+            metrics = QFontMetrics(font)
+            # digits have no descent, so lines can be packed tighter than the font height
+            width, height = metrics.horizontalAdvance('000'), metrics.ascent() + 1
+            glyphs = []
+            for value in range(256):
+                pixmap = QPixmap(width, height)
+                pixmap.fill(QtCore.Qt.transparent)
+                painter = QPainter(pixmap)
+                painter.setFont(font)
+                painter.setPen(QColor(255, 255, 255) if light else QColor(0, 0, 0))
+                painter.drawText(pixmap.rect(), QtCore.Qt.AlignCenter, str(value))
+                painter.end()
+                glyphs.append(pixmap)
+            self._glyphs[light] = glyphs
+        return glyphs
+
+    def render_tile(self, tile_y, tile_x, scale_x, scale_y):
+        """Render grid lines and values of a tile (TILE_SIZE x TILE_SIZE pixels) in device pixels."""
+        pixels = self.pixels
+        y0, x0 = tile_y * TILE_SIZE, tile_x * TILE_SIZE
+        block = pixels[y0:y0 + TILE_SIZE, x0:x0 + TILE_SIZE]
+        num_rows, num_cols = block.shape
+        pixmap = QPixmap(math.ceil(num_cols * scale_x) + 1, math.ceil(num_rows * scale_y) + 1)
+        pixmap.fill(QtCore.Qt.transparent)
+        painter = QPainter(pixmap)
+        painter.setPen(QPen(QColor(128, 128, 128, 160), 0))
+        lines = [QLineF(col * scale_x, 0, col * scale_x, num_rows * scale_y) for col in range(num_cols + 1)]
+        lines += [QLineF(0, row * scale_y, num_cols * scale_x, row * scale_y) for row in range(num_rows + 1)]
+        painter.drawLines(lines)
+
+        font_size = max(6, min(int(min(scale_x, scale_y) / 3.5), 16))
+        red, green, blue = (block >> 16) & 255, (block >> 8) & 255, block & 255
+        # light text on dark pixels
+        lights = (red * 299 + green * 587 + blue * 114) < 128000
+        grays = (red == green) & (green == blue)
+        glyphs = (self.get_glyphs(font_size, False), self.get_glyphs(font_size, True))
+        glyph_w, glyph_h = glyphs[0][0].width(), glyphs[0][0].height()
+        for row, (red_row, green_row, blue_row, light_row, gray_row) in enumerate(
+                zip(red.tolist(), green.tolist(), blue.tolist(), lights.tolist(), grays.tolist())):
+            top = row * scale_y
+            for col in range(num_cols):
+                left = col * scale_x + (scale_x - glyph_w) / 2
+                row_glyphs = glyphs[light_row[col]]
+                if gray_row[col]:
+                    painter.drawPixmap(QPointF(left, top + (scale_y - glyph_h) / 2), row_glyphs[red_row[col]])
+                    continue
+                start = top + (scale_y - 3 * glyph_h) / 2
+                painter.drawPixmap(QPointF(left, start), row_glyphs[red_row[col]])
+                painter.drawPixmap(QPointF(left, start + glyph_h), row_glyphs[green_row[col]])
+                painter.drawPixmap(QPointF(left, start + 2 * glyph_h), row_glyphs[blue_row[col]])
+        painter.end()
+        return pixmap
+
+    def draw(self, painter, rect, zoom):
+        """Draw values of the pixels in the exposed scene rect. The painter is in scene coordinates.
+
+        Args:
+            painter (QPainter): Painter of QGraphicsView.drawForeground.
+            rect (QRectF): Exposed scene rect.
+            zoom (float): Zoom ratio of the view.
+        """
+        transform = painter.transform()
+        if not self.enabled or zoom < self.min_zoom or transform.isRotating():
+            return
+        pixels = self.get_pixels()
+        if pixels is None:
+            return
+        height, width = pixels.shape
+        x0, y0 = max(math.floor(rect.left()), 0), max(math.floor(rect.top()), 0)
+        x1, y1 = min(math.ceil(rect.right()), width), min(math.ceil(rect.bottom()), height)
+        if x0 >= x1 or y0 >= y1 or (x1 - x0) * (y1 - y0) > self.max_cells:
+            return
+
+        # tiles are rendered in device pixels, and are valid for the same image and scale
+        scale_x, scale_y, offset_x, offset_y = transform.m11(), transform.m22(), transform.dx(), transform.dy()
+        # ids of freed arrays are reused, so images are identified by the cache key of QImage
+        tiles_key = (self.qimg.cacheKey(), scale_x, scale_y)
+        if tiles_key != self._tiles_key:
+            self._tiles.clear()
+            self._tiles_key = tiles_key
+        painter.save()
+        # draw in device coordinates, so that text is not scaled
+        painter.resetTransform()
+        for tile_y in range(y0 // TILE_SIZE, (y1 - 1) // TILE_SIZE + 1):
+            for tile_x in range(x0 // TILE_SIZE, (x1 - 1) // TILE_SIZE + 1):
+                tile = self._tiles.get((tile_y, tile_x))
+                if tile is None:
+                    tile = self.render_tile(tile_y, tile_x, scale_x, scale_y)
+                    self._tiles[(tile_y, tile_x)] = tile
+                    while len(self._tiles) > self.max_tiles:
+                        self._tiles.popitem(last=False)
+                else:
+                    self._tiles.move_to_end((tile_y, tile_x))
+                painter.drawPixmap(
+                    QPointF(tile_x * TILE_SIZE * scale_x + offset_x, tile_y * TILE_SIZE * scale_y + offset_y), tile)
+        painter.restore()
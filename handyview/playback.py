@@ -0,0 +1,129 @@
+"""
+Playback of image sequences (e.g., video frames exported as images) at a fixed frame rate.
+
+Frames ahead of the playhead are decoded by the image loader (a worker pool) into the image cache, as a ring buffer
+of buffer_size frames which moves with the playhead. Frames are shown by a clock: each tick shows the frame that is
+due at the current time, and frames not decoded in time are dropped, so that playback keeps the timing of the
+target rate instead of slowing down. All views of a canvas show the same frame, so compare views advance in lockstep.
+"""
+import time
+from collections import deque
+from PyQt5 import QtCore
+from PyQt5.QtCore import QObject, QTimer
+
+from handyview.image_loader import get_image_loader
+
+
+class FramePlayer(QObject):
+    """Play the path list of a canvas at a target frame rate.
+
+    Args:
+        canvas (Canvas): Canvas to play. Frames are shown by Canvas.show_loaded_image.
+        fps (float): Target frame rate. Default: 24.
+        buffer_size (int): Number of frames decoded ahead of the playhead. Default: 16.
+    """
+
+    def __init__(self, canvas, fps=24, buffer_size=16):
+        super(FramePlayer, self).__init__(canvas)
+        self.canvas = canvas
+        self.db = canvas.db
+        self.fps = fps
+        self.buffer_size = buffer_size
+        self.playing = False
+        # frame k is the path index start_pidx + k * step (wrapped around)
+        self.start_pidx = 0
+        self.start_time = 0
+        self.frame = 0
+        # first frame of the buffer
+        self.buffer_start = None
+        self.num_dropped = 0
+        # show times of recent frames, for the real frame rate
+        self.show_times = deque(maxlen=32)
+
+        self.timer = QTimer(self)
+        self.timer.setTimerType(QtCore.Qt.PreciseTimer)
+        self.timer.timeout.connect(self.tick)
+
+    def set_fps(self, fps):
+        self.fps = fps
+        if self.playing:
+            # restart the clock from the shown frame
+            self.start()
+
+    def get_pidx(self, frame):
+        # the same step as browsing, so that views in interval mode do not overlap
+        step = self.db.interval + 1
+        return (self.start_pidx + frame * step) % self.db.get_path_len()
+
+    def get_frame_paths(self, frame):
+        return self.canvas.get_needed_paths(self.get_pidx(frame))
+
+    def is_ready(self, frame):
+        loader = get_image_loader()
+        return all(loader.is_ready(path, self.canvas.show_fingerprint) for path in self.get_frame_paths(frame))
+
+    def fill_buffer(self, start):
+        """Load the frames from start, and the shown one. Loads of the frames that are already late (before start)
+        are cancelled, so that slow decoding drops frames instead of falling behind."""
+        if start == self.buffer_start:
+            return
+        self.buffer_start = start
+        paths = self.get_frame_paths(self.frame)
+        for frame in range(start, start + self.buffer_size):
+            paths.extend(self.get_frame_paths(frame))
+        loader = get_image_loader()
+        loader.set_wanted(paths)
+        loader.request(paths, self.canvas.show_fingerprint, validate=False)
+
+    def get_buffered(self):
+        """Number of consecutive decoded frames after the shown one."""
+        num = 0
+        while num < self.buffer_size and self.is_ready(self.frame + num + 1):
+            num += 1
+        return num
+
+    def start(self):
+        self.start_pidx = self.db.pidx
+        self.frame = 0
+        self.num_dropped = 0
+        self.show_times.clear()
+        self.start_time = time.monotonic()
+        self.playing = True
+        self.buffer_start = None
+        self.fill_buffer(1)
+        # tick at twice the frame rate, so that a frame is shown at most half a frame late
+        self.timer.start(max(1, int(500 / self.fps)))
+
+    def stop(self):
+        self.playing = False
+        self.timer.stop()
+
+    def tick(self):
+        due = int((time.monotonic() - self.start_time) * self.fps)
+        if due > self.frame:
+            # the latest decoded frame that is due. Frames before it are dropped
+            for frame in range(due, max(self.frame, due - self.buffer_size), -1):
+                if self.is_ready(frame):
+                    self.show_frame(frame)
+                    break
+        self.fill_buffer(max(due, self.frame + 1))
+
+    def show_frame(self, frame):
+        self.num_dropped += frame - self.frame - 1
+        self.frame = frame
+        self.db.pidx = self.get_pidx(frame)
+        self.canvas.show_loaded_image(self.get_frame_paths(frame))
+        self.show_times.append(time.monotonic())
+        self.show_status()
+
+    def get_real_fps(self):
+        if len(self.show_times) < 2:
+            return 0.
+        return (len(self.show_times) - 1) / max(self.show_times[-1] - self.show_times[0], 1e-6)
+
+    def show_status(self):
+        text = (f'Playback: {self.get_real_fps():.1f} / {self.fps:g} fps, dropped {self.num_dropped}, '
+                f'buffered {self.get_buffered()} / {self.buffer_size}')
+        qview = self.canvas.qviews[0]
+        qview.shown_text.append(text)
+        qview.viewport().update()
@@ -0,0 +1,167 @@
+import numpy as np
+import os
+from PyQt5 import QtCore
+from PyQt5.QtCore import QPointF, QTimer
+from PyQt5.QtGui import QColor, QPainter, QPen, QPixmap, QPolygonF
+from PyQt5.QtWidgets import QApplication, QCheckBox, QFileDialog, QGridLayout, QLabel, QPushButton, QWidget
+
+from handyview.canvas_crop import CropWorker
+from handyview.image_cache import get_image_cache, qimage_to_array
+from handyview.image_loader import get_image_loader
+from handyview.roi_stats import RoiHistogram, batch_roi_stats, hist_stats, summarize_roi_stats, write_roi_csv
+from handyview.widgets import HVLable, show_msg
+
+HIST_COLORS = ('#e04040', '#30a030', '#4060e0')
+
+
+def draw_histogram(hist, width=256, height=100, log_scale=False):
+    """Draw the histograms of channels as curves.
+
+    Args:
+        hist (ndarray): (c, 256) histograms.
+        width (int): Width of the pixmap. Default: 256.
+        height (int): Height of the pixmap. Default: 100.
+        log_scale (bool): Whether to show counts in log scale. Default: False.
+
+    Returns:
+        QPixmap: Histogram curves of R, G, B.
+    """
+    pixmap = QPixmap(width, height)
+    pixmap.fill(QColor('#202020'))
+    hist = np.log1p(hist) if log_scale else hist.astype(np.float64)
+    peak = hist.max()
+    if peak <= 0:
+        return pixmap
+    xs = np.arange(256) * (width - 1) / 255
+    ys = (height - 1) * (1 - hist / peak)
+    painter = QPainter(pixmap)
+    painter.setRenderHint(QPainter.Antialiasing)
+    for channel, color in zip(range(hist.shape[0]), HIST_COLORS):
+        painter.setPen(QPen(QColor(color), 1))
+        painter.drawPolyline(QPolygonF([QPointF(x, y) for x, y in zip(xs, ys[channel])]))
+    painter.end()
+    return pixmap
+
+
+class RoiStatsPanel(QWidget):
+    """Statistics (mean, std, min / max and histograms) of the selection rectangle in the current image.
+
+    Histograms are computed by numpy on a zero-copy view of the decoded image in the image cache. Updates are
+    coalesced to the display refresh rate, and histograms are updated incrementally while dragging the selection.
+    The same statistics of all the images in the current folder can be computed in the background.
+    """
+
+    def __init__(self, parent, db):
+        super(RoiStatsPanel, self).__init__()
+        self.parent = parent
+        self.db = db
+        # (path, qimg, RoiHistogram) of the current image
+        self.roi = None
+        self.batch_worker = None
+
+        self.init_widgets_layout()
+
+        rate = QApplication.primaryScreen().refreshRate() if QApplication.primaryScreen() else 60
+        self.update_timer = QTimer(self)
+        self.update_timer.setSingleShot(True)
+        self.update_timer.setInterval(max(1, int(1000 / max(rate, 1))))
+        self.update_timer.timeout.connect(self.update_stats)
+        # the current image may be loaded after it is shown here
+        get_image_loader().loaded.connect(self.on_image_loaded)
+
+    def init_widgets_layout(self):
+        self.title_label = HVLable('', self, color='blue')
+        self.stats_label = QLabel(self)
+        self.stats_label.setTextInteractionFlags(QtCore.Qt.TextSelectableByMouse)
+        font = self.stats_label.font()
+        font.setFamily('monospace')
+        self.stats_label.setFont(font)
+        self.hist_label = QLabel(self)
+        self.check_log = QCheckBox('Log scale')
+        self.check_log.stateChanged.connect(self.schedule_update)
+        self.btn_batch = QPushButton('All images')
+        self.btn_batch.setToolTip('Statistics of the selection in all the images of the current folder, saved as CSV.')
+        self.btn_batch.clicked.connect(self.batch_stats)
+
+        layout = QGridLayout(self)
+        layout.addWidget(self.title_label, 0, 0, 1, 2)
+        layout.addWidget(self.stats_label, 1, 0, 1, 2)
+        layout.addWidget(self.hist_label, 2, 0, 1, 2)
+        layout.addWidget(self.check_log, 3, 0, 1, 1)
+        layout.addWidget(self.btn_batch, 3, 1, 1, 1)
+        layout.setRowStretch(4, 1)
+
+    def schedule_update(self):
+        # do not restart an active timer, so that continuous updates are shown at the refresh rate
+        if self.isVisible() and not self.update_timer.isActive():
+            self.update_timer.start()
+
+    def showEvent(self, event):
+        super(RoiStatsPanel, self).showEvent(event)
+        self.schedule_update()
+
+    def on_image_loaded(self, path, changed):
+        if path == self.db.get_path()[0]:
+            self.schedule_update()
+
+    def get_roi_histogram(self, path):
+        """RoiHistogram of an image. It is kept for the current image, so that dragging updates incrementally."""
+        qimg = get_image_cache().get(path)
+        if self.roi is None or self.roi[0] != path or self.roi[1] is not qimg:
+            self.roi = (path, qimg, RoiHistogram(qimage_to_array(qimg)))
+        return self.roi[2]
+
+    def update_stats(self):
+        path = self.db.get_path()[0]
+        self.title_label.setText(os.path.basename(os.path.dirname(path)) + '/' + os.path.basename(path))
+        entry = get_image_cache().get_entry(path)
+        if entry.qimg.isNull():
+            loading = get_image_loader().is_loading(path)
+            self.stats_label.setText(entry.error or ('Loading ...' if loading else 'Cannot decode the image.'))
+            self.hist_label.clear()
+            return
+        hist = self.get_roi_histogram(path).update(self.db.selection_pos)
+        stats = hist_stats(hist)
+        if stats['num'] == 0:
+            self.stats_label.setText('No selection.')
+            self.hist_label.clear()
+            return
+        y0, x0, y1, x1 = self.roi[2].box
+        lines = [f'ROI: ({y0}, {x0}) - ({y1}, {x1}), {stats["num"]} pixels', '     mean     std  min  max']
+        for name, mean, std, min_value, max_value in zip('RGB', stats['mean'], stats['std'], stats['min'],
+                                                         stats['max']):
+            lines.append(f'{name} {mean:8.2f} {std:7.2f} {min_value:4d} {max_value:4d}')
+        self.stats_label.setText('\n'.join(lines))
+        self.hist_label.setPixmap(draw_histogram(hist, log_scale=self.check_log.isChecked()))
+
+    def batch_stats(self):
+        if self.batch_worker is not None and self.batch_worker.isRunning():
+            return
+        paths = self.db.path_list[self.db.fidx]
+        kwargs = dict(paths=paths, rect=list(self.db.selection_pos))
+        self.batch_worker = CropWorker(batch_roi_stats, kwargs, self)
+        self.batch_worker.progress.connect(
+            lambda num_done, num_total: self.parent.set_statusbar(f'ROI statistics: {num_done} / {num_total}'))
+        self.batch_worker.done.connect(self.batch_done)
+        self.batch_worker.failed.connect(
+            lambda error: show_msg('Critical', 'Critical', f'ROI statistics error: {error}', timeout=None))
+        self.btn_batch.setEnabled(False)
+        self.batch_worker.finished.connect(lambda: self.btn_batch.setEnabled(True))
+        self.parent.set_statusbar(f'ROI statistics of {len(paths)} images...')
+        self.batch_worker.start()
+
+    def batch_done(self, results):
+        summary = summarize_roi_stats(results)
+        if summary['num_images'] == 0:
+            show_msg('Warning', 'ROI Statistics', 'The selection is outside of all the images.')
+            return
+        mean = ', '.join(f'{value:.2f}' for value in summary['mean'])
+        std = ', '.join(f'{value:.2f}' for value in summary['std'])
+        self.parent.set_statusbar(f'ROI statistics of {summary["num_images"]} images: mean ({mean}), std ({std}).')
+        csv_path, _ = QFileDialog.getSaveFileName(self, 'Save ROI statistics',
+                                                  os.path.join(self.db.get_folder(), 'roi_stats.csv'), 'CSV (*.csv)')
+        if csv_path:
+            write_roi_csv(results, csv_path)
+        text = (f'{summary["num_images"]} images.\nMean of ROI means: ({mean})\nStd of ROI means: ({std})\n'
+                f'Largest shift: {summary["max_shift"]:.2f} in {os.path.basename(summary["max_shift_path"])}')
+        show_msg('Information', 'ROI Statistics', text, timeout=None)
@@ -0,0 +1,183 @@
+"""
+Statistics (mean, std, min / max and histogram of each channel) of a region of interest, e.g., the selection rect.
+
+All the statistics are derived from the 256-bin histograms of 8-bit channels. When the region changes a little
+(e.g., dragging the selection), histograms are updated incrementally from the strips entering and leaving the
+region.
+"""
+import csv
+import numpy as np
+import os
+
+from handyview.crop import open_image, run_in_pool
+
+
+def rect_to_box(rect, shape=None):
+    """Convert a rect (start_h, start_w, len_h, len_w) to a box (y0, x0, y1, x1), clipped to the image shape.
+
+    Lengths can be negative, when the selection is dragged towards the top left.
+    """
+    start_h, start_w, len_h, len_w = rect
+    y0, y1 = sorted((start_h, start_h + len_h))
+    x0, x1 = sorted((start_w, start_w + len_w))
+    if shape is not None:
+        y0, y1 = min(max(y0, 0), shape[0]), min(max(y1, 0), shape[0])
+        x0, x1 = min(max(x0, 0), shape[1]), min(max(x1, 0), shape[1])
+    return y0, x0, y1, x1
+
+
+def box_area(box):
+    return max(box[2] - box[0], 0) * max(box[3] - box[1], 0)
+
+
+def subtract_box(box, other):
+    """Split the region of box not in other into (up to 4) boxes."""
+    y0, x0, y1, x1 = box
+    oy0, ox0, oy1, ox1 = max(other[0], y0), max(other[1], x0), min(other[2], y1), min(other[3], x1)
+    if oy0 >= oy1 or ox0 >= ox1:
+        return [box]
+    boxes = [(y0, x0, oy0, x1), (oy1, x0, y1, x1), (oy0, x0, oy1, ox0), (oy0, ox1, oy1, x1)]
+    return [b for b in boxes if box_area(b) > 0]
+
+
+def region_histogram(img, box):
+    """256-bin histogram of each channel in a box.
+
+    Args:
+        img (ndarray): (h, w, c) uint8 image.
+        box (tuple[int]): (y0, x0, y1, x1).
+
+    Returns:
+        ndarray: (c, 256) int64 histograms.
+    """
+    region = img[box[0]:box[2], box[1]:box[3]]
+    return np.stack([np.bincount(region[..., c].ravel(), minlength=256) for c in range(img.shape[2])])
+
+
+def hist_stats(hist):
+    """Number of pixels, and mean, std, min and max of each channel, from (c, 256) histograms."""
+    num = int(hist[0].sum())
+    if num == 0:
+        return dict(num=0, mean=[], std=[], min=[], max=[])
+    values = np.arange(256)
+    mean = hist @ values / num
+    std = np.sqrt(np.maximum(hist @ (values * values) / num - mean * mean, 0))
+    nonzero = hist > 0
+    return dict(
+        num=num,
+        mean=mean.tolist(),
+        std=std.tolist(),
+        min=nonzero.argmax(axis=1).tolist(),
+        max=(255 - nonzero[:, ::-1].argmax(axis=1)).tolist())
+
+
+class RoiHistogram():
+    """Histograms of a region in an image, updated incrementally when the region changes.
+
+    Args:
+        img (ndarray): (h, w, c) uint8 image. It can be a read-only view of a decoded image.
+    """
+
+    def __init__(self, img):
+        self.img = img
+        self.box = None
+        self.hist = None
+
+    def update(self, rect):
+        """Histograms of a rect (start_h, start_w, len_h, len_w), clipped to the image."""
+        box = rect_to_box(rect, self.img.shape)
+        if self.box is not None and self.box == box:
+            return self.hist
+        if self.box is not None and box_area(box) > 0:
+            # incremental when the strips entering and leaving the region are smaller than the region
+            entering, leaving = subtract_box(box, self.box), subtract_box(self.box, box)
+            if sum(box_area(b) for b in entering + leaving) < box_area(box):
+                hist = self.hist.copy()
+                for b in entering:
+                    hist += region_histogram(self.img, b)
+                for b in leaving:
+                    hist -= region_histogram(self.img, b)
+                self.box, self.hist = box, hist
+                return hist
+        self.box, self.hist = box, region_histogram(self.img, box)
+        return self.hist
+
+
+def roi_stats_one_image(path, rect):
+    """ROI statistics of an image. Only the region covering the rect is decoded when possible.
+
+    Args:
+        path (str): Image path.
+        rect (list[int]): (start_h, start_w, len_h, len_w).
+
+    Returns:
+        dict: path, box (y0, x0, y1, x1), num, and mean, std, min, max and hist of each channel.
+    """
+    y0, x0, y1, x1 = rect_to_box(rect)
+    img, (origin_w, origin_h) = open_image(path, (x0, y0, x1, y1))
+    img = np.asarray(img.convert('RGB'))
+    box = rect_to_box((y0 - origin_h, x0 - origin_w, y1 - y0, x1 - x0), img.shape)
+    hist = region_histogram(img, box)
+    box = (box[0] + origin_h, box[1] + origin_w, box[2] + origin_h, box[3] + origin_w)
+    return dict(path=path, box=box, hist=hist.tolist(), **hist_stats(hist))
+
+
+def batch_roi_stats(paths, rect, num_workers=None, progress_callback=None):
+    """ROI statistics of the same rect in images, e.g., for checking color shifts across outputs.
+
+    Args:
+        paths (list[str]): Image paths.
+        rect (list[int]): (start_h, start_w, len_h, len_w).
+        num_workers (int): Number of worker processes. None for the number of CPU cores. Images are processed in
+            the current process when num_workers <= 1. Default: None.
+        progress_callback (func): Called after each image with (num_done, num_total, result). Default: None.
+
+    Returns:
+        list[dict]: Result of roi_stats_one_image for each image.
+    """
+    if num_workers is None:
+        num_workers = os.cpu_count() or 1
+    num_workers = min(num_workers, len(paths))
+    if num_workers > 1:
+        return run_in_pool(roi_stats_one_image, [(path, dict(rect=rect)) for path in paths], num_workers,
+                           progress_callback)
+    results = []
+    for path in paths:
+        results.append(roi_stats_one_image(path, rect))
+        if progress_callback is not None:
+            progress_callback(len(results), len(paths), results[-1])
+    return results
+
+
+def summarize_roi_stats(results):
+    """Spread of the ROI means across images.
+
+    Returns:
+        dict: Mean and std (across images) of the ROI mean of each channel, and the image whose ROI mean is the
+            farthest from the average (the largest color shift).
+    """
+    results = [result for result in results if result['num'] > 0]
+    if not results:
+        return dict(num_images=0)
+    means = np.array([result['mean'] for result in results])
+    average = means.mean(axis=0)
+    shifts = np.abs(means - average).max(axis=1)
+    idx = int(shifts.argmax())
+    return dict(
+        num_images=len(results),
+        mean=average.tolist(),
+        std=means.std(axis=0).tolist(),
+        max_shift=float(shifts[idx]),
+        max_shift_path=results[idx]['path'])
+
+
+def write_roi_csv(results, csv_path):
+    """Write ROI statistics as CSV, one row for each image (without histograms)."""
+    num_channels = max((len(result['mean']) for result in results), default=0)
+    with open(csv_path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(['path', 'num'] +
+                        [f'{name}_{c}' for name in ('mean', 'std', 'min', 'max') for c in range(num_channels)])
+        for result in results:
+            writer.writerow([result['path'], result['num']] +
+                            [value for name in ('mean', 'std', 'min', 'max') for value in result[name]])
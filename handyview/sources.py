@@ -0,0 +1,698 @@
+"""
+Image sources other than plain folders, e.g., zip and tar archives, lmdb, and arrays (.npy tensors and raw .yuv
+frame dumps) whose frames are browsed as images.
+
+A file inside a source is addressed by a virtual path: '<source path>/<member>'.
+In this way, os.path.dirname and os.path.basename work in the same way as for
+files in a folder, and HVDB can treat a source (or a sub folder in it) as a folder.
+"""
+import hashlib
+import io
+import json
+import mmap
+import numpy as np
+import os
+import re
+import tarfile
+import threading
+import zipfile
+from collections import OrderedDict
+
+from handyview.utils import CACHE_DIR
+
+ARCHIVE_FORMATS = ('.zip', '.ZIP', '.tar', '.TAR')
+LMDB_FORMATS = ('.lmdb', )
+# files in a lmdb folder. Selecting them means opening the lmdb
+LMDB_FILES = ('data.mdb', 'lock.mdb', 'meta_info.txt')
+
+# .npy arrays and raw .yuv frames. Only arrays with multiple frames are sources
+ARRAY_FORMATS = ('.npy', '.NPY', '.yuv', '.YUV')
+# name -> (chroma subsampling (x, y), or None for gray; sample dtype; semi-planar (interleaved UV) order)
+YUV_PIX_FMTS = {
+    'gray': (None, np.uint8, None),
+    'gray10le': (None, np.dtype('<u2'), None),
+    'yuv420p': ((2, 2), np.uint8, None),
+    'yuv422p': ((2, 1), np.uint8, None),
+    'yuv444p': ((1, 1), np.uint8, None),
+    'yuv420p10le': ((2, 2), np.dtype('<u2'), None),
+    'yuv422p10le': ((2, 1), np.dtype('<u2'), None),
+    'yuv444p10le': ((1, 1), np.dtype('<u2'), None),
+    'nv12': ((2, 2), np.uint8, 'uv'),
+    'nv21': ((2, 2), np.uint8, 'vu'),
+}
+# Kr, Kb of YCbCr matrices
+YUV_MATRICES = {'bt601': (0.299, 0.114), 'bt709': (0.2126, 0.0722)}
+# layouts of the last axes of arrays. Other (leading) axes are frames
+ARRAY_LAYOUTS = ('HW', 'HWC', 'CHW')
+
+# pages mapped around a page fault by the kernel
+_FAULT_AROUND_BYTES = 64 * 1024
+# source path -> dict of layout options, set by set_array_layout
+_array_layouts = {}
+# opened sources (LRU), key: source path. Evicted sources are closed
+_sources = OrderedDict()
+_sources_lock = threading.Lock()
+MAX_OPEN_SOURCES = 32
+# source path -> error message of the latest failed open (e.g., a compressed tar)
+_source_errors = {}
+# magic numbers of compressed tar archives, which do not support random access
+_COMPRESSED_MAGICS = {b'\x1f\x8b': 'gzip', b'BZh': 'bzip2', b'\xfd7zXZ\x00': 'xz', b'\x28\xb5\x2f\xfd': 'zstd'}
+
+
+class Source():
+    """Base class of sources.
+
+    Sub classes set self.path, self.pid, self.mtime and self.members (dict, key: member name),
+    and implement open, read and getsize for members.
+    """
+
+    def listdir(self, folder='', recursive=False):
+        """List member names (files only) in a sub folder of the source.
+
+        Args:
+            folder (str): Sub folder in the source. '' for the source root. Default: ''.
+            recursive (bool): Whether to include members in the nested sub folders. Default: False.
+
+        Returns:
+            A generator for the member names.
+        """
+        prefix = folder.strip('/')
+        if prefix:
+            prefix += '/'
+        for name in self.members:
+            if name.startswith(prefix) and (recursive or '/' not in name[len(prefix):]):
+                yield name
+
+    def close(self):
+        """Release the file handles of the source. Readers holding them (e.g., open members) keep working."""
+
+
+class ArchiveSource(Source):
+    """Random access to the members of a zip or an (uncompressed) tar archive, without extraction.
+
+    Zip archives have a central directory, which is read when opening.
+    Tar archives only have a header before each member, so the member index (name, data offset and size) is
+    built once by scanning the headers, and persisted in CACHE_DIR. It is keyed by the archive path, size and
+    mtime. Then each member is read with one seek.
+
+    Compressed tar archives are rejected, as their members cannot be read with a seek.
+
+    Args:
+        path (str): Archive path.
+
+    Raises:
+        ValueError: Compressed or broken archives.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.pid = os.getpid()
+        stat = os.stat(path)
+        self.mtime = stat.st_mtime
+        self._lock = threading.Lock()
+        if zipfile.is_zipfile(path):
+            self.type = 'zip'
+            try:
+                self._zip = zipfile.ZipFile(path)
+            except zipfile.BadZipFile as error:
+                raise ValueError(f'Cannot read the zip archive {path}: {error}') from None
+            self.members = {info.filename: info.file_size for info in self._zip.infolist() if not info.is_dir()}
+        else:
+            self.type = 'tar'
+            self._index = self._load_tar_index(stat)
+            self.members = {name: size for name, (_, size) in self._index.items()}
+            self._fp = open(path, 'rb')
+
+    def _load_tar_index(self, stat):
+        index_name = hashlib.md5(os.path.abspath(self.path).encode('utf-8')).hexdigest() + '.json'
+        index_path = os.path.join(CACHE_DIR, 'archive_index', index_name)
+        try:
+            with open(index_path, 'r') as f:
+                index = json.load(f)
+            if index['size'] == stat.st_size and index['mtime'] == stat.st_mtime:
+                return index['members']
+        except Exception:  # no index or a broken index
+            pass
+
+        members = {}
+        # 'r:' only accepts uncompressed tar, as compressed tar does not support random access
+        try:
+            with tarfile.open(self.path, 'r:') as tar:
+                for info in tar:
+                    if info.isfile():
+                        name = info.name[2:] if info.name.startswith('./') else info.name
+                        members[name] = (info.offset_data, info.size)
+        except tarfile.TarError as error:
+            with open(self.path, 'rb') as f:
+                head = f.read(6)
+            for magic, compression in _COMPRESSED_MAGICS.items():
+                if head.startswith(magic):
+                    raise ValueError(f'{self.path} is compressed by {compression}. Only uncompressed tar archives '
+                                     'can be browsed, please extract it or repack it without compression') from None
+            raise ValueError(f'Cannot read the tar archive {self.path}: {error}') from None
+        try:
+            os.makedirs(os.path.dirname(index_path), exist_ok=True)
+            with open(index_path, 'w') as f:
+                json.dump({'size': stat.st_size, 'mtime': stat.st_mtime, 'members': members}, f)
+        except OSError:  # the index is only a cache
+            pass
+        return members
+
+    def read(self, name):
+        if self.type == 'zip':
+            return self._zip.read(name)
+        offset, size = self._index[name]
+        with self._lock:
+            self._fp.seek(offset)
+            return self._fp.read(size)
+
+    def open(self, name):
+        return io.BytesIO(self.read(name))
+
+    def getsize(self, name):
+        return self.members[name]
+
+    def close(self):
+        with self._lock:
+            if self.type == 'zip':
+                self._zip.close()
+            else:
+                self._fp.close()
+
+
+class BufferReader(io.RawIOBase):
+    """A read-only file object on a buffer (e.g., memoryview), without copying the buffer.
+
+    Args:
+        buf (buffer): The buffer.
+        on_close (func): Called when closing, e.g., to release the buffer. Default: None.
+    """
+
+    def __init__(self, buf, on_close=None):
+        super(BufferReader, self).__init__()
+        self._buf = memoryview(buf).cast('B')
+        self._pos = 0
+        self._on_close = on_close
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, b):
+        size = max(0, min(len(b), len(self._buf) - self._pos))
+        b[:size] = self._buf[self._pos:self._pos + size]
+        self._pos += size
+        return size
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._pos
+        elif whence == io.SEEK_END:
+            offset += len(self._buf)
+        self._pos = max(0, offset)
+        return self._pos
+
+    def tell(self):
+        return self._pos
+
+    def close(self):
+        if not self.closed:
+            self._buf.release()
+            if self._on_close is not None:
+                self._on_close()
+        super(BufferReader, self).close()
+
+
+class LmdbSource(Source):
+    """Images in a lmdb, in the BasicSR layout.
+
+    The lmdb folder contains data.mdb, lock.mdb and meta_info.txt. Each line in meta_info.txt is
+    '<key>.png (h,w,c) <compression level>', and the value of <key> is the encoded image.
+    Members are named '<key>.png', so that they can be compared with a folder of the same images.
+
+    Values are read from the memory-mapped pages directly: the returned file objects hold a read
+    transaction and read the value buffer in place, until they are closed.
+
+    Args:
+        path (str): Lmdb folder path.
+    """
+
+    def __init__(self, path):
+        try:
+            import lmdb
+        except ImportError:
+            raise ImportError('Please install lmdb to open lmdb files: pip install lmdb')
+
+        self.path = path
+        self.pid = os.getpid()
+        self.mtime = os.path.getmtime(os.path.join(path, 'data.mdb'))
+        self._env = lmdb.open(path, readonly=True, lock=False, readahead=False, meminit=False)
+        # member name -> key. Value sizes are read lazily
+        self._keys = {}
+        meta_info_path = os.path.join(path, 'meta_info.txt')
+        if os.path.isfile(meta_info_path):
+            with open(meta_info_path, 'r') as f:
+                for line in f:
+                    name = line.split(' ')[0].strip()
+                    if name:
+                        self._keys[name] = os.path.splitext(name)[0].encode('ascii')
+        else:
+            with self._env.begin(write=False) as txn:
+                for key in txn.cursor().iternext(values=False):
+                    self._keys[f'{key.decode("ascii")}.png'] = key
+        self.members = self._keys
+
+    def open(self, name):
+        txn = self._env.begin(write=False, buffers=True)
+        buf = txn.get(self._keys[name])
+        if buf is None:
+            txn.abort()
+            raise FileNotFoundError(f'Cannot find {name} in {self.path}')
+        return BufferReader(buf, on_close=txn.abort)
+
+    def read(self, name):
+        with self.open(name) as f:
+            return f.read()
+
+    def getsize(self, name):
+        with self._env.begin(write=False, buffers=True) as txn:
+            return len(txn.get(self._keys[name]))
+
+    def close(self):
+        # not closed explicitly, as open members read the mapped pages in place. The environment is closed when it
+        # is released by the source and the transactions of open members
+        pass
+
+
+def guess_array_layout(shape):
+    """Layout of the last axes of an array: channels are the first or last axis with 1, 3 or 4 elements.
+    Otherwise, (e.g., 64 feature maps) each channel is a frame."""
+    if len(shape) >= 3 and shape[-1] in (1, 3, 4):
+        return 'HWC'
+    if len(shape) >= 3 and shape[-3] in (1, 3, 4):
+        return 'CHW'
+    return 'HW'
+
+
+def parse_yuv_name(name):
+    """Frame size, pixel format and matrix in a .yuv file name, e.g., 'foo_1920x1080_yuv420p10le_bt709.yuv'.
+
+    Returns:
+        dict: width and height (if found in the name), pix_fmt ('yuv420p' if not in the name) and matrix ('bt601'
+            if not in the name).
+    """
+    name = os.path.basename(name)
+    options = dict(pix_fmt='yuv420p', matrix='bt601')
+    size = re.search(r'(\d+)x(\d+)', name)
+    if size is not None:
+        options['width'], options['height'] = int(size.group(1)), int(size.group(2))
+    for pix_fmt in sorted(YUV_PIX_FMTS, key=len, reverse=True):
+        if re.search(rf'(^|[^a-z0-9]){pix_fmt}([^a-z0-9]|$)', name.lower()):
+            options['pix_fmt'] = pix_fmt
+            break
+    for matrix in YUV_MATRICES:
+        if matrix in name.lower():
+            options['matrix'] = matrix
+    return options
+
+
+def yuv_to_rgb(y, u, v, bit_depth=8, matrix='bt601', subsampling=None, band=256):
+    """Convert planar YCbCr (limited range) to RGB, by vectorized numpy in bands of rows.
+
+    Args:
+        y (ndarray): (h, w) luma.
+        u (ndarray | None): (ceil(h / sy), ceil(w / sx)) Cb. None for gray.
+        v (ndarray | None): (ceil(h / sy), ceil(w / sx)) Cr. None for gray.
+        bit_depth (int): Bit depth of samples. Default: 8.
+        matrix (str): 'bt601' or 'bt709'. Default: 'bt601'.
+        subsampling (tuple[int]): Chroma subsampling (sx, sy), e.g., (2, 2) for 4:2:0. None for deriving it from
+            the shapes of the planes. Default: None.
+        band (int): Rows of each band, to bound the memory of float buffers. Default: 256.
+
+    Returns:
+        ndarray: (h, w, 3) RGB image, uint8 for 8-bit samples and uint16 (in [0, 65535]) otherwise.
+    """
+    height, width = y.shape
+    out_dtype = np.uint8 if bit_depth == 8 else np.uint16
+    out_max = np.iinfo(out_dtype).max
+    out = np.empty((height, width, 3), dtype=out_dtype)
+    scale = np.float32(1 << (bit_depth - 8))
+    kr, kb = YUV_MATRICES[matrix]
+    kg = 1 - kr - kb
+    if u is None:
+        sx, sy = 1, 1
+    elif subsampling is not None:
+        sx, sy = subsampling
+    else:
+        # chroma of odd sizes is rounded up, e.g., 961 columns for 1921 luma columns in 4:2:0
+        sx, sy = -(-width // u.shape[1]), -(-height // u.shape[0])
+    # bands start at chroma rows
+    band = max(band // sy, 1) * sy
+    for start in range(0, height, band):
+        luma = (y[start:start + band].astype(np.float32) / scale - 16) / 219
+        rgb = out[start:start + band]
+        if u is None:
+            np.clip(luma * out_max + 0.5, 0, out_max, out=rgb[..., 0], casting='unsafe')
+            rgb[..., 1] = rgb[..., 0]
+            rgb[..., 2] = rgb[..., 0]
+            continue
+        rows = slice(start // sy, (start + luma.shape[0] + sy - 1) // sy)
+        # nearest upsampling of chroma
+        cb = np.repeat(np.repeat((u[rows].astype(np.float32) / scale - 128) / 224, sy, axis=0), sx, axis=1)
+        cr = np.repeat(np.repeat((v[rows].astype(np.float32) / scale - 128) / 224, sy, axis=0), sx, axis=1)
+        cb, cr = cb[:luma.shape[0], :width], cr[:luma.shape[0], :width]
+        red = luma + 2 * (1 - kr) * cr
+        blue = luma + 2 * (1 - kb) * cb
+        green = (luma - kr * red - kb * blue) / kg
+        for channel, value in enumerate((red, green, blue)):
+            np.clip(value * out_max + 0.5, 0, out_max, out=rgb[..., channel], casting='unsafe')
+    return out
+
+
+class ArraySource(Source):
+    """Frames of a .npy array or a raw .yuv file, without reading the whole file.
+
+    Files are memory mapped, so that only the pages of the requested frame are read, and browsing a large dump
+    frame by frame uses a constant memory. Members are named by frame indices, e.g., '000012.npy'.
+
+    .npy arrays: the last axes are an image in a layout of ARRAY_LAYOUTS (guessed from the shape by default), and
+    all the leading axes are frames. Frames are returned as (zero-copy) views of the memory-mapped array.
+    .yuv files: frames of a raw planar YCbCr format in YUV_PIX_FMTS. The frame size is required, which is read from
+    the file name (see parse_yuv_name) or set by set_array_layout. Frames are converted to RGB.
+
+    Args:
+        path (str): .npy or .yuv file path.
+        layout (str): Layout of .npy arrays in ARRAY_LAYOUTS. None for guessing. Default: None.
+        width (int): Frame width of .yuv files. Default: None.
+        height (int): Frame height of .yuv files. Default: None.
+        pix_fmt (str): Pixel format of .yuv files in YUV_PIX_FMTS. Default: None.
+        matrix (str): YCbCr matrix of .yuv files in YUV_MATRICES. None for the one in the file name, or 'bt601'.
+            Default: None.
+    """
+
+    def __init__(self, path, layout=None, width=None, height=None, pix_fmt=None, matrix=None):
+        self.path = path
+        self.pid = os.getpid()
+        self.mtime = os.path.getmtime(path)
+        if path.endswith(('.npy', '.NPY')):
+            self.type = 'npy'
+            self._array = np.load(path, mmap_mode='r')
+            if self._array.ndim < 2:
+                raise ValueError(f'{path} is not an image array: shape {self._array.shape}.')
+            self.layout = layout or guess_array_layout(self._array.shape)
+            self.frame_shape = self._array.shape[-len(self.layout):]
+            num_frames = int(np.prod(self._array.shape[:-len(self.layout)], dtype=np.int64))
+        else:
+            self.type = 'yuv'
+            options = parse_yuv_name(path)
+            width, height = width or options.get('width'), height or options.get('height')
+            if width is None or height is None:
+                raise ValueError(f'Unknown frame size of {path}. Name it like name_1920x1080.yuv or set the layout.')
+            self.width, self.height = width, height
+            self.pix_fmt = pix_fmt or options['pix_fmt']
+            self.matrix = matrix or options['matrix']
+            subsampling, self._dtype, _ = YUV_PIX_FMTS[self.pix_fmt]
+            self._dtype = np.dtype(self._dtype)
+            luma_size = width * height
+            chroma_size = 0
+            if subsampling is not None:
+                chroma_size = -(-width // subsampling[0]) * -(-height // subsampling[1])
+            self.frame_bytes = (luma_size + 2 * chroma_size) * self._dtype.itemsize
+            num_frames = os.path.getsize(path) // self.frame_bytes
+            self._fp = open(path, 'rb')
+            # mapping an empty file fails
+            self._mmap = mmap.mmap(self._fp.fileno(), 0, access=mmap.ACCESS_READ) if num_frames > 0 else None
+        ext = '.npy' if self.type == 'npy' else '.yuv'
+        self.num_frames = num_frames
+        self.members = {f'{idx:06d}{ext}': idx for idx in range(num_frames)}
+
+    def frame_index(self, name):
+        """Frame index of a member. '' for the first frame (e.g., a single image)."""
+        if name == '':
+            return 0
+        idx = self.members.get(name)
+        if idx is None:
+            raise FileNotFoundError(f'Cannot find {name} in {self.path}')
+        return idx
+
+    def read_array(self, name=''):
+        """Frame as a (h, w) or (h, w, c) array. A read-only view of the memory-mapped file for .npy arrays."""
+        idx = self.frame_index(name)
+        if self.type == 'npy':
+            lead = self._array.shape[:-len(self.layout)]
+            frame = self._array[np.unravel_index(idx, lead) if lead else ()]
+            return frame.transpose(1, 2, 0) if self.layout == 'CHW' else frame
+        return self._read_yuv(idx)
+
+    def _read_yuv(self, idx):
+        width, height = self.width, self.height
+        subsampling, dtype, order = YUV_PIX_FMTS[self.pix_fmt]
+        offset = idx * self.frame_bytes
+        samples = np.frombuffer(
+            self._mmap, dtype=self._dtype, count=self.frame_bytes // self._dtype.itemsize, offset=offset)
+        y = samples[:width * height].reshape(height, width)
+        u = v = None
+        if subsampling is not None:
+            chroma_h, chroma_w = -(-height // subsampling[1]), -(-width // subsampling[0])
+            chroma = samples[width * height:]
+            if order is None:
+                u = chroma[:chroma_h * chroma_w].reshape(chroma_h, chroma_w)
+                v = chroma[chroma_h * chroma_w:].reshape(chroma_h, chroma_w)
+            else:
+                uv = chroma.reshape(chroma_h, chroma_w, 2)
+                u, v = (uv[..., 0], uv[..., 1]) if order == 'uv' else (uv[..., 1], uv[..., 0])
+        rgb = yuv_to_rgb(
+            y, u, v, bit_depth=8 if self._dtype.itemsize == 1 else 10, matrix=self.matrix, subsampling=subsampling)
+        # the frame has been converted: drop its pages, so that memory does not grow when browsing. Pages around
+        # the frame are also dropped, as the kernel maps cached pages around page faults (fault-around)
+        if hasattr(mmap, 'MADV_DONTNEED'):
+            start = max(offset - offset % mmap.PAGESIZE - _FAULT_AROUND_BYTES, 0)
+            end = min(offset + self.frame_bytes + _FAULT_AROUND_BYTES, len(self._mmap))
+            self._mmap.madvise(mmap.MADV_DONTNEED, start, end - start)
+        return rgb
+
+    def open(self, name):
+        # raw bytes of the frame (e.g., for md5)
+        return io.BytesIO(self.read(name))
+
+    def read(self, name):
+        idx = self.frame_index(name)
+        if self.type == 'npy':
+            return np.ascontiguousarray(self.read_array(name)).tobytes()
+        return self._mmap[idx * self.frame_bytes:(idx + 1) * self.frame_bytes]
+
+    def getsize(self, name):
+        if self.type == 'npy':
+            return int(np.prod(self.frame_shape, dtype=np.int64)) * self._array.itemsize
+        return self.frame_bytes
+
+    def close(self):
+        # frames of .npy arrays are views of the mapping (e.g., in the image cache), which is unmapped when they
+        # are released
+        if self.type == 'yuv':
+            if self._mmap is not None:
+                try:
+                    self._mmap.close()
+                except BufferError:  # a frame is being converted
+                    pass
+            self._fp.close()
+
+
+def set_array_layout(path, **options):
+    """Set layout options of an array source (see ArraySource), e.g., the frame size of a .yuv file.
+    The source is opened again with the options."""
+    _array_layouts[path] = {key: value for key, value in options.items() if value is not None}
+    with _sources_lock:
+        source = _sources.pop(path, None)
+    if source is not None:
+        source.close()
+
+
+def get_array_layout(path):
+    return dict(_array_layouts.get(path, {}))
+
+
+def get_array_layouts():
+    """Layout options of all array sources, e.g., for passing them to worker processes (see set_array_layouts)."""
+    return {path: dict(options) for path, options in _array_layouts.items()}
+
+
+def set_array_layouts(layouts):
+    """Set the layout options returned by get_array_layouts, e.g., in a spawned worker process."""
+    for path, options in layouts.items():
+        set_array_layout(path, **options)
+
+
+def split_array_path(path):
+    """Split a path into the .npy / .yuv file and the member (frame) in it.
+
+    Returns:
+        tuple: (array file, member). (None, path) if path is not in an array file.
+    """
+    parts = path.replace('\\', '/').split('/')
+    for idx, part in enumerate(parts):
+        if part.endswith(ARRAY_FORMATS):
+            root = '/'.join(parts[:idx + 1])
+            if os.path.isfile(root):
+                return root, '/'.join(parts[idx + 1:])
+    return None, path
+
+
+def get_array_source(path):
+    """The ArraySource of a .npy / .yuv file, or of a frame in it (also for single-frame arrays).
+
+    Returns:
+        tuple: (source, member). (None, path) if path is not in an array.
+    """
+    root, member = split_array_path(path)
+    if root is not None:
+        source = _open_source(root, include_single=True)
+        if source is not None:
+            return source, member
+    return None, path
+
+
+def _cache_source(root, source):
+    """Cache an opened source, and close the sources evicted from the LRU (or replaced by it)."""
+    old = _sources.pop(root, None)
+    _sources[root] = source
+    evicted = [old] if old is not None and old is not source else []
+    while len(_sources) > MAX_OPEN_SOURCES:
+        evicted.append(_sources.popitem(last=False)[1])
+    for source in evicted:
+        # sources of other processes (forked) share the handles with them
+        if source.pid == os.getpid():
+            source.close()
+
+
+def _open_source(root, refresh=False, include_single=False):
+    with _sources_lock:
+        source = _sources.get(root)
+        if source is not None:
+            _sources.move_to_end(root)
+        # file handles and lmdb environments cannot be shared with forked processes
+        if source is None or refresh or source.pid != os.getpid():
+            if root.endswith(ARRAY_FORMATS):
+                if not os.path.isfile(root):
+                    return None
+                source_type, mtime = ArraySource, os.path.getmtime(root)
+            elif root.endswith(LMDB_FORMATS):
+                if not os.path.isfile(os.path.join(root, 'data.mdb')):
+                    return None
+                source_type, mtime = LmdbSource, os.path.getmtime(os.path.join(root, 'data.mdb'))
+            else:
+                if not os.path.isfile(root):
+                    return None
+                source_type, mtime = ArchiveSource, os.path.getmtime(root)
+            # reopen when the source has been modified
+            if source is None or source.mtime != mtime or source.pid != os.getpid():
+                if source_type is ArraySource:
+                    try:
+                        source = ArraySource(root, **_array_layouts.get(root, {}))
+                    except ValueError:
+                        # e.g., unknown frame size. Opened as an image, which shows the error
+                        if include_single:
+                            raise
+                        return None
+                else:
+                    try:
+                        source = source_type(root)
+                    except ValueError as error:
+                        # e.g., compressed or broken archives. See get_source_error
+                        _source_errors[root] = str(error)
+                        return None
+                _source_errors.pop(root, None)
+                _cache_source(root, source)
+        # arrays with one frame are images rather than sources
+        if isinstance(source, ArraySource) and source.num_frames <= 1 and not include_single:
+            return None
+        return source
+
+
+def get_source(path, refresh=False):
+    """Find the source that a path belongs to.
+
+    Args:
+        path (str): Path, can be a source itself, or a virtual path in a source.
+        refresh (bool): Whether to check the source has been modified. Default: False.
+
+    Returns:
+        tuple: (source, member). If path is not in a source, return (None, path).
+    """
+    parts = path.replace('\\', '/').split('/')
+    for idx, part in enumerate(parts):
+        if part.endswith(ARCHIVE_FORMATS + LMDB_FORMATS + ARRAY_FORMATS):
+            source = _open_source('/'.join(parts[:idx + 1]), refresh=refresh)
+            if source is not None:
+                return source, '/'.join(parts[idx + 1:])
+    return None, path
+
+
+def get_source_error(path):
+    """Why the source that a path belongs to cannot be opened (e.g., a compressed tar). None if there is no error."""
+    parts = path.replace('\\', '/').split('/')
+    for idx in range(len(parts)):
+        error = _source_errors.get('/'.join(parts[:idx + 1]))
+        if error is not None:
+            return error
+    return None
+
+
+def is_source(path):
+    """Whether the path is a source itself (rather than a file or a folder)."""
+    source, member = get_source(path)
+    return source is not None and member.strip('/') == ''
+
+
+def normalize_source_path(path):
+    """Lmdb is a folder, so it is opened by selecting a file in it (e.g., data.mdb).
+    Map these files to the lmdb itself."""
+    if os.path.basename(path) in LMDB_FILES and is_source(os.path.dirname(path)):
+        return os.path.dirname(path)
+    return path
+
+
+def is_virtual_path(path):
+    """Whether the path is inside a source."""
+    return get_source(path)[0] is not None
+
+
+def get_host_folder(path):
+    """Get the folder on disk that a file path belongs to.
+
+    For a virtual path, it is the source (e.g., the archive) itself.
+    """
+    source = get_source(path)[0]
+    if source is None:
+        return os.path.dirname(path)
+    return source.path
+
+
+def open_file(path):
+    """Open a file (or a member in a source) for binary reading."""
+    source, member = get_source(path)
+    if source is None:
+        return open(path, 'rb')
+    return source.open(member)
+
+
+def read_bytes(path):
+    with open_file(path) as f:
+        return f.read()
+
+
+def getmtime(path):
+    """Modification time. For a virtual path, it is the mtime of the source."""
+    source = get_source(path)[0]
+    if source is None:
+        return os.path.getmtime(path)
+    return source.mtime
+
+
+def getsize(path):
+    source, member = get_source(path)
+    if source is None:
+        return os.path.getsize(path)
+    return source.getsize(member)
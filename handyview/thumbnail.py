@@ -0,0 +1,249 @@
+"""
+Thumbnails decoded asynchronously by a worker pool, and cached on disk
+following the freedesktop thumbnail spec:
+https://specifications.freedesktop.org/thumbnail-spec/thumbnail-spec-latest.html
+
+Images in sources (e.g., archives) have no file URI that other applications understand, so their thumbnails are
+kept in a private HandyView cache (PRIVATE_THUMBNAIL_DIR) instead of the shared one.
+"""
+import hashlib
+import os
+import pathlib
+import threading
+from collections import OrderedDict
+from PIL import Image
+from PyQt5 import QtCore
+from PyQt5.QtCore import QBuffer, QObject, QRunnable, QSize, QThreadPool
+from PyQt5.QtGui import QImage, QImageReader, QPixmap
+from urllib.parse import quote
+
+from handyview.sources import get_source, getmtime, is_virtual_path, read_bytes
+from handyview.utils import CACHE_DIR
+
+THUMBNAIL_DIR = os.path.join(
+    os.environ.get('XDG_CACHE_HOME', os.path.join(os.path.expanduser('~'), '.cache')), 'thumbnails')
+# thumbnails of virtual paths, in the same layout as THUMBNAIL_DIR
+PRIVATE_THUMBNAIL_DIR = os.path.join(CACHE_DIR, 'thumbnails')
+# thumbnail flavors (folder name, max size) in the thumbnail spec
+THUMBNAIL_FLAVORS = (('normal', 128), ('large', 256), ('x-large', 512), ('xx-large', 1024))
+
+
+def get_thumbnail_uri(path):
+    """URI of an image, which is the key of its thumbnail in the disk cache.
+
+    For a virtual path, it is the URI of the source followed by the member name.
+    """
+    source, member = get_source(path)
+    if source is None:
+        return pathlib.Path(os.path.abspath(path)).as_uri()
+    return pathlib.Path(os.path.abspath(source.path)).as_uri() + '/' + quote(member)
+
+
+def read_thumbnail(path, size, use_cache=True):
+    """Read a thumbnail.
+
+    Thumbnails are first looked up in the disk cache, and it is valid only when
+    its Thumb::URI and Thumb::MTime match the image. Otherwise, the thumbnail is
+    decoded and saved to the disk cache.
+
+    Args:
+        path (str): Image path.
+        size (QSize): Max thumbnail size.
+        use_cache (bool): Whether to use the disk cache. Default: True.
+
+    Returns:
+        QImage: Thumbnail. A null QImage if failing to decode.
+    """
+    flavor, flavor_size = THUMBNAIL_FLAVORS[-1]
+    for name, max_size in THUMBNAIL_FLAVORS:
+        if max(size.width(), size.height()) <= max_size:
+            flavor, flavor_size = name, max_size
+            break
+
+    qimg = None
+    if use_cache:
+        uri = get_thumbnail_uri(path)
+        mtime = str(int(getmtime(path)))
+        thumbnail_dir = PRIVATE_THUMBNAIL_DIR if is_virtual_path(path) else THUMBNAIL_DIR
+        cache_path = os.path.join(thumbnail_dir, flavor, hashlib.md5(uri.encode('utf-8')).hexdigest() + '.png')
+        if os.path.isfile(cache_path):
+            # QImageReader.text cannot read keys with ':'. PIL only reads the chunks before image data here
+            try:
+                with Image.open(cache_path) as lazy_img:
+                    is_valid = lazy_img.info.get('Thumb::URI') == uri and lazy_img.info.get('Thumb::MTime') == mtime
+            except Exception:
+                is_valid = False
+            if is_valid:
+                qimg = QImage(cache_path)
+    if qimg is None or qimg.isNull():
+        qimg = decode_thumbnail(path, QSize(flavor_size, flavor_size))
+        if use_cache and not qimg.isNull():
+            save_thumbnail(qimg, cache_path, uri, mtime)
+
+    if qimg.width() > size.width() or qimg.height() > size.height():
+        qimg = qimg.scaled(size, QtCore.Qt.KeepAspectRatio, QtCore.Qt.SmoothTransformation)
+    return qimg
+
+
+def save_thumbnail(qimg, cache_path, uri, mtime):
+    """Save a thumbnail to the disk cache.
+
+    It is first written to a temporary file and then renamed, so that other
+    programs never read an incomplete thumbnail.
+    """
+    qimg.setText('Thumb::URI', uri)
+    qimg.setText('Thumb::MTime', mtime)
+    qimg.setText('Software', 'HandyView')
+    tmp_path = f'{cache_path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    try:
+        os.makedirs(os.path.dirname(cache_path), mode=0o700, exist_ok=True)
+        if qimg.save(tmp_path, 'PNG'):
+            os.chmod(tmp_path, 0o600)
+            os.replace(tmp_path, cache_path)
+    except OSError:  # the disk cache is optional
+        pass
+
+
+def decode_thumbnail(path, size):
+    """Decode a thumbnail from an image.
+
+    It uses the scaled decoding of QImageReader (e.g., DCT scaling for JPEG), so
+    that the full-resolution image is not decoded when possible.
+
+    Args:
+        path (str): Image path.
+        size (QSize): Max thumbnail size.
+
+    Returns:
+        QImage: Thumbnail. A null QImage if failing to decode.
+    """
+    if is_virtual_path(path):
+        buffer = QBuffer()
+        buffer.setData(read_bytes(path))
+        reader = QImageReader(buffer)
+    else:
+        reader = QImageReader(path)
+    reader.setAutoTransform(True)
+    img_size = reader.size()
+    if img_size.isValid() and (img_size.width() > size.width() or img_size.height() > size.height()):
+        reader.setScaledSize(img_size.scaled(size, QtCore.Qt.KeepAspectRatio))
+    return reader.read()
+
+
+class _Emitter(QObject):
+    """Deliver results from workers to the GUI thread.
+
+    It lives as long as the application, so that workers never emit signals
+    on a loader that has been deleted (e.g., when switching canvas).
+    """
+    decoded = QtCore.pyqtSignal(object, str, QImage)
+    skipped = QtCore.pyqtSignal(object, str)
+
+
+_emitter = None
+_pool = None
+
+
+def _get_emitter_and_pool():
+    global _emitter, _pool
+    if _emitter is None:
+        _emitter = _Emitter()
+        _pool = QThreadPool()
+    return _emitter, _pool
+
+
+class _LoaderState():
+    """States shared with workers. It is not a QObject, so workers can safely hold it."""
+
+    def __init__(self, size):
+        self.size = size
+        # None for all paths
+        self.wanted = None
+
+
+class _ThumbnailTask(QRunnable):
+
+    def __init__(self, state, path):
+        super(_ThumbnailTask, self).__init__()
+        self.state = state
+        self.path = path
+
+    def run(self):
+        emitter = _get_emitter_and_pool()[0]
+        wanted = self.state.wanted
+        if wanted is not None and self.path not in wanted:
+            # the cell has been scrolled away before the task starts
+            emitter.skipped.emit(self.state, self.path)
+            return
+        try:
+            qimg = read_thumbnail(self.path, self.state.size)
+        except Exception:
+            qimg = QImage()
+        emitter.decoded.emit(self.state, self.path, qimg)
+
+
+class ThumbnailLoader(QObject):
+    """Load thumbnails with a worker pool, and keep them in a bounded (LRU) cache.
+
+    Args:
+        size (QSize): Max thumbnail size.
+        cache_size (int): Max number of cached thumbnails. Default: 500.
+        parent (QObject): Parent. Default: None.
+    """
+    thumbnail_ready = QtCore.pyqtSignal(str)
+
+    def __init__(self, size, cache_size=500, parent=None):
+        super(ThumbnailLoader, self).__init__(parent)
+        self.size = size
+        self.cache_size = cache_size
+        self._state = _LoaderState(size)
+        # path -> QPixmap (null QPixmap for the images failing to decode)
+        self._cache = OrderedDict()
+        self._pending = set()
+
+        emitter, self.pool = _get_emitter_and_pool()
+        emitter.decoded.connect(self._on_decoded)
+        emitter.skipped.connect(self._on_skipped)
+
+    def get(self, path):
+        """Get a thumbnail. If it is not ready, schedule it and return None."""
+        pixmap = self._cache.get(path)
+        if pixmap is not None:
+            self._cache.move_to_end(path)
+            return pixmap
+        if self._state.wanted is not None:
+            self._state.wanted.add(path)
+        self.request(path)
+        return None
+
+    def request(self, path):
+        if path not in self._pending and path not in self._cache:
+            self._pending.add(path)
+            self.pool.start(_ThumbnailTask(self._state, path))
+
+    def clear(self):
+        """Clear cached thumbnails, e.g., when the images have been overwritten.
+        Results of the running tasks are dropped."""
+        self._state = _LoaderState(self.size)
+        self._cache.clear()
+        self._pending.clear()
+
+    def set_wanted(self, paths):
+        """Only decode the wanted paths (e.g., for the visible and near-visible cells).
+        Queued tasks for other paths are skipped."""
+        self._state.wanted = set(paths)
+        for path in paths:
+            self.request(path)
+
+    def _on_decoded(self, state, path, qimg):
+        if state is not self._state:
+            return
+        self._pending.discard(path)
+        self._cache[path] = QPixmap.fromImage(qimg)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        self.thumbnail_ready.emit(path)
+
+    def _on_skipped(self, state, path):
+        if state is self._state:
+            self._pending.discard(path)
@@ -1,10 +1,9 @@
 import os
 import re
 import sys
-from PIL import Image, ImageDraw
 
-FORMATS = ('.jpg', '.JPG', '.jpeg', '.JPEG', '.png', '.PNG', '.ppm', '.PPM', '.bmp', '.BMP', '.gif', '.GIF', '.tiff',
-           '.TIFF', '.webp', '.WEBP')
+FORMATS = ('.jpg', '.JPG', '.jpeg', '.JPEG', '.png', '.PNG', '.ppm', '.PPM', '.bmp', '.BMP', '.gif', '.GIF', '.tif',
+           '.TIF', '.tiff', '.TIFF', '.webp', '.WEBP', '.exr', '.EXR', '.hdr', '.HDR', '.npy', '.NPY', '.yuv', '.YUV')
 
 if getattr(sys, 'frozen', False):
     # If the application is run as a bundle, the PyInstaller bootloader
@@ -14,6 +13,9 @@ if getattr(sys, 'frozen', False):
 else:
     ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
+# folder for persistent caches, e.g., member index of tar archives
+CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'handyview')
+
 
 def sizeof_fmt(size, suffix='B'):
     """Get human readable file size.
@@ -34,7 +36,8 @@ def scandir(dir_path, suffix=None, recursive=False, full_path=False):
     """Scan a directory to find the interested files.
 
     Args:
-        dir_path (str): Path of the directory.
+        dir_path (str): Path of the directory. It can also be a (sub folder
+            in a) source, e.g., zip and tar archives.
         suffix (str | tuple(str), optional): File suffix that we are
             interested in. Default: None.
         recursive (bool, optional): If set to True, recursively scan the
@@ -51,6 +54,23 @@ def scandir(dir_path, suffix=None, recursive=False, full_path=False):
 
     root = dir_path
 
+    # avoid circular import
+    from handyview.sources import get_source
+    source, sub_folder = get_source(dir_path, refresh=True)
+
+    def _scan_source(sub_folder, suffix, recursive):
+        for name in source.listdir(sub_folder, recursive=recursive):
+            if os.path.basename(name).startswith('.'):
+                continue
+            return_path = name[len(sub_folder.strip('/')):].lstrip('/')
+            if full_path:
+                return_path = f'{root.rstrip("/")}/{return_path}'
+
+            if suffix is None:
+                yield return_path
+            elif return_path.endswith(suffix):
+                yield return_path
+
     def _scandir(dir_path, suffix, recursive):
         for entry in os.scandir(dir_path):
             if not entry.name.startswith('.') and entry.is_file():
@@ -69,6 +89,8 @@ def scandir(dir_path, suffix=None, recursive=False, full_path=False):
                 else:
                     continue
 
+    if source is not None:
+        return _scan_source(sub_folder, suffix=suffix, recursive=recursive)
     return _scandir(dir_path, suffix=suffix, recursive=recursive)
 
 
@@ -118,71 +140,3 @@ def get_img_list(folder, include_names=None, exclude_names=None, exact_exclude_n
     # natural sort for numbers in names
     img_list.sort(key=lambda s: [int(t) if t.isdigit() else t.lower() for t in re.split(r'(\d+)', s)])
     return img_list
-
-
-def crop_images(img_list,
-                rect_pos,
-                patch_folder,
-                enlarge_ratio=2,
-                interpolation='bicubic',
-                line_width=0,
-                color='yellow',
-                rect_folder=None):
-
-    color_tb = {}
-    # in BGR
-    # color_tb['yellow'] = (0, 255, 255)
-    # color_tb['green'] = (0, 255, 0)
-    # color_tb['red'] = (0, 0, 255)
-    # color_tb['magenta'] = (255, 0, 255)
-    # color_tb['matlab_blue'] = (189, 114, 0)
-    # color_tb['matlab_orange'] = (25, 83, 217)
-    # color_tb['matlab_yellow'] = (32, 177, 237)
-    # color_tb['matlab_purple'] = (142, 47, 126)
-    # color_tb['matlab_green'] = (48, 172, 119)
-    # color_tb['matlab_liblue'] = (238, 190, 77)
-    # color_tb['matlab_brown'] = (47, 20, 162)
-    # in RGB
-    color_tb['yellow'] = (255, 255, 0)
-    color_tb['green'] = (0, 255, 0)
-    color_tb['red'] = (255, 0, 0)
-    color_tb['magenta'] = (255, 0, 255)
-    color_tb['matlab_blue'] = (0, 114, 189)
-    color_tb['matlab_orange'] = (217, 83, 25)
-    color_tb['matlab_yellow'] = (237, 177, 32)
-    color_tb['matlab_purple'] = (126, 47, 142)
-    color_tb['matlab_green'] = (119, 172, 48)
-    color_tb['matlab_liblue'] = (77, 190, 238)
-    color_tb['matlab_brown'] = (162, 20, 47)
-    color = color_tb[color]
-
-    # make temp folder
-    os.makedirs(patch_folder, exist_ok=True)
-    if line_width > 0 and not os.path.exists(rect_folder):
-        os.makedirs(rect_folder)
-
-    start_h, start_w, len_h, len_w = rect_pos
-    for i, path in enumerate(img_list):
-        img = Image.open(path)
-        base_name = os.path.splitext(os.path.basename(path))[0]
-        # crop patch
-        patch = img.crop((start_w, start_h, start_w + len_w, start_h + len_h))
-
-        # enlarge patch if necessary
-        if enlarge_ratio > 1:
-            w, h = patch.size
-            if interpolation == 'bicubic':
-                interpolation = Image.BICUBIC
-            elif interpolation == 'bilinear':
-                interpolation = Image.BILINEAR
-            elif interpolation == 'nearest':
-                interpolation = Image.NEAREST
-            patch = patch.resize((w * enlarge_ratio, h * enlarge_ratio), resample=interpolation)
-        patch.save(os.path.join(patch_folder, base_name + '_patch.png'))
-
-        # draw rectangle
-        if line_width > 0:
-            img_rect = img.convert('RGB')
-            draw = ImageDraw.Draw(img_rect)
-            draw.rectangle(((start_w, start_h), (start_w + len_w, start_h + len_h)), outline=color, width=line_width)
-            img_rect.save(os.path.join(rect_folder, base_name + '_rect.png'))
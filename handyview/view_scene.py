@@ -3,9 +3,11 @@ We use the Graphics View Framework (https://doc.qt.io/qt-5/graphicsview.html)
 for our HandyView.
 """
 from PyQt5 import QtCore
-from PyQt5.QtCore import QPoint, QRect, QSize
-from PyQt5.QtGui import QColor, QFont, QFontMetrics, QTransform
-from PyQt5.QtWidgets import QApplication, QGraphicsScene, QGraphicsView, QRubberBand
+from PyQt5.QtCore import QLineF, QPoint, QRect, QRectF, QSize
+from PyQt5.QtGui import QColor, QFont, QFontMetrics, QPen, QTransform
+from PyQt5.QtWidgets import QApplication, QGraphicsItem, QGraphicsPixmapItem, QGraphicsScene, QGraphicsView, QRubberBand
+
+from handyview.pixel_overlay import PixelValueOverlay
 
 
 class HVView(QGraphicsView):
@@ -15,6 +17,8 @@ class HVView(QGraphicsView):
     Selection Rect: https://stackoverflow.com/questions/47102224/pyqt-draw-selection-rectangle-over-picture
     """
     zoom_signal = QtCore.pyqtSignal(float)
+    # emitted when the selection rect is changed
+    selection_signal = QtCore.pyqtSignal()
 
     def __init__(self, scene, parent=None, show_info=True):
         super(HVView, self).__init__(scene, parent)
@@ -45,6 +49,12 @@ class HVView(QGraphicsView):
         self.rect_top_left = (0, 0)
         self.setViewportUpdateMode(0)
 
+        # pixel values drawn on pixels at high zoom ratios
+        self.pixel_overlay = PixelValueOverlay()
+        # WipeItem of the wipe compare, set by the canvas
+        self.wipe_item = None
+        self.wipe_dragging = False
+
     def set_shown_text(self, text, color='green'):
         # text is a list, each item will be shown in a line
         if text is not None:
@@ -55,6 +65,7 @@ class HVView(QGraphicsView):
             self.shwon_text_color = QColor(220, 0, 0)
 
     def drawForeground(self, painter, rect):
+        self.pixel_overlay.draw(painter, rect, self.zoom)
         painter.resetTransform()  # not scale shown text
         painter.setFont(self.font)
         painter.setPen(self.shwon_text_color)
@@ -63,9 +74,21 @@ class HVView(QGraphicsView):
             for idx, text in enumerate(self.shown_text):
                 painter.drawText(margin, margin + self.text_height * (idx + 1), text)
 
+    def near_wipe_line(self, pos, modifiers):
+        """Whether a mouse press drags the wipe line: near the line, or anywhere with Alt pressed."""
+        if self.wipe_item is None or self.wipe_item.scene() is None:
+            return False
+        line_x = self.mapFromScene(self.wipe_item.split_x, 0).x()
+        return modifiers == QtCore.Qt.AltModifier or abs(pos.x() - line_x) <= 8
+
     def mousePressEvent(self, event):
         modifiers = QApplication.keyboardModifiers()
-        if modifiers == QtCore.Qt.ShiftModifier:
+        if event.button() == QtCore.Qt.LeftButton and self.near_wipe_line(event.pos(), modifiers):
+            self.wipe_dragging = True
+            # only repaint the region swept by the line, rather than the whole viewport
+            self.setViewportUpdateMode(QGraphicsView.MinimalViewportUpdate)
+            self.wipe_item.set_split(self.mapToScene(event.pos()).x(), self.zoom)
+        elif modifiers == QtCore.Qt.ShiftModifier:
             # Show rubber band
             self.rubber_band_origin = event.pos()
             self.rubber_band.setGeometry(QRect(self.rubber_band_origin, QSize()))
@@ -96,11 +119,12 @@ class HVView(QGraphicsView):
         if self.show_info:
             scene_pos = self.mapToScene(event.pos())
             x_scene, y_scene = scene_pos.x(), scene_pos.y()
-            self.show_mouse_position(x_scene, y_scene)
-            self.show_mouse_color(x_scene, y_scene)
+            self.parent.hover_inspector.hover(x_scene, y_scene)
 
         modifiers = QApplication.keyboardModifiers()
-        if modifiers == QtCore.Qt.ShiftModifier:
+        if self.wipe_dragging:
+            self.wipe_item.set_split(self.mapToScene(event.pos()).x(), self.zoom)
+        elif modifiers == QtCore.Qt.ShiftModifier:
             if event.buttons() == QtCore.Qt.LeftButton:
                 # Show selection rect position
                 if self.show_info:
@@ -115,7 +139,12 @@ class HVView(QGraphicsView):
 
     def mouseReleaseEvent(self, event):
         modifiers = QApplication.keyboardModifiers()
-        if modifiers == QtCore.Qt.ShiftModifier:
+        if self.wipe_dragging:
+            self.wipe_dragging = False
+            # shown text is at a fixed position in the viewport, which needs full updates when scrolling
+            self.setViewportUpdateMode(QGraphicsView.FullViewportUpdate)
+            self.parent.wipe_ratio = self.wipe_item.split_ratio()
+        elif modifiers == QtCore.Qt.ShiftModifier:
             self.rubber_band_changable = False
         else:
             QGraphicsView.mouseReleaseEvent(self, event)
@@ -139,34 +168,15 @@ class HVView(QGraphicsView):
                 self.zoom_out(emit_signal=False)
         elif modifiers == QtCore.Qt.ShiftModifier:
             if mouse > 0:
-                self.parent.dir_browse(-10)
+                self.parent.dir_browse(-10, coalesce=True)
             elif mouse < 0:
-                self.parent.dir_browse(10)
+                self.parent.dir_browse(10, coalesce=True)
         else:
             # Otherwise, show the next or previous image
             if mouse > 0:
-                self.parent.dir_browse(-1)
+                self.parent.dir_browse(-1, coalesce=True)
             elif mouse < 0:
-                self.parent.dir_browse(1)
-
-    def show_mouse_position(self, x_pos, y_pos):
-        """Show mouse position under the scene position (ignore the zoom)."""
-        self.parent.mouse_pos_label.setText(('Cursor position:\n (ignore zoom)\n'
-                                             f' Height(y): {y_pos:.1f}\n Width(x):  {x_pos:.1f}'))
-
-        # if cursor is out of image, the text will be red
-        if (0 < x_pos < self.scene().width and 0 < y_pos < self.scene().height):
-            self.parent.mouse_pos_label.setStyleSheet('QLabel {color : black;}')
-        else:
-            self.parent.mouse_pos_label.setStyleSheet('QLabel {color : red;}')
-
-    def show_mouse_color(self, x_pos, y_pos):
-        """Show mouse color with RGBA values."""
-        pixel = self.parent.qimg.pixel(int(x_pos), int(y_pos))
-        pixel_color = QColor(pixel)
-        self.parent.mouse_color_label.fill(pixel_color)
-        rgba = pixel_color.getRgb()  # 8 bit RGBA
-        self.parent.mouse_rgb_label.setText(f' ({rgba[0]:03d}, {rgba[1]:03d}, {rgba[2]:03d}, {rgba[3]:03d})')
+                self.parent.dir_browse(1, coalesce=True)
 
     def show_rect_position(self, x_start, y_start, x_end, y_end):
         """Show selection rect position."""
@@ -177,6 +187,7 @@ class HVView(QGraphicsView):
                                                 f' End  : {int(y_end)}, {int(x_end)}\n'
                                                 f' Len  : {int(y_len)}, {int(x_len)}')
         self.parent.db.selection_pos = [int(y_start), int(x_start), int(y_len), int(x_len)]
+        self.selection_signal.emit()
         width, height = self.scene().width, self.scene().height
         if (0 < x_start < width and 0 < y_start < height and 0 < x_end < width and 0 < y_end < height):
             self.parent.selection_pos_label.setStyleSheet('QLabel {color : black;}')
@@ -217,6 +228,49 @@ class HVView(QGraphicsView):
         self.setTransform(QTransform().scale(self.zoom, self.zoom).rotate(self.rotate))
 
 
+class WipeItem(QGraphicsPixmapItem):
+    """The compared image in a wipe compare, shown on the right of a split line over the current image.
+
+    Moving the line only updates the region swept by the line, and the pixmap is only painted in the exposed region.
+
+    Args:
+        pixmap (QPixmap): The compared image.
+        split_ratio (float): Position of the split line, relative to the image width. Default: 0.5.
+    """
+
+    def __init__(self, pixmap, split_ratio=0.5):
+        super(WipeItem, self).__init__(pixmap)
+        self.setFlag(QGraphicsItem.ItemUsesExtendedStyleOption)
+        self.split_x = split_ratio * pixmap.width()
+
+    def split_ratio(self):
+        return self.split_x / max(self.pixmap().width(), 1)
+
+    def set_split(self, x_pos, zoom=1):
+        """Move the split line to x_pos (in the scene). zoom is the zoom ratio of the view, for the line width."""
+        x_pos = min(max(x_pos, 0), self.pixmap().width())
+        if x_pos == self.split_x:
+            return
+        # the swept region, and the old and new lines (2 device pixels on each side)
+        margin = 2 / max(zoom, 1e-6)
+        left, right = min(x_pos, self.split_x) - margin, max(x_pos, self.split_x) + margin
+        self.split_x = x_pos
+        self.update(QRectF(left, 0, right - left, self.pixmap().height()))
+
+    def paint(self, painter, option, widget=None):
+        height = self.pixmap().height()
+        painter.save()
+        painter.setClipRect(
+            QRectF(self.split_x, 0,
+                   self.pixmap().width() - self.split_x, height).intersected(option.exposedRect),
+            QtCore.Qt.IntersectClip)
+        super(WipeItem, self).paint(painter, option, widget)
+        painter.restore()
+        # cosmetic pen: 1 device pixel in any zoom ratio
+        painter.setPen(QPen(QColor(255, 200, 0), 0))
+        painter.drawLine(QLineF(self.split_x, 0, self.split_x, height))
+
+
 class HVScene(QGraphicsScene):
     """A customized QGraphicsScene for HandyView.
     """
@@ -241,29 +295,11 @@ class HVScene(QGraphicsScene):
             # use canvas keyPressEvent for direction keys
             self.parent.keyPressEvent(event)
 
+    def keyReleaseEvent(self, event):
+        self.parent.keyReleaseEvent(event)
+
     def mouseMoveEvent(self, event):
         """It only works when NO mouse button is pressed."""
         # Show mouse position and color when mouse move without button pressed
         if self.show_info:
-            x_pos, y_pos = event.scenePos().x(), event.scenePos().y()
-            self.show_mouse_position(x_pos, y_pos)
-            self.show_mouse_color(x_pos, y_pos)
-
-    def show_mouse_position(self, x_pos, y_pos):
-        """Show mouse position under the scene position (ignore the zoom)."""
-        self.parent.mouse_pos_label.setText(('Cursor position:\n (ignore zoom)\n'
-                                             f' Height(y): {y_pos:.1f}\n Width(x):  {x_pos:.1f}'))
-
-        # if cursor is out of image, the text will be red
-        if (0 < x_pos < self.width and 0 < y_pos < self.height):
-            self.parent.mouse_pos_label.setStyleSheet('QLabel {color : black;}')
-        else:
-            self.parent.mouse_pos_label.setStyleSheet('QLabel {color : red;}')
-
-    def show_mouse_color(self, x_pos, y_pos):
-        """Show mouse color with RGBA values."""
-        pixel = self.parent.qimg.pixel(int(x_pos), int(y_pos))
-        pixel_color = QColor(pixel)
-        self.parent.mouse_color_label.fill(pixel_color)
-        rgba = pixel_color.getRgb()  # 8 bit RGBA
-        self.parent.mouse_rgb_label.setText(f' ({rgba[0]:03d}, {rgba[1]:03d}, {rgba[2]:03d}, {rgba[3]:03d})')
+            self.parent.hover_inspector.hover(event.scenePos().x(), event.scenePos().y())